@@ -0,0 +1,107 @@
+"""
+Benchmark the embedding codecs: memory, recall and search latency
+
+Usage:
+    python benchmark_embedding_codec.py [--faces 200000] [--queries 300] [--from-db]
+
+Recall is the share of queries whose best face (and best user) is the same
+as with the float32 matrix. With --from-db the enrolled faces are used,
+otherwise synthetic clustered embeddings.
+"""
+import argparse
+import time
+import numpy as np
+from config import settings
+from services.embedding_codec import CODECS, decode, encode, to_memory
+from services.face_index import FaceEmbeddingIndex, normalize_rows
+
+
+def synthetic_dataset(faces: int, faces_per_user: int, queries: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    users = max(1, faces // faces_per_user)
+    centers = normalize_rows(rng.normal(size=(users, 512)))
+    owners = np.repeat(np.arange(users), faces_per_user)[:faces]
+    enrolled = normalize_rows(centers[owners] + 0.04 * rng.normal(size=(len(owners), 512)))
+
+    query_owners = rng.choice(users, min(queries, users), replace=False)
+    query_vectors = normalize_rows(centers[query_owners] + 0.04 * rng.normal(size=(len(query_owners), 512)))
+    return enrolled, owners.astype(np.int64), query_vectors
+
+
+def database_dataset(queries: int, seed: int = 0):
+    from database import SessionLocal
+    from models.face import Face
+
+    db = SessionLocal()
+    try:
+        rows = db.query(Face.id, Face.user_id, Face.embedding, Face.embedding_codec).order_by(Face.id).all()
+    finally:
+        db.close()
+    if not rows:
+        raise SystemExit("No faces in the database")
+
+    enrolled = normalize_rows(np.vstack([decode(r.embedding, r.embedding_codec) for r in rows]))
+    owners = np.array([r.user_id for r in rows], dtype=np.int64)
+
+    # Queries: enrolled faces with a little noise (a new photo of the same person)
+    rng = np.random.default_rng(seed)
+    picks = rng.choice(len(enrolled), min(queries, len(enrolled)), replace=False)
+    query_vectors = normalize_rows(enrolled[picks] + 0.02 * rng.normal(size=(len(picks), enrolled.shape[1])))
+    return enrolled, owners, query_vectors
+
+
+def build_index(enrolled: np.ndarray, owners: np.ndarray, codec: str) -> FaceEmbeddingIndex:
+    index = FaceEmbeddingIndex()
+    face_ids = np.arange(1, len(enrolled) + 1, dtype=np.int64)
+    index._swap(to_memory(enrolled, codec), face_ids, owners)
+    index.loaded = True
+    return index
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare float32 / float16 / int8 embedding codecs")
+    parser.add_argument("--faces", type=int, default=200000)
+    parser.add_argument("--faces-per-user", type=int, default=4)
+    parser.add_argument("--queries", type=int, default=300)
+    parser.add_argument("--from-db", action="store_true", help="Use the enrolled faces instead of synthetic data")
+    args = parser.parse_args()
+
+    # Measure the plain matrix scan
+    settings.FACE_INDEX_BACKEND = "exact"
+    settings.FACE_TEMPLATE_K = 0
+
+    if args.from_db:
+        enrolled, owners, queries = database_dataset(args.queries)
+    else:
+        enrolled, owners, queries = synthetic_dataset(args.faces, args.faces_per_user, args.queries)
+    print(f"Faces: {len(enrolled)}, users: {len(np.unique(owners))}, queries: {len(queries)}\n")
+
+    reference = None
+    print(f"{'codec':<8} {'bytes/row':>9} {'memory MB':>10} {'round-trip cos':>15} "
+          f"{'face recall':>12} {'user recall':>12} {'mean ms':>8} {'p95 ms':>8}")
+
+    for codec in CODECS:
+        stored = [encode(vector, codec) for vector in enrolled[:1000]]
+        restored = normalize_rows(np.vstack([decode(data, codec) for data in stored]))
+        round_trip = np.sum(restored * enrolled[:1000], axis=1).min()
+
+        index = build_index(enrolled, owners, codec)
+        matrix = index._data[0]
+
+        results, latencies = [], []
+        for query in queries:
+            start = time.perf_counter()
+            results.append(index.search(query))
+            latencies.append((time.perf_counter() - start) * 1000)
+
+        if reference is None:
+            reference = results
+        face_recall = np.mean([a[0] == b[0] for a, b in zip(reference, results)])
+        user_recall = np.mean([a[1] == b[1] for a, b in zip(reference, results)])
+
+        print(f"{codec:<8} {len(stored[0]):>9} {matrix.nbytes / 1e6:>10.1f} {round_trip:>15.5f} "
+              f"{face_recall:>12.4f} {user_recall:>12.4f} {np.mean(latencies):>8.2f} {np.percentile(latencies, 95):>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
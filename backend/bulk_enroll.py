@@ -0,0 +1,71 @@
+"""
+Bulk face enrollment from a zip archive or a directory
+
+Usage:
+    python bulk_enroll.py photos.zip [--workers 4] [--batch-size 100] [--report report.json]
+    python bulk_enroll.py photos/ ...
+
+Layout: one folder per user named after the employee_id
+(photos/<employee_id>/<photo>.jpg) or images named <employee_id>.jpg.
+Images with no face or more than one face are rejected and listed in the report.
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+from config import settings
+from database import SessionLocal
+from services.enrollment_service import (
+    enrollment_service, iter_directory, iter_zip, count_directory_images, count_zip_images
+)
+from services.face_index import face_embedding_index
+
+
+async def run(source: str, workers: int, batch_size: int, report_path: str = None):
+    if os.path.isdir(source):
+        items, total = iter_directory(source), count_directory_images(source)
+    else:
+        items, total = iter_zip(source), count_zip_images(source)
+
+    print(f"📦 {total} ta rasm topildi: {source}")
+    os.makedirs(os.path.join(settings.UPLOAD_DIR, "faces"), exist_ok=True)
+
+    started = time.perf_counter()
+    summary = None
+    db = SessionLocal()
+    try:
+        async for event in enrollment_service.enroll(db, items, total=total, workers=workers, batch_size=batch_size):
+            if event["type"] == "summary":
+                summary = event
+            elif event["status"] != "ok":
+                print(f"  ⚠️  {event['file']}: {event['status']}")
+            elif event["processed"] % 50 == 0:
+                print(f"  {event['processed']}/{total} ta rasm...")
+    finally:
+        db.close()
+
+    elapsed = time.perf_counter() - started
+    print(f"\n🎉 Yakunlandi: {summary['total']} ta rasm, {elapsed:.1f} s ({summary['total'] / max(elapsed, 1e-9):.1f} rasm/s)")
+    for status_name, count in sorted(summary["counts"].items()):
+        print(f"  {status_name}: {count}")
+
+    if report_path:
+        with open(report_path, "w") as f:
+            json.dump(summary, f, indent=2, ensure_ascii=False)
+        print(f"📝 Hisobot: {report_path}")
+
+    if settings.FACE_INDEX_SNAPSHOT and summary["counts"].get("ok"):
+        # Running servers map the new snapshot without a restart
+        face_embedding_index._publish_snapshot()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Enroll faces from a zip archive or a directory")
+    parser.add_argument("source", help="Zip archive or directory")
+    parser.add_argument("--workers", type=int, default=None, help="Images processed in parallel (default: inference pool size)")
+    parser.add_argument("--batch-size", type=int, default=100, help="Faces inserted per transaction")
+    parser.add_argument("--report", default=None, help="Write the summary with every failure to this JSON file")
+    args = parser.parse_args()
+
+    asyncio.run(run(args.source, args.workers, max(1, args.batch_size), args.report))
@@ -32,9 +32,90 @@ class Settings(BaseSettings):
     FACE_MATCH_THRESHOLD: float = 0.4  # 0.5 o'rniga 0.4 (osonroq tanish)
     FACE_DETECTION_THRESHOLD: float = 0.6
     
+    # Inference
+    PRELOAD_MODEL: bool = False  # Load and warm up the model in the background at startup
+    INFERENCE_WORKERS: int = 1  # Parallel InsightFace sessions (each holds its own models), 0 = number of CPU cores
+    INFERENCE_MAX_QUEUE: int = 64  # Frames allowed to wait before uploads get 503
+    INFERENCE_BATCH_MAX_SIZE: int = 8  # Frames per recognition batch, 1 = no batching
+    INFERENCE_BATCH_MAX_WAIT_MS: float = 5.0  # How long a batch waits for more frames
+    
+    # Memory budget mode
+    MODEL_IDLE_UNLOAD_MINUTES: int = 0  # Unload the model after this long without requests, 0 = never
+    MODEL_PRELOAD_BEFORE_SCHEDULE_MINUTES: int = 0  # Load the model this long before today's first lesson, 0 = off
+    
+    # ONNX Runtime profile: 'default' (InsightFace sessions), 'throughput', 'latency' or 'low_memory'
+    ONNX_PROFILE: str = "default"
+    ONNX_INTRA_OP_THREADS: int = 0  # 0 = profile default
+    ONNX_INTER_OP_THREADS: int = 0  # 0 = profile default
+    ONNX_GRAPH_OPTIMIZATION: str = ""  # 'disable', 'basic', 'extended' or 'all'
+    ONNX_ENABLE_MEM_ARENA: Optional[bool] = None
+    ONNX_OPTIMIZED_MODEL_DIR: str = ""  # Serialized pre-optimized models, e.g. ./data/onnx
+    FACE_RECOGNITION_MODEL_PATH: str = ""  # Custom recognition model, e.g. INT8 from quantize_model.py
+    
+    # Pre-cropped face fast path (detection at a reduced input size)
+    FACE_CROP_DET_SIZE: int = 128
+    FACE_CROP_MIN_DET_SCORE: float = 0.7  # Below this, fall back to full detection
+    
+    # Near-duplicate frame cache (per device)
+    FRAME_CACHE_TTL_SECONDS: float = 0.0  # Answer near-identical faceless frames "no face" this long, 0 = off
+    FRAME_CACHE_MAX_DISTANCE: int = 2  # Max differing dHash bits (out of 64) for a near-duplicate
+    FRAME_CACHE_ENTRIES_PER_DEVICE: int = 4
+    
+    # Pre-filter before detection (services/frame_filter.py)
+    FRAME_FILTER_ENABLED: bool = False  # Opt-in: tune the thresholds on the deployment's cameras first
+    FRAME_FILTER_SIZE: int = 160  # Long side of the grayscale copy the checks run on
+    FRAME_FILTER_MIN_BRIGHTNESS: float = 30.0  # Mean gray level (0-255)
+    FRAME_FILTER_MAX_BRIGHTNESS: float = 240.0
+    FRAME_FILTER_MIN_SHARPNESS: float = 15.0  # Variance of the Laplacian, 0 = no blur check
+    FRAME_FILTER_HAAR: bool = False  # Also require a Haar cascade face (full frames only)
+    
+    # Idempotent upload replay
+    IDEMPOTENCY_BACKEND: str = "memory"  # memory (per process), database (shared by workers) or off
+    IDEMPOTENCY_TTL_SECONDS: int = 120  # How long a retry gets the stored response
+    IDEMPOTENCY_MAX_ENTRIES: int = 2048  # LRU size of the memory backend
+    
+    # Candidate narrowing: match students with a lesson right now first
+    FACE_CANDIDATE_NARROWING: bool = True
+    FACE_CANDIDATE_MATCH_ROOM: bool = True  # Prefer the lesson held in the device's location (room)
+    
+    # Embedding storage
+    EMBEDDING_CODEC: str = "float32"  # faces.embedding format for new rows: float32, float16 or int8
+    EMBEDDING_MEMORY_CODEC: str = ""  # In-memory face index format, empty = same as EMBEDDING_CODEC
+    
+    # Face index
+    INDEX_DIR: str = "./data"  # Persisted search indexes (not served like uploads)
+    FACE_INDEX_BACKEND: str = "exact"  # 'exact', 'ivf' or 'hnsw' (needs hnswlib)
+    FACE_INDEX_MIN_SIZE: int = 20000  # Below this many faces the exact scan is used
+    FACE_INDEX_RERANK: int = 64  # ANN candidates re-scored exactly
+    FACE_INDEX_IVF_LISTS: int = 0  # 0 = sqrt(number of faces)
+    FACE_INDEX_IVF_PROBES: int = 32
+    FACE_INDEX_IVF_RETRAIN_GROWTH: float = 2.0  # Retrain centroids when the index grows/shrinks by this factor
+    FACE_INDEX_HNSW_M: int = 16
+    FACE_INDEX_HNSW_EF: int = 64
+    FACE_INDEX_SNAPSHOT: bool = True  # Share the index between workers via a memory-mapped file in INDEX_DIR
+    FACE_INDEX_SNAPSHOT_DELAY_SECONDS: float = 2.0  # Enrolment changes are batched this long before a snapshot is written
+    FACE_INDEX_SNAPSHOT_CHECK_SECONDS: float = 2.0  # How often workers look for a newer snapshot
+    FACE_TEMPLATE_K: int = 3  # Exemplar faces kept per user for matching, 0 = compare every image
+    FACE_TEMPLATE_TOP_USERS: int = 8  # Users whose exemplars are re-checked after the centroid pass
+    
+    # Re-embedding after a model change (POST /api/face/model/reembed)
+    REEMBED_BATCH_SIZE: int = 64  # Faces embedded and committed per batch
+    REEMBED_WORKERS: int = 2  # Sessions of the new model used by the job (extra memory while it runs)
+    
+    # Aligned face crops (services/crop_store.py): re-embedding without detection
+    CROP_DIR: str = "./data/crops"
+    STORE_FACE_CROPS: bool = True  # Keep the aligned crop of every enrolled face
+    STORE_ATTENDANCE_CROPS: bool = True  # Append recognition crops to a daily file
+    SAVE_ATTENDANCE_FRAMES: bool = True  # Also keep the full frame in uploads/attendance
+    
     # File Upload
     UPLOAD_DIR: str = "./uploads"
     MAX_UPLOAD_SIZE: int = 10485760  # 10MB
+    MAX_BULK_UPLOAD_SIZE: int = 524288000  # 500MB, zip archives for /api/face/register/bulk
+    IMAGE_WRITER_QUEUE_SIZE: int = 256  # Images waiting for the background writer; when full, new images are dropped (no path recorded)
+    IMAGE_WRITER_BATCH_SIZE: int = 32  # Images written and fsynced together
+    IMAGE_WRITER_FSYNC: bool = True
+    FACE_DECODE_MIN_SIDE: int = 640  # Large JPEGs are decoded at 1/2-1/8 scale down to this long side, 0 = full size
     
     # Server
     HOST: str = "0.0.0.0"
@@ -47,6 +128,11 @@ class Settings(BaseSettings):
     # Attendance
     LATE_THRESHOLD_MINUTES: int = 30
     WORK_START_TIME: str = "09:00"
+    DUPLICATE_CHECK_MINUTES: int = 60  # Used when no time settings are saved
+    ATTENDANCE_WRITE_BEHIND: bool = False  # Buffer attendance writes in memory (single worker only)
+    ATTENDANCE_FLUSH_INTERVAL_MS: int = 500  # Buffered attendance is written at least this often
+    ATTENDANCE_FLUSH_BATCH_SIZE: int = 100  # ... or as soon as this many records are waiting
+    ATTENDANCE_FLUSH_MAX_RETRIES: int = 5  # Failed writes of one record before it is logged and dropped
     
     # Frontend
     FRONTEND_URL: str = "http://localhost:3000"
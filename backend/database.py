@@ -33,6 +33,22 @@ def get_db() -> Generator[Session, None, None]:
         db.close()
 
 
+def ping_database() -> float:
+    """
+    Run a trivial query against the database
+    
+    Returns:
+        Round-trip latency in milliseconds (raises if the database is unreachable)
+    """
+    import time
+    from sqlalchemy import text
+    
+    start = time.perf_counter()
+    with engine.connect() as conn:
+        conn.execute(text("SELECT 1"))
+    return (time.perf_counter() - start) * 1000
+
+
 def init_db():
     """
     Initialize database - create all tables and default admin if needed
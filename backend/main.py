@@ -37,6 +37,19 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Image uploads larger than MAX_UPLOAD_SIZE are refused before the body is read
+from middleware.body_limit import BodySizeLimitMiddleware
+app.add_middleware(
+    BodySizeLimitMiddleware,
+    max_size=settings.MAX_UPLOAD_SIZE,
+    paths=("/api/face/upload", "/api/face/register"),
+)
+app.add_middleware(
+    BodySizeLimitMiddleware,
+    max_size=settings.MAX_BULK_UPLOAD_SIZE,
+    paths=("/api/face/register/bulk",),
+)
+
 # Import routes
 # Import routes
 from routes.auth_routes import router as auth_router
@@ -73,11 +86,14 @@ async def startup_event():
     try:
         # Run migrations first
         from database import engine
-        from utils.migrations import migrate_users_table, migrate_schedules_table
+        from utils.migrations import migrate_users_table, migrate_schedules_table, migrate_devices_table, migrate_faces_table, migrate_attendance_table
         
         logger.info("Running database migrations...")
         migrate_users_table(engine)
         migrate_schedules_table(engine)
+        migrate_devices_table(engine)
+        migrate_faces_table(engine, settings.INSIGHTFACE_MODEL)
+        migrate_attendance_table(engine)
         
         # Add password_hash column migration
         try:
@@ -162,7 +178,30 @@ async def startup_event():
         logger.error(f"Failed to start Telegram bot: {e}")
     
     # Services are initialized lazily when needed
-    logger.info("Services configured for lazy loading")
+    if settings.PRELOAD_MODEL:
+        try:
+            import asyncio
+            from services.face_recognition_service import face_recognition_service
+            
+            async def preload_model():
+                try:
+                    await face_recognition_service.pool.run(face_recognition_service.warm_up)
+                except Exception as e:
+                    logger.error(f"Model preload failed: {e}")
+            
+            asyncio.create_task(preload_model())
+            logger.info("Face recognition model preload started in background")
+        except Exception as e:
+            logger.error(f"Failed to start model preload: {e}")
+    else:
+        logger.info("Services configured for lazy loading")
+    
+    # Idle unload / preload before lessons (memory budget mode)
+    try:
+        from services.model_lifecycle import model_lifecycle
+        model_lifecycle.start()
+    except Exception as e:
+        logger.error(f"Failed to start model lifecycle watchdog: {e}")
 
 
 @app.on_event("shutdown")
@@ -176,6 +215,28 @@ async def shutdown_event():
         await telegram_service.stop_polling()
     except Exception as e:
         logger.error(f"Failed to stop Telegram bot: {e}")
+    
+    try:
+        from services.model_lifecycle import model_lifecycle
+        await model_lifecycle.stop()
+    except Exception as e:
+        logger.error(f"Failed to stop model lifecycle watchdog: {e}")
+    
+    # Write buffered attendance before the process exits
+    try:
+        import asyncio
+        from services.attendance_buffer import attendance_buffer
+        await asyncio.to_thread(attendance_buffer.stop)
+    except Exception as e:
+        logger.error(f"Failed to flush attendance buffer: {e}")
+    
+    # Write the images still queued
+    try:
+        import asyncio
+        from services.image_writer import image_writer
+        await asyncio.to_thread(image_writer.stop)
+    except Exception as e:
+        logger.error(f"Failed to flush image writer: {e}")
 
 
 @app.get("/")
@@ -188,16 +249,61 @@ async def root():
     }
 
 
+async def _check_database() -> dict:
+    """Ping the database without blocking the event loop"""
+    import asyncio
+    from database import ping_database
+    
+    try:
+        latency_ms = await asyncio.to_thread(ping_database)
+        return {"status": "connected", "latency_ms": round(latency_ms, 2)}
+    except Exception as e:
+        logger.error(f"Database ping failed: {e}")
+        return {"status": "error", "error": str(e)}
+
+
 @app.get("/health")
 async def health_check():
-    """Health check endpoint"""
+    """Health check endpoint - reports the actual database and model state"""
+    from services.face_recognition_service import face_recognition_service
+    
+    database = await _check_database()
+    face_recognition = face_recognition_service.status()
+    
+    healthy = database["status"] == "connected" and face_recognition["state"] != "error"
     return {
-        "status": "healthy",
-        "database": "connected",
-        "face_recognition": "loaded"
+        "status": "healthy" if healthy else "unhealthy",
+        "database": database,
+        "face_recognition": face_recognition
     }
 
 
+@app.get("/ready")
+async def readiness_check():
+    """
+    Readiness probe for load balancers
+    
+    Returns 503 until the database answers and, when PRELOAD_MODEL is on,
+    the face recognition model has been loaded.
+    """
+    from fastapi.responses import JSONResponse
+    from services.face_recognition_service import face_recognition_service
+    
+    database = await _check_database()
+    face_recognition = face_recognition_service.status()
+    
+    ready = database["status"] == "connected" and face_recognition["ready"]
+    
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={
+            "ready": ready,
+            "database": database,
+            "face_recognition": face_recognition
+        }
+    )
+
+
 @app.post("/api/telegram/webhook")
 async def telegram_webhook(request: Request):
     """Handle incoming Telegram updates via Webhook"""
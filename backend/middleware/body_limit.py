@@ -0,0 +1,60 @@
+"""
+Request body size limit for image uploads
+"""
+from starlette.exceptions import HTTPException
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+# Multipart boundaries and part headers on top of the file itself
+MULTIPART_OVERHEAD = 64 * 1024
+
+
+class BodySizeLimitMiddleware:
+    """
+    Reject oversized request bodies on the given paths before they are read
+
+    A Content-Length above the limit is answered with 413 without touching the
+    body. Bodies without a length (chunked) are counted while they stream in
+    and aborted with 413 as soon as they cross the limit, so an oversized
+    upload is never spooled to disk or held in memory in full.
+    """
+
+    def __init__(self, app: ASGIApp, max_size: int, paths: tuple):
+        self.app = app
+        self.max_size = max_size + MULTIPART_OVERHEAD
+        self.paths = set(paths)
+
+    def _too_large(self) -> HTTPException:
+        return HTTPException(status_code=413, detail=f"Upload exceeds {self.max_size - MULTIPART_OVERHEAD} bytes")
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        for name, value in scope.get("headers", []):
+            if name == b"content-length":
+                try:
+                    length = int(value)
+                except ValueError:
+                    length = 0
+                if length > self.max_size:
+                    error = self._too_large()
+                    response = JSONResponse({"detail": error.detail}, status_code=error.status_code)
+                    await response(scope, receive, send)
+                    return
+                break
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_size:
+                    # Re-raised by FastAPI's body parsing and turned into a 413 response
+                    raise self._too_large()
+            return message
+
+        await self.app(scope, limited_receive, send)
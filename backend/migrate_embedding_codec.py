@@ -0,0 +1,58 @@
+"""
+Migration: re-encode stored face embeddings with settings.EMBEDDING_CODEC
+
+Usage:
+    python migrate_embedding_codec.py [--codec float16] [--batch-size 500]
+
+Adds the faces.embedding_codec column if needed, then converts every row
+that is not in the target codec yet. Safe to run again after an interruption.
+"""
+import argparse
+from config import settings
+from database import SessionLocal, engine
+from models.face import Face
+from services.embedding_codec import check_codec, decode, encode
+from utils.migrations import migrate_faces_table
+
+
+def migrate(codec: str, batch_size: int):
+    migrate_faces_table(engine, settings.INSIGHTFACE_MODEL)
+
+    db = SessionLocal()
+    converted = 0
+    try:
+        last_id = 0
+        while True:
+            faces = db.query(Face).filter(
+                Face.id > last_id,
+                (Face.embedding_codec == None) | (Face.embedding_codec != codec)
+            ).order_by(Face.id).limit(batch_size).all()
+            if not faces:
+                break
+
+            for face in faces:
+                embedding = decode(face.embedding, face.embedding_codec)
+                face.embedding = encode(embedding, codec)
+                face.embedding_codec = codec
+            db.commit()
+
+            converted += len(faces)
+            last_id = faces[-1].id
+            print(f"  {converted} ta embedding o'zgartirildi...")
+    except Exception as e:
+        db.rollback()
+        print(f"❌ Xato: {e}")
+        raise
+    finally:
+        db.close()
+
+    print(f"\n🎉 Migratsiya yakunlandi: {converted} ta embedding -> {codec}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Re-encode face embeddings")
+    parser.add_argument("--codec", default=settings.EMBEDDING_CODEC, help="float32, float16 or int8")
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+
+    migrate(check_codec(args.codec), args.batch_size)
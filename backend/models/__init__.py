@@ -1,10 +1,12 @@
 from .user import User
 from .device import Device
 from .face import Face
+from .face_embedding import FaceEmbedding
 from .attendance import Attendance
 from .api_key import APIKey
 from .group import Group
 from .time_settings import TimeSettings
 from .schedule import Schedule
+from .upload_response import UploadResponse
 
-__all__ = ["User", "Device", "Face", "Attendance", "APIKey", "Group", "TimeSettings", "Schedule"]
+__all__ = ["User", "Device", "Face", "FaceEmbedding", "Attendance", "APIKey", "Group", "TimeSettings", "Schedule", "UploadResponse"]
@@ -1,7 +1,7 @@
 """
 Attendance model
 """
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, Float, Date, DateTime, ForeignKey, UniqueConstraint
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from database import Base
@@ -9,11 +9,14 @@ from database import Base
 
 class Attendance(Base):
     __tablename__ = "attendance"
+    # One record per lesson occurrence; concurrent check-ins upsert into it
+    __table_args__ = (UniqueConstraint("user_id", "schedule_id", "session_date", name="uq_attendance_session"),)
     
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     device_id = Column(Integer, ForeignKey("devices.id"))
     schedule_id = Column(Integer, ForeignKey("schedules.id", ondelete="CASCADE"), nullable=True)  # Link to class schedule
+    session_date = Column(Date, nullable=True)  # Local date of the lesson occurrence (NULL without a schedule)
     check_in_time = Column(DateTime(timezone=True), server_default=func.now(), index=True)
     confidence = Column(Float)
     image_path = Column(String(500))
@@ -38,6 +41,7 @@ class Attendance(Base):
             "device_name": self.device.device_name if self.device else None,
             "schedule_id": self.schedule_id,
             "schedule_name": self.schedule.name if self.schedule else None,
+            "session_date": self.session_date.isoformat() if self.session_date else None,
             "check_in_time": self.check_in_time.isoformat() if self.check_in_time else None,
             "confidence": self.confidence,
             "image_path": self.image_path,
@@ -14,6 +14,7 @@ class Device(Base):
     device_name = Column(String(100), nullable=False)
     api_key = Column(String(255), unique=True, nullable=False, index=True)
     location = Column(String(255))
+    precropped_faces = Column(Boolean, default=False)  # Device sends already cropped faces
     is_active = Column(Boolean, default=True)
     last_seen = Column(DateTime(timezone=True))
     created_at = Column(DateTime(timezone=True), server_default=func.now())
@@ -26,6 +27,7 @@ class Device(Base):
             "id": self.id,
             "device_name": self.device_name,
             "location": self.location,
+            "precropped_faces": self.precropped_faces,
             "is_active": self.is_active,
             "last_seen": self.last_seen.isoformat() if self.last_seen else None,
             "created_at": self.created_at.isoformat() if self.created_at else None
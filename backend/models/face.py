@@ -13,16 +13,20 @@ class Face(Base):
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
     embedding = Column(LargeBinary, nullable=False)  # numpy array as bytes
+    embedding_codec = Column(String(16), default="float32")  # float32, float16 or int8 (see services/embedding_codec.py)
+    model_name = Column(String(64), index=True)  # InsightFace model pack that produced the embedding
     image_path = Column(String(500))
     registered_at = Column(DateTime(timezone=True), server_default=func.now())
     
     # Relationships
     user = relationship("User", back_populates="faces")
+    model_embeddings = relationship("FaceEmbedding", back_populates="face", cascade="all, delete-orphan")
     
     def to_dict(self):
         return {
             "id": self.id,
             "user_id": self.user_id,
             "image_path": self.image_path,
+            "model_name": self.model_name,
             "registered_at": self.registered_at.isoformat() if self.registered_at else None
         }
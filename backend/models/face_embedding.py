@@ -0,0 +1,25 @@
+"""
+Face Embedding model - embeddings of an enrolled face produced by another recognition model
+"""
+from sqlalchemy import Column, Integer, String, LargeBinary, DateTime, ForeignKey, UniqueConstraint
+from sqlalchemy.orm import relationship
+from sqlalchemy.sql import func
+from database import Base
+
+
+class FaceEmbedding(Base):
+    __tablename__ = "face_embeddings"
+    __table_args__ = (UniqueConstraint("face_id", "model_name", name="uq_face_embeddings_face_model"),)
+    
+    id = Column(Integer, primary_key=True, index=True)
+    face_id = Column(Integer, ForeignKey("faces.id", ondelete="CASCADE"), nullable=False, index=True)
+    model_name = Column(String(64), nullable=False, index=True)  # InsightFace model pack, e.g. buffalo_l
+    embedding = Column(LargeBinary, nullable=False)
+    embedding_codec = Column(String(16), default="float32")
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    
+    # Relationships
+    face = relationship("Face", back_populates="model_embeddings")
+    
+    def __repr__(self):
+        return f"<FaceEmbedding face={self.face_id} model={self.model_name}>"
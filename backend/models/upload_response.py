@@ -0,0 +1,18 @@
+"""
+Upload Response model - stored responses for idempotent device upload replay
+"""
+from sqlalchemy import Column, Integer, String, Text, DateTime
+from database import Base
+from datetime import datetime
+
+
+class UploadResponse(Base):
+    __tablename__ = "upload_responses"
+    
+    key = Column(String(64), primary_key=True)  # sha256 of device id + request id (or image bytes)
+    device_id = Column(Integer, nullable=False)
+    response = Column(Text, nullable=False)  # JSON body returned to the device
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False, index=True)
+    
+    def __repr__(self):
+        return f"<UploadResponse {self.key[:12]} device={self.device_id}>"
@@ -0,0 +1,161 @@
+"""
+Build an INT8-quantized recognition model and report its accuracy delta
+
+Usage:
+    python quantize_model.py [--output ./data/onnx/recognition_int8.onnx] [--limit 500]
+
+The enrolled face images (faces.image_path) are used both as calibration data
+and as the evaluation set. Afterwards set FACE_RECOGNITION_MODEL_PATH to the
+output file to serve the quantized model.
+"""
+import argparse
+import os
+import time
+import cv2
+import numpy as np
+import onnxruntime as ort
+from onnxruntime.quantization import (
+    CalibrationDataReader, QuantFormat, QuantType, quantize_dynamic, quantize_static
+)
+from insightface.app import FaceAnalysis
+from insightface.model_zoo.arcface_onnx import ArcFaceONNX
+from insightface.utils import face_align
+from config import settings
+from database import SessionLocal
+from models.face import Face
+
+MIN_CALIBRATION_CROPS = 32
+
+
+def load_aligned_crops(app, limit):
+    """Detect and align the enrolled face images"""
+    db = SessionLocal()
+    try:
+        rows = db.query(Face.id, Face.user_id, Face.image_path).filter(
+            Face.image_path.isnot(None)
+        ).order_by(Face.id).limit(limit).all()
+    finally:
+        db.close()
+
+    rec_model = app.models['recognition']
+    crops, user_ids = [], []
+    for row in rows:
+        if not os.path.exists(row.image_path):
+            continue
+        image = cv2.imread(row.image_path)
+        if image is None:
+            continue
+        bboxes, kpss = app.det_model.detect(image, max_num=1, metric='default')
+        if bboxes is None or len(bboxes) == 0:
+            continue
+        crops.append(face_align.norm_crop(image, landmark=kpss[0], image_size=rec_model.input_size[0]))
+        user_ids.append(row.user_id)
+
+    return crops, np.array(user_ids)
+
+
+class CropDataReader(CalibrationDataReader):
+    def __init__(self, rec_model, crops):
+        self._blobs = iter([
+            {rec_model.input_name: cv2.dnn.blobFromImages(
+                [crop], 1.0 / rec_model.input_std, rec_model.input_size,
+                (rec_model.input_mean,) * 3, swapRB=True
+            )}
+            for crop in crops
+        ])
+
+    def get_next(self):
+        return next(self._blobs, None)
+
+
+def embed(rec_model, crops):
+    embeddings = np.vstack([rec_model.get_feat(crop) for crop in crops]).astype(np.float32)
+    return embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+
+def identification_accuracy(embeddings, user_ids):
+    """Leave-one-out nearest-neighbour accuracy over users with 2+ images"""
+    scores = embeddings @ embeddings.T
+    np.fill_diagonal(scores, -np.inf)
+    counts = np.bincount(user_ids) if len(user_ids) else np.array([])
+    probes = [i for i, u in enumerate(user_ids) if counts[u] > 1]
+    if not probes:
+        return None
+    hits = sum(user_ids[int(np.argmax(scores[i]))] == user_ids[i] for i in probes)
+    return hits / len(probes)
+
+
+def time_per_crop(rec_model, crops):
+    start = time.perf_counter()
+    for crop in crops:
+        rec_model.get_feat(crop)
+    return (time.perf_counter() - start) * 1000 / max(1, len(crops))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Quantize the recognition model to INT8")
+    parser.add_argument("--output", default=os.path.join(settings.INDEX_DIR, "onnx", "recognition_int8.onnx"))
+    parser.add_argument("--limit", type=int, default=1000, help="Max enrolled images to use")
+    args = parser.parse_args()
+
+    print(f"Loading InsightFace model: {settings.INSIGHTFACE_MODEL}")
+    app = FaceAnalysis(
+        name=settings.INSIGHTFACE_MODEL,
+        allowed_modules=['detection', 'recognition'],
+        providers=['CPUExecutionProvider']
+    )
+    app.prepare(ctx_id=0, det_size=(320, 320))
+    fp32_model = app.models['recognition']
+    print(f"FP32 recognition model: {fp32_model.model_file}")
+
+    crops, user_ids = load_aligned_crops(app, args.limit)
+    print(f"Aligned enrolled faces: {len(crops)}")
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    if len(crops) >= MIN_CALIBRATION_CROPS:
+        print("Static INT8 quantization (QDQ) calibrated on enrolled faces...")
+        quantize_static(
+            fp32_model.model_file,
+            args.output,
+            CropDataReader(fp32_model, crops),
+            quant_format=QuantFormat.QDQ,
+            activation_type=QuantType.QInt8,
+            weight_type=QuantType.QInt8,
+            per_channel=True
+        )
+    else:
+        print(f"Fewer than {MIN_CALIBRATION_CROPS} faces for calibration, using dynamic quantization...")
+        quantize_dynamic(fp32_model.model_file, args.output, weight_type=QuantType.QInt8)
+    print(f"INT8 model written: {args.output}")
+
+    if not crops:
+        print("No enrolled faces available - accuracy delta not measured")
+        return
+
+    int8_session = ort.InferenceSession(args.output, providers=['CPUExecutionProvider'])
+    int8_model = ArcFaceONNX(model_file=args.output, session=int8_session)
+
+    fp32_embeddings = embed(fp32_model, crops)
+    int8_embeddings = embed(int8_model, crops)
+    agreement = np.sum(fp32_embeddings * int8_embeddings, axis=1)
+
+    print("\n=== Accuracy delta (INT8 vs FP32) ===")
+    print(f"Embedding cosine FP32~INT8: mean={agreement.mean():.4f} min={agreement.min():.4f}")
+
+    fp32_accuracy = identification_accuracy(fp32_embeddings, user_ids)
+    int8_accuracy = identification_accuracy(int8_embeddings, user_ids)
+    if fp32_accuracy is None:
+        print("Identification accuracy: needs users with 2+ enrolled images")
+    else:
+        print(f"Identification accuracy: FP32={fp32_accuracy:.4f} INT8={int8_accuracy:.4f} "
+              f"delta={int8_accuracy - fp32_accuracy:+.4f}")
+
+    sample = crops[:100]
+    fp32_ms = time_per_crop(fp32_model, sample)
+    int8_ms = time_per_crop(int8_model, sample)
+    print(f"Latency per face: FP32={fp32_ms:.2f} ms INT8={int8_ms:.2f} ms ({fp32_ms / int8_ms:.2f}x)")
+    print(f"\nTo use it: FACE_RECOGNITION_MODEL_PATH={args.output}")
+
+
+if __name__ == "__main__":
+    main()
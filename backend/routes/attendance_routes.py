@@ -23,6 +23,16 @@ async def attendance_health():
     return {"status": "ok", "router": "attendance"}
 
 
+@router.get("/buffer/stats")
+async def get_attendance_buffer_stats():
+    """Write-behind buffer state (pending records, flushes)"""
+    from services.attendance_buffer import attendance_buffer
+    return {
+        "success": True,
+        **attendance_buffer.stats()
+    }
+
+
 @router.get("")
 async def get_attendance(
     start_date: Optional[str] = None,
@@ -19,12 +19,14 @@ router = APIRouter(prefix="/api/devices", tags=["Devices"])
 class DeviceCreate(BaseModel):
     device_name: str
     location: Optional[str] = None
+    precropped_faces: bool = False
 
 
 class DeviceUpdate(BaseModel):
     device_name: Optional[str] = None
     location: Optional[str] = None
     is_active: Optional[bool] = None
+    precropped_faces: Optional[bool] = None
 
 
 @router.get("")
@@ -73,6 +75,7 @@ async def create_device(device_data: DeviceCreate, db: Session = Depends(get_db)
     device = Device(
         device_name=device_data.device_name,
         location=device_data.location,
+        precropped_faces=device_data.precropped_faces,
         api_key=api_key,
         last_seen=datetime.now()
     )
@@ -112,6 +115,8 @@ async def update_device(
         device.location = device_data.location
     if device_data.is_active is not None:
         device.is_active = device_data.is_active
+    if device_data.precropped_faces is not None:
+        device.precropped_faces = device_data.precropped_faces
     
     db.commit()
     db.refresh(device)
@@ -1,20 +1,35 @@
 """
 Face Recognition Routes
 """
-from fastapi import APIRouter, Depends, File, UploadFile, HTTPException, status, Header
+from fastapi import APIRouter, Depends, File, UploadFile, HTTPException, status, Header, Response
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
-from database import get_db
+from database import get_db, SessionLocal
 from models.user import User
 from models.face import Face
 from models.device import Device
 from services.face_recognition_service import face_recognition_service
+from services.face_index import face_embedding_index
+from services.inference_pool import InferenceQueueFull
+from services.frame_cache import frame_cache, difference_hash
+from services.frame_filter import frame_filter, REASON_MESSAGES
+from services.crop_store import crop_store
+from services.image_writer import image_writer
+from services.idempotency import idempotency_store
+from services.schedule_candidates import schedule_candidates
 from services.attendance_service import attendance_service
+from services.enrollment_service import enrollment_service, iter_zip, count_zip_images
 from services.telegram_service import telegram_service
 from middleware.auth_middleware import verify_device_api_key
+from utils.image_io import decode_image, read_upload, spool_upload, stored_image_name
 import cv2
 import numpy as np
-from datetime import datetime
+from typing import Optional, Tuple
 import os
+import json
+import tempfile
+import zipfile
 from config import settings
 import logging
 
@@ -22,11 +37,17 @@ logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/api/face", tags=["Face Recognition"])
 
+# _decode_and_prefilter reason for a near-duplicate of a recent faceless frame
+NO_FACE_CACHED = "no_face_cached"
+
 
 @router.post("/upload")
 async def upload_face_for_recognition(
+    response: Response,
     file: UploadFile = File(...),
     x_api_key: str = Header(..., alias="X-API-Key"),
+    x_face_crop: Optional[bool] = Header(None, alias="X-Face-Crop"),
+    x_request_id: Optional[str] = Header(None, alias="X-Request-ID"),
     db: Session = Depends(get_db)
 ):
     """
@@ -35,6 +56,8 @@ async def upload_face_for_recognition(
     Args:
         file: Image file (400x400 cropped face)
         x_api_key: Device API key
+        x_face_crop: Image is already a face crop (overrides the device setting)
+        x_request_id: Idempotency key - a retry with the same key gets the stored response
         db: Database session
         
     Returns:
@@ -45,20 +68,76 @@ async def upload_face_for_recognition(
     # Verify device API key
     device = await verify_device_api_key(None, x_api_key, db)
     
+    # Read image (at most MAX_UPLOAD_SIZE bytes)
+    contents = await read_upload(file)
+    precropped = x_face_crop if x_face_crop is not None else bool(device.precropped_faces)
+    
+    # Retried upload (device timed out waiting for us): replay the stored response
+    key = await idempotency_store.key_for(device.id, x_request_id, contents)
+    result, replayed = await idempotency_store.run_once(
+        key, device.id, lambda: _recognize_upload(contents, device, precropped, db)
+    )
+    if replayed:
+        logger.info(f"Replaying stored response for retried upload from device {device.id}")
+        response.headers["X-Idempotent-Replay"] = "true"
+    return result
+
+
+def _decode_and_prefilter(contents: bytes, device_id: int, precropped: bool) -> Tuple[Optional[np.ndarray], Optional[str], Optional[int]]:
+    """
+    Decode an upload (large JPEGs at reduced resolution, DCT scaling) and run
+    the pre-filter that rejects blurry, dark or faceless frames before detection
+    
+    A near-duplicate of a recent faceless frame from the same device is not
+    decoded at all.
+    
+    Returns:
+        (image or None, rejection reason or None, frame hash or None);
+        no image and no reason means the bytes are not an image
+    """
+    frame_hash = difference_hash(contents) if frame_cache.enabled else None
+    if frame_cache.lookup(device_id, frame_hash, precropped) is not None:
+        return None, NO_FACE_CACHED, frame_hash
+    
+    image = decode_image(contents)
+    if image is None:
+        return None, None, frame_hash
+    return image, face_recognition_service.prefilter(image, device_id=device_id, precropped=precropped), frame_hash
+
+
+async def _recognize_upload(contents: bytes, device: Device, precropped: bool, db: Session) -> dict:
+    """Recognize the face in an uploaded image and record attendance"""
     try:
-        # Read image
-        contents = await file.read()
-        nparr = np.frombuffer(contents, np.uint8)
-        image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        
-        if image is None:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Invalid image file"
-            )
+        # Hash, decode and pre-filter on the threadpool, not the event loop
+        image, reason, frame_hash = await run_in_threadpool(_decode_and_prefilter, contents, device.id, precropped)
         
-        # Extract embedding from uploaded image
-        query_embedding = face_recognition_service.get_embedding(image)
+        if reason == NO_FACE_CACHED:
+            logger.info(f"Near-duplicate of a frame without a face from device {device.id}, skipping")
+            query_embedding = None
+        else:
+            if image is None:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail="Invalid image file"
+                )
+            
+            if reason is not None:
+                logger.info(f"Frame from device {device.id} rejected before detection: {reason}")
+                return {
+                    "success": False,
+                    "message": REASON_MESSAGES[reason],
+                    "recognized": False,
+                    "reason": reason
+                }
+            
+            # Extract embedding from uploaded image
+            # Pre-cropped faces skip full-size detection
+            result = await face_recognition_service.get_embedding_async(image, precropped=precropped, return_crop=True)
+            query_embedding, crop = result if result is not None else (None, None)
+            
+            if query_embedding is None:
+                # A near-identical frame from this device is answered from the cache
+                frame_cache.store(device.id, frame_hash, precropped)
         
         if query_embedding is None:
             logger.warning("No face detected in uploaded image")
@@ -70,10 +149,10 @@ async def upload_face_for_recognition(
         
         logger.info("Face detected in image, searching database...")
         
-        # Get all face embeddings from database
-        faces = db.query(Face).join(User).filter(User.is_active == True).all()
+        # Search the in-memory face index (built from the database on first use)
+        face_embedding_index.ensure_loaded(db)
         
-        if not faces:
+        if len(face_embedding_index) == 0:
             logger.warning("No registered faces in database")
             return {
                 "success": False,
@@ -81,14 +160,11 @@ async def upload_face_for_recognition(
                 "recognized": False
             }
         
-        # Convert database embeddings
-        database_embeddings = []
-        for face in faces:
-            db_embedding = face_recognition_service.bytes_to_embedding(face.embedding)
-            database_embeddings.append((face.id, db_embedding))
-        
-        # Find best match
-        match_result = face_recognition_service.find_best_match(query_embedding, database_embeddings)
+        # Find best match: students with a lesson right now (local time, in this room) are searched first
+        candidates = None
+        if settings.FACE_CANDIDATE_NARROWING:
+            candidates = schedule_candidates.candidate_user_ids(db, room=device.location)
+        match_result = face_recognition_service.find_best_match(query_embedding, candidate_user_ids=candidates)
         
         if match_result is None:
             logger.info("Face not recognized (no match found)")
@@ -102,8 +178,15 @@ async def upload_face_for_recognition(
         logger.info(f"Face recognized! Face ID: {face_id}, Confidence: {confidence}")
         
         # Get user info
-        matched_face = db.query(Face).filter(Face.id == face_id).first()
-        user = matched_face.user
+        user = db.query(User).filter(User.id == face_embedding_index.get_user_id(face_id)).first()
+        if user is None:
+            # Index is stale (user removed in the meantime) - rebuild on next request
+            face_embedding_index.invalidate()
+            return {
+                "success": True,
+                "message": "Face detected but not recognized",
+                "recognized": False
+            }
         
         # Check for duplicate attendance today
         if attendance_service.check_duplicate_today(db, user.id):
@@ -117,11 +200,12 @@ async def upload_face_for_recognition(
                 "duplicate": True
             }
         
-        # Save image
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        image_filename = f"{user.employee_id}_{timestamp}.jpg"
-        image_path = os.path.join(settings.UPLOAD_DIR, "attendance", image_filename)
-        cv2.imwrite(image_path, image)
+        # Path of the uploaded image, written in the background once attendance is recorded
+        # (the aligned crop is enough for re-embedding and evaluation). No path is
+        # recorded when the writer's queue is full.
+        image_path = None
+        if settings.SAVE_ATTENDANCE_FRAMES and image_writer.reserve():
+            image_path = os.path.join(settings.UPLOAD_DIR, "attendance", stored_image_name(user.employee_id, contents))
         
         # Create attendance record (with group validation)
         try:
@@ -133,6 +217,8 @@ async def upload_face_for_recognition(
                 image_path=image_path
             )
         except ValueError as e:
+            if image_path:
+                image_writer.release()
             # No active schedule or user not authorized
             logger.warning(f"Attendance creation failed for user {user.id}: {str(e)}")
             return {
@@ -143,6 +229,18 @@ async def upload_face_for_recognition(
                 "confidence": round(confidence * 100, 2),
                 "error": "no_schedule_or_unauthorized"
             }
+        except Exception:
+            if image_path:
+                image_writer.release()
+            raise
+        
+        if image_path:
+            if attendance.image_path == image_path:
+                image_writer.submit(image_path, contents, reserved=True)
+            else:
+                # Seen again too soon: the record keeps its earlier image
+                image_writer.release()
+        crop_store.append_attendance(crop, device.id, user.id, face_id, confidence, attendance.check_in_time)
         
         # Send Telegram notifications
         check_in_time_str = attendance.check_in_time.strftime("%Y-%m-%d %H:%M:%S")
@@ -154,7 +252,8 @@ async def upload_face_for_recognition(
             check_in_time=check_in_time_str,
             confidence=confidence * 100,
             status=attendance.status,
-            image_path=image_path
+            image_path=image_path,
+            image_bytes=contents if settings.SAVE_ATTENDANCE_FRAMES else None
         )
         
         # Personal user notification (new)
@@ -166,7 +265,8 @@ async def upload_face_for_recognition(
             check_in_time=attendance.check_in_time.strftime("%H:%M:%S"),
             status=attendance.status,
             late_minutes=late_minutes,
-            image_path=image_path
+            image_path=image_path,
+            image_bytes=contents if settings.SAVE_ATTENDANCE_FRAMES else None
         )
         
         logger.info(f"Attendance recorded for {user.full_name}")
@@ -180,6 +280,14 @@ async def upload_face_for_recognition(
             "duplicate": False
         }
         
+    except HTTPException:
+        raise
+    except InferenceQueueFull as e:
+        logger.warning(f"Upload rejected: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Server is busy, please retry"
+        )
     except Exception as e:
         logger.error(f"Face recognition error: {e}")
         raise HTTPException(
@@ -214,8 +322,8 @@ async def register_face(
         )
     
     try:
-        # Read image
-        contents = await file.read()
+        # Read image (full resolution: it is the enrolment reference)
+        contents = await read_upload(file)
         nparr = np.frombuffer(contents, np.uint8)
         image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
         
@@ -226,30 +334,44 @@ async def register_face(
             )
         
         # Extract embedding
-        embedding = face_recognition_service.get_embedding(image)
+        result = await face_recognition_service.get_embedding_async(image, return_crop=True)
         
-        if embedding is None:
+        if result is None:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="No face detected in image"
             )
+        embedding, crop = result
         
-        # Save image
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        image_filename = f"{user.employee_id}_{timestamp}.jpg"
-        image_path = os.path.join(settings.UPLOAD_DIR, "faces", image_filename)
-        cv2.imwrite(image_path, image)
+        # Save the uploaded bytes as they are (written in the background after the commit,
+        # no path is recorded when the writer's queue is full)
+        image_path = None
+        if image_writer.reserve():
+            image_path = os.path.join(settings.UPLOAD_DIR, "faces", stored_image_name(user.employee_id, contents))
         
         # Save to database
         face = Face(
             user_id=user_id,
             embedding=face_recognition_service.embedding_to_bytes(embedding),
+            embedding_codec=face_recognition_service.embedding_codec,
+            model_name=settings.INSIGHTFACE_MODEL,
             image_path=image_path
         )
         
-        db.add(face)
-        db.commit()
+        try:
+            db.add(face)
+            db.commit()
+        except Exception:
+            if image_path:
+                image_writer.release()
+            raise
         db.refresh(face)
+        if image_path:
+            image_writer.submit(image_path, contents, reserved=True)
+        
+        if user.is_active:
+            face_embedding_index.add(face.id, user.id, embedding)
+        crop_store.add_face(user.id, face.id, crop)
         
         logger.info(f"Face registered for user {user.employee_id}")
         
@@ -259,6 +381,14 @@ async def register_face(
             "face": face.to_dict()
         }
         
+    except HTTPException:
+        raise
+    except InferenceQueueFull as e:
+        logger.warning(f"Registration rejected: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Server is busy, please retry"
+        )
     except Exception as e:
         logger.error(f"Face registration error: {e}")
         raise HTTPException(
@@ -267,6 +397,53 @@ async def register_face(
         )
 
 
+@router.post("/register/bulk")
+async def register_faces_bulk(
+    file: UploadFile = File(...),
+    batch_size: int = 100
+):
+    """
+    Register faces for many users from a zip archive
+    
+    The archive holds one folder per user named after the employee_id
+    (<employee_id>/<photo>.jpg) or images named <employee_id>.jpg.
+    Images with no face or more than one face are rejected.
+    
+    Returns:
+        NDJSON stream: one event per image, then a summary with the failures
+    """
+    # Spool the upload ourselves: the request's file is closed before the stream ends
+    archive = tempfile.TemporaryFile()
+    try:
+        await spool_upload(file, archive, settings.MAX_BULK_UPLOAD_SIZE)
+        archive.seek(0)
+        total = await run_in_threadpool(count_zip_images, archive)
+        archive.seek(0)
+    except zipfile.BadZipFile:
+        archive.close()
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid zip archive"
+        )
+    except BaseException:
+        archive.close()
+        raise
+    
+    async def events():
+        db = SessionLocal()
+        try:
+            async for event in enrollment_service.enroll(
+                db, iter_zip(archive), total=total, batch_size=max(1, batch_size)
+            ):
+                yield json.dumps(event) + "\n"
+        finally:
+            db.close()
+            archive.close()
+    
+    logger.info(f"Bulk enrollment started: {total} images from {file.filename}")
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
+
 @router.delete("/{face_id}")
 async def delete_face(face_id: int, db: Session = Depends(get_db)):
     """Delete a face record"""
@@ -278,13 +455,18 @@ async def delete_face(face_id: int, db: Session = Depends(get_db)):
             detail="Face not found"
         )
     
-    # Delete image file if exists
-    if face.image_path and os.path.exists(face.image_path):
-        os.remove(face.image_path)
+    # Delete image file if exists (and discard a write still queued for it)
+    if face.image_path:
+        image_writer.cancel(face.image_path)
+        if os.path.exists(face.image_path):
+            os.remove(face.image_path)
     
     db.delete(face)
     db.commit()
     
+    face_embedding_index.remove(face_id)
+    crop_store.remove_face(face.user_id, face_id)
+    
     return {"success": True, "message": "Face deleted successfully"}
 
 
@@ -297,3 +479,109 @@ async def get_user_faces(user_id: int, db: Session = Depends(get_db)):
         "success": True,
         "faces": [face.to_dict() for face in faces]
     }
+
+
+@router.get("/inference/stats")
+async def get_inference_stats():
+    """Inference pool queue depth, wait-time and batching counters"""
+    return {
+        "success": True,
+        "model_loaded": face_recognition_service.model_loaded,
+        "pool": face_recognition_service.pool.stats(),
+        "batching": face_recognition_service.scheduler.stats()
+    }
+
+
+@router.get("/model/stats")
+async def get_model_stats():
+    """Model residency (idle eviction / preload) and process memory usage"""
+    from services.model_lifecycle import model_lifecycle
+    return {
+        "success": True,
+        **model_lifecycle.stats()
+    }
+
+
+@router.post("/model/reembed")
+async def start_reembedding(
+    target_model: str,
+    batch_size: Optional[int] = None,
+    workers: Optional[int] = None,
+    activate: bool = True,
+    force: bool = False
+):
+    """
+    Re-embed every enrolled face with another InsightFace model
+
+    Runs in the background while recognition keeps using the current model.
+    Starting again after a restart or cancel resumes where the job stopped.
+    With activate, the model and the face index are switched when it finishes.
+    """
+    from services.reembed_service import reembed_job
+    try:
+        reembed_job.start(target_model, batch_size=batch_size, workers=workers, activate=activate, force=force)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=str(e)
+        )
+    return {
+        "success": True,
+        **reembed_job.status()
+    }
+
+
+@router.get("/model/reembed")
+async def get_reembedding_status():
+    """Progress of the re-embedding job"""
+    from services.reembed_service import reembed_job
+    return {
+        "success": True,
+        **reembed_job.status()
+    }
+
+
+@router.post("/model/reembed/cancel")
+async def cancel_reembedding():
+    """Stop the re-embedding job after the current batch"""
+    from services.reembed_service import reembed_job
+    return {
+        "success": reembed_job.cancel(),
+        **reembed_job.status()
+    }
+
+
+@router.get("/cache/stats")
+async def get_frame_cache_stats():
+    """Near-duplicate frame cache hit/miss counters"""
+    return {
+        "success": True,
+        **frame_cache.stats()
+    }
+
+
+@router.get("/writer/stats")
+async def get_image_writer_stats():
+    """Background image writes (queue depth, batches, failures)"""
+    return {
+        "success": True,
+        **image_writer.stats()
+    }
+
+
+@router.get("/filter/stats")
+async def get_frame_filter_stats():
+    """Frames rejected before detection, per device and reason"""
+    return {
+        "success": True,
+        **frame_filter.stats()
+    }
+
+
+@router.get("/idempotency/stats")
+async def get_idempotency_stats():
+    """Stored and replayed upload responses"""
+    return {
+        "success": True,
+        **idempotency_store.stats()
+    }
@@ -7,6 +7,7 @@ from sqlalchemy.sql import func
 from database import get_db
 from models.group import Group
 from models.user import User
+from services.timetable import timetable_cache
 from typing import List, Optional
 from pydantic import BaseModel
 import logging
@@ -155,6 +156,7 @@ async def delete_group(group_id: int, db: Session = Depends(get_db)):
     
     db.delete(group)
     db.commit()
+    timetable_cache.invalidate()
     
     return {
         "success": True,
@@ -192,6 +194,7 @@ async def add_students_to_group(
             group.users.append(user)
     
     db.commit()
+    timetable_cache.invalidate()
     db.refresh(group)
     
     return {
@@ -227,6 +230,7 @@ async def remove_student_from_group(
     if user in group.users:
         group.users.remove(user)
         db.commit()
+        timetable_cache.invalidate()
     
     return {
         "success": True,
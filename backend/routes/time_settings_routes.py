@@ -6,6 +6,7 @@ from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
 from database import get_db
 from models.time_settings import TimeSettings
+from services.attendance_policy import attendance_policies
 from pydantic import BaseModel
 from typing import Optional
 from datetime import time
@@ -83,6 +84,7 @@ async def create_time_settings(
         db.add(new_settings)
         db.commit()
         db.refresh(new_settings)
+        attendance_policies.invalidate()
         
         logger.info(f"New time settings created: {new_settings.to_dict()}")
         
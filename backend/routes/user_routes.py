@@ -5,6 +5,7 @@ from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
 from database import get_db
 from models.user import User
+from services.face_index import face_embedding_index
 from pydantic import BaseModel, EmailStr, field_validator
 from typing import Optional
 import logging
@@ -190,6 +191,12 @@ async def update_user(
     db.commit()
     db.refresh(user)
     
+    # Keep the face index in sync with the user's active flag
+    if user_data.is_active is False:
+        face_embedding_index.remove_user(user.id)
+    elif user_data.is_active:
+        face_embedding_index.invalidate()
+    
     logger.info(f"User updated: {user.employee_id}")
     
     return {
@@ -214,6 +221,8 @@ async def delete_user(user_id: int, db: Session = Depends(get_db)):
     user.is_active = False
     db.commit()
     
+    face_embedding_index.remove_user(user.id)
+    
     logger.info(f"User deleted: {user.employee_id}")
     
     return {
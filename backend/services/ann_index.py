@@ -0,0 +1,291 @@
+"""
+Approximate nearest-neighbour backends for the face embedding index
+
+The backends only produce candidate face ids; FaceEmbeddingIndex re-scores
+the candidates exactly against its float32 matrix, so the exact scan stays
+the reference and the fallback.
+"""
+import numpy as np
+from typing import Optional
+from config import settings
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class IVFFlatBackend:
+    """
+    Inverted-file index: embeddings are bucketed by their nearest coarse
+    centroid (spherical k-means) and a query only scans the closest buckets.
+
+    The bucket members are ranked with a float16 copy of their vectors and
+    only the top k go back to FaceEmbeddingIndex for the exact re-score.
+    Centroids are retrained once the index grows (or shrinks) past
+    FACE_INDEX_IVF_RETRAIN_GROWTH times the size they were trained on.
+    """
+    name = "ivf"
+
+    def __init__(self, n_lists: int = 0, n_probe: int = 32):
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.centroids = None
+        self.trained_size = 0
+        self._face_ids = np.empty(0, dtype=np.int64)
+        self._vectors = np.empty((0, 0), dtype=np.float16)
+        self._assign = np.empty(0, dtype=np.int32)
+        self._lists = {}  # list -> row positions in _face_ids / _vectors
+
+    @property
+    def path(self) -> str:
+        return os.path.join(settings.INDEX_DIR, f"face_index_ivf.{settings.INSIGHTFACE_MODEL}.npz")
+
+    def _train(self, matrix: np.ndarray, iterations: int = 10, sample_size: int = 50000):
+        """Spherical k-means on a sample of the embeddings"""
+        n_lists = self.n_lists or max(1, int(np.sqrt(len(matrix))))
+        n_lists = min(n_lists, len(matrix))
+
+        rng = np.random.default_rng(0)
+        sample = matrix
+        if len(matrix) > sample_size:
+            sample = matrix[rng.choice(len(matrix), sample_size, replace=False)]
+        sample = np.asarray(sample, dtype=np.float32)
+
+        centroids = sample[rng.choice(len(sample), n_lists, replace=False)].copy()
+        for _ in range(iterations):
+            assign = np.argmax(sample @ centroids.T, axis=1)
+            for c in range(n_lists):
+                members = sample[assign == c]
+                if len(members):
+                    centroid = members.sum(axis=0)
+                    norm = np.linalg.norm(centroid)
+                    if norm > 0:
+                        centroids[c] = centroid / norm
+
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        self.trained_size = len(matrix)
+
+    def _drifted(self, size: int) -> bool:
+        """Index size moved far enough from the training size to retrain"""
+        growth = settings.FACE_INDEX_IVF_RETRAIN_GROWTH
+        if growth <= 1 or not self.trained_size:
+            return False
+        return size > self.trained_size * growth or size * growth < self.trained_size
+
+    def _assign_vectors(self, vectors: np.ndarray) -> np.ndarray:
+        assign = np.empty(len(vectors), dtype=np.int32)
+        # Chunked so that a 200k x n_lists score matrix is never materialized at once
+        for start in range(0, len(vectors), 20000):
+            chunk = np.asarray(vectors[start:start + 20000], dtype=np.float32)
+            assign[start:start + len(chunk)] = np.argmax(chunk @ self.centroids.T, axis=1)
+        return assign
+
+    def _rebuild_lists(self):
+        order = np.argsort(self._assign, kind="stable")
+        bounds = np.searchsorted(self._assign[order], np.arange(len(self.centroids) + 1))
+        self._lists = {
+            c: order[bounds[c]:bounds[c + 1]]
+            for c in range(len(self.centroids))
+        }
+
+    def _retrain(self):
+        logger.info(f"Retraining IVF centroids: {len(self._face_ids)} embeddings, trained on {self.trained_size}")
+        self._train(self._vectors)
+        self.save()
+        self._assign = self._assign_vectors(self._vectors)
+        self._rebuild_lists()
+
+    def build(self, matrix: np.ndarray, face_ids: np.ndarray):
+        """Load persisted centroids if possible, otherwise train them"""
+        if not self.load() or self._drifted(len(matrix)):
+            self._train(matrix)
+            self.save()
+
+        self._face_ids = face_ids.copy()
+        self._vectors = np.asarray(matrix, dtype=np.float16)
+        self._assign = self._assign_vectors(matrix)
+        self._rebuild_lists()
+
+    def add(self, face_id: int, vector: np.ndarray):
+        if self.centroids is None:
+            return
+        c = int(np.argmax(self.centroids @ vector))
+        position = len(self._face_ids)
+        self._face_ids = np.append(self._face_ids, np.int64(face_id))
+        self._vectors = np.vstack([self._vectors, np.asarray(vector, dtype=np.float16)[None, :]])
+        self._assign = np.append(self._assign, np.int32(c))
+        self._lists[c] = np.append(self._lists[c], position)
+        if self._drifted(len(self._face_ids)):
+            self._retrain()
+
+    def remove(self, face_ids: np.ndarray):
+        keep = ~np.isin(self._face_ids, face_ids)
+        if keep.all():
+            return
+        self._face_ids = self._face_ids[keep]
+        self._vectors = self._vectors[keep]
+        self._assign = self._assign[keep]
+        if self._drifted(len(self._face_ids)):
+            self._retrain()
+        else:
+            self._rebuild_lists()
+
+    def search(self, query: np.ndarray, k: int) -> np.ndarray:
+        """Top k face ids from the n_probe closest buckets, best first"""
+        if self.centroids is None:
+            return np.empty(0, dtype=np.int64)
+        n_probe = min(self.n_probe, len(self.centroids))
+        probes = np.argpartition(-(self.centroids @ query), n_probe - 1)[:n_probe]
+        positions = np.concatenate([self._lists[int(c)] for c in probes])
+        if len(positions) == 0:
+            return np.empty(0, dtype=np.int64)
+
+        scores = self._vectors[positions].astype(np.float32) @ query
+        if 0 < k < len(positions):
+            top = np.argpartition(-scores, k - 1)[:k]
+            positions, scores = positions[top], scores[top]
+        return self._face_ids[positions[np.argsort(-scores)]]
+
+    def save(self):
+        os.makedirs(settings.INDEX_DIR, exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp.npz"
+        np.savez(tmp_path, centroids=self.centroids, trained_size=np.int64(self.trained_size))
+        os.replace(tmp_path, self.path)
+        logger.info(f"IVF centroids saved: {self.path}")
+
+    def load(self) -> bool:
+        if not os.path.exists(self.path):
+            return False
+        try:
+            with np.load(self.path) as data:
+                centroids = data["centroids"]
+                # Older files have no training size: never treated as drifted
+                trained_size = int(data["trained_size"]) if "trained_size" in data.files else 0
+            if self.n_lists and len(centroids) != self.n_lists:
+                return False
+            self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+            self.trained_size = trained_size
+            logger.info(f"IVF centroids loaded: {self.path} ({len(centroids)} lists)")
+            return True
+        except Exception as e:
+            logger.error(f"Failed to load IVF index: {e}")
+            return False
+
+
+class HNSWBackend:
+    """Hierarchical navigable small-world graph via the optional hnswlib package"""
+    name = "hnsw"
+
+    def __init__(self, m: int = 16, ef_construction: int = 200, ef_search: int = 64):
+        import hnswlib  # Optional dependency - raises ImportError if missing
+        self._hnswlib = hnswlib
+        self.m = m
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self.index = None
+
+    @property
+    def path(self) -> str:
+        return os.path.join(settings.INDEX_DIR, f"face_index_hnsw.{settings.INSIGHTFACE_MODEL}.bin")
+
+    def _new_index(self, dim: int, capacity: int):
+        index = self._hnswlib.Index(space="ip", dim=dim)
+        index.init_index(
+            max_elements=capacity,
+            ef_construction=self.ef_construction,
+            M=self.m,
+            allow_replace_deleted=True
+        )
+        return index
+
+    def build(self, matrix: np.ndarray, face_ids: np.ndarray):
+        """Load the persisted graph and reconcile it with the current faces"""
+        dim = matrix.shape[1]
+        capacity = max(1024, int(len(face_ids) * 1.25))
+
+        index = None
+        if os.path.exists(self.path):
+            try:
+                index = self._hnswlib.Index(space="ip", dim=dim)
+                index.load_index(self.path, max_elements=capacity, allow_replace_deleted=True)
+                logger.info(f"HNSW index loaded: {self.path}")
+            except Exception as e:
+                logger.error(f"Failed to load HNSW index: {e}")
+                index = None
+
+        if index is None:
+            index = self._new_index(dim, capacity)
+            if len(face_ids):
+                index.add_items(matrix, face_ids)
+            self.index = index
+        else:
+            self.index = index
+            stored = np.array(index.get_ids_list(), dtype=np.int64)
+            self.remove(np.setdiff1d(stored, face_ids))
+            missing = ~np.isin(face_ids, stored)
+            if missing.any():
+                if index.get_current_count() + int(missing.sum()) > index.get_max_elements():
+                    index.resize_index(index.get_current_count() + int(missing.sum()) + 1024)
+                index.add_items(matrix[missing], face_ids[missing], replace_deleted=True)
+
+        index.set_ef(self.ef_search)
+        self.save()
+
+    def add(self, face_id: int, vector: np.ndarray):
+        if self.index is None:
+            return
+        if self.index.get_current_count() >= self.index.get_max_elements():
+            self.index.resize_index(self.index.get_max_elements() * 2)
+        self.index.add_items(vector.reshape(1, -1), [face_id], replace_deleted=True)
+
+    def remove(self, face_ids: np.ndarray):
+        if self.index is None:
+            return
+        for face_id in face_ids:
+            try:
+                self.index.mark_deleted(int(face_id))
+            except RuntimeError:
+                pass
+
+    def search(self, query: np.ndarray, k: int) -> np.ndarray:
+        if self.index is None or self.index.get_current_count() == 0:
+            return np.empty(0, dtype=np.int64)
+        k = min(k, self.index.get_current_count())
+        labels, _ = self.index.knn_query(query.reshape(1, -1), k=k)
+        return labels[0].astype(np.int64)
+
+    def save(self):
+        os.makedirs(settings.INDEX_DIR, exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        self.index.save_index(tmp_path)
+        os.replace(tmp_path, self.path)
+
+
+def create_ann_backend(name: Optional[str] = None):
+    """
+    Create the ANN backend selected in settings
+
+    Returns:
+        Backend instance or None when the exact scan should be used
+    """
+    name = (name or settings.FACE_INDEX_BACKEND).lower()
+
+    if name == "ivf":
+        return IVFFlatBackend(
+            n_lists=settings.FACE_INDEX_IVF_LISTS,
+            n_probe=settings.FACE_INDEX_IVF_PROBES
+        )
+
+    if name == "hnsw":
+        try:
+            return HNSWBackend(
+                m=settings.FACE_INDEX_HNSW_M,
+                ef_search=settings.FACE_INDEX_HNSW_EF
+            )
+        except ImportError:
+            logger.warning("hnswlib is not installed, falling back to exact face search")
+            return None
+
+    if name != "exact":
+        logger.warning(f"Unknown FACE_INDEX_BACKEND '{name}', using exact face search")
+    return None
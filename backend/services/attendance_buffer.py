@@ -0,0 +1,404 @@
+"""
+Attendance Buffer - optional write-behind stage for attendance records
+
+With ATTENDANCE_WRITE_BEHIND enabled, check-ins update an in-memory state
+per lesson occurrence (user, schedule, session date) and a background
+thread writes the changed ones in batches: every ATTENDANCE_FLUSH_INTERVAL_MS
+or as soon as ATTENDANCE_FLUSH_BATCH_SIZE occurrences are waiting. Repeated
+sightings of the same student between flushes become one row write.
+
+The in-memory state is what the duplicate checks read, so a check-in is
+visible to the next one immediately, before it reaches the database. The
+buffer is per process: run a single worker when it is enabled.
+
+A batch that fails is retried row by row, so one bad record does not hold
+back the others. A record that still fails ATTENDANCE_FLUSH_MAX_RETRIES
+times (e.g. a constraint violation) is logged with its values and dropped.
+Connection errors are retried without limit: the pending state is at most
+one record per student and lesson.
+"""
+from datetime import date, datetime, timedelta
+from sqlalchemy.exc import InterfaceError, OperationalError
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import set_committed_value
+from typing import Optional
+from config import settings
+from models.attendance import Attendance
+from utils import get_current_time
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Database unreachable or locked: retried without counting against the record
+TRANSIENT_ERRORS = (OperationalError, InterfaceError)
+
+
+class SessionState:
+    """Current attendance of one user in one lesson occurrence"""
+
+    __slots__ = (
+        "user_id", "schedule_id", "session_date", "id", "device_id", "check_in_time", "last_seen_time",
+        "confidence", "image_path", "status", "detection_count", "pending", "failures"
+    )
+
+    def __init__(self, user_id: int, schedule_id: int, session_date: date, **fields):
+        self.user_id = user_id
+        self.schedule_id = schedule_id
+        self.session_date = session_date
+        self.id = fields.get("id")
+        self.device_id = fields.get("device_id")
+        self.check_in_time = fields.get("check_in_time")
+        self.last_seen_time = fields.get("last_seen_time")
+        self.confidence = fields.get("confidence")
+        self.image_path = fields.get("image_path")
+        self.status = fields.get("status")
+        self.detection_count = fields.get("detection_count") or 0
+        self.pending = 0  # Sightings not written yet
+        self.failures = 0  # Consecutive failed writes
+
+    @property
+    def key(self) -> tuple:
+        return self.user_id, self.schedule_id, self.session_date
+
+    def to_attendance(self) -> Attendance:
+        """Detached Attendance with the current values (id is None until first written)"""
+        return Attendance(
+            id=self.id,
+            user_id=self.user_id,
+            device_id=self.device_id,
+            schedule_id=self.schedule_id,
+            session_date=self.session_date,
+            check_in_time=self.check_in_time,
+            confidence=self.confidence,
+            image_path=self.image_path,
+            status=self.status,
+            detection_count=self.detection_count,
+            last_seen_time=self.last_seen_time
+        )
+
+
+class AttendanceWriteBuffer:
+    """In-memory attendance state with batched, coalesced writes"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = False
+        self._thread = None
+        self._states = {}  # (user_id, schedule_id, session_date) -> SessionState
+        self._sessions = {}  # (user_id, session_date) -> number of tracked occurrences
+        self._dirty = set()  # Keys with pending sightings
+
+        # Counters
+        self.sightings = 0
+        self.rows_written = 0
+        self.flushes = 0
+        self.failed_flushes = 0
+        self.dead_lettered = 0
+        self.total_flush_ms = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return settings.ATTENDANCE_WRITE_BEHIND
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name="attendance-buffer", daemon=True)
+            self._thread.start()
+            logger.info("Attendance write-behind buffer started")
+
+    def _load_state(self, db: Session, key: tuple) -> Optional[SessionState]:
+        user_id, schedule_id, session_date = key
+        row = db.query(Attendance).filter(
+            Attendance.user_id == user_id,
+            Attendance.schedule_id == schedule_id,
+            Attendance.session_date == session_date
+        ).first()
+        if row is None:
+            return None
+        return SessionState(
+            user_id, schedule_id, session_date,
+            id=row.id, device_id=row.device_id, check_in_time=row.check_in_time,
+            last_seen_time=row.last_seen_time, confidence=row.confidence, image_path=row.image_path,
+            status=row.status, detection_count=row.detection_count
+        )
+
+    def record(
+        self,
+        db: Session,
+        user_id: int,
+        device_id: int,
+        schedule_id: int,
+        check_in_time: datetime,
+        confidence: float,
+        image_path: str = None
+    ) -> Attendance:
+        """
+        Apply a sighting to the in-memory state (same rules as upsert_attendance)
+
+        Returns:
+            Attendance with the current state of the lesson occurrence (not attached to db)
+        """
+        from services.attendance_policy import attendance_policies
+        from services.attendance_service import AttendanceService
+        from services.timetable import timetable_cache
+
+        if self._thread is None or not self._thread.is_alive():
+            self.start()
+
+        policy = attendance_policies.resolve(db, schedule_id)
+        key = (user_id, schedule_id, timetable_cache.get(db).session_date(schedule_id, check_in_time))
+
+        # Outside the lock: status of a first sighting (cached policy) and one read the
+        # first time the occurrence is seen by this process
+        status = AttendanceService.determine_status(check_in_time, db, schedule_id, key[2])
+        loaded = None
+        if key not in self._states:
+            loaded = self._load_state(db, key)
+
+        with self._lock:
+            self.sightings += 1
+            state = self._states.get(key)
+            if state is None:
+                state = loaded
+                if state is not None:
+                    self._track(key, state)
+
+            if state is None:
+                state = SessionState(
+                    user_id, schedule_id, key[2],
+                    device_id=device_id, check_in_time=check_in_time, last_seen_time=check_in_time,
+                    confidence=confidence, image_path=image_path,
+                    status=status,
+                    detection_count=1
+                )
+                state.pending = 1
+                self._track(key, state)
+                self._dirty.add(key)
+            elif _as_local(state.last_seen_time, check_in_time) <= check_in_time - timedelta(minutes=policy.duplicate_check_minutes):
+                state.detection_count += 1
+                state.pending += 1
+                state.last_seen_time = check_in_time
+                if confidence is not None and (state.confidence is None or confidence > state.confidence):
+                    state.confidence = confidence
+                if image_path:
+                    state.image_path = image_path
+                self._dirty.add(key)
+            else:
+                logger.info(f"❌ Takroriy davomat rad etildi: user {user_id}. Last: {state.last_seen_time}")
+
+            attendance = state.to_attendance()
+            if len(self._dirty) >= settings.ATTENDANCE_FLUSH_BATCH_SIZE:
+                self._wake.set()
+
+        # Related rows for notifications and to_dict(), without adding the record to the session
+        from models.user import User
+        from models.device import Device
+        from models.schedule import Schedule
+        set_committed_value(attendance, "user", db.get(User, user_id))
+        set_committed_value(attendance, "device", db.get(Device, attendance.device_id) if attendance.device_id else None)
+        set_committed_value(attendance, "schedule", db.get(Schedule, schedule_id))
+        return attendance
+
+    def _track(self, key: tuple, state: SessionState):
+        """Start tracking an occurrence (lock held)"""
+        self._states[key] = state
+        session = (key[0], key[2])
+        self._sessions[session] = self._sessions.get(session, 0) + 1
+
+    def seen_on(self, user_id: int, session_date: date) -> bool:
+        """True if this buffer knows a check-in of the user to a lesson occurrence on session_date"""
+        with self._lock:
+            return (user_id, session_date) in self._sessions
+
+    def _take_dirty(self) -> list:
+        with self._lock:
+            batch = []
+            for key in self._dirty:
+                state = self._states[key]
+                batch.append((state, state.pending, {
+                    "user_id": state.user_id,
+                    "device_id": state.device_id,
+                    "schedule_id": state.schedule_id,
+                    "session_date": state.session_date,
+                    "check_in_time": state.check_in_time,
+                    "confidence": state.confidence,
+                    "image_path": state.image_path,
+                    "status": state.status,
+                    "detection_count": state.pending,
+                    "last_seen_time": state.last_seen_time
+                }))
+                state.pending = 0
+            self._dirty = set()
+            return batch
+
+    def _write(self, db: Session, rows: list) -> dict:
+        """One INSERT ... ON CONFLICT for the batch; returns key -> id"""
+        from sqlalchemy import case, func
+
+        if db.get_bind().dialect.name == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+
+        stmt = insert(Attendance).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[Attendance.user_id, Attendance.schedule_id, Attendance.session_date],
+            set_={
+                # detection_count carries the sightings since the last flush
+                "detection_count": Attendance.detection_count + stmt.excluded.detection_count,
+                "last_seen_time": stmt.excluded.last_seen_time,
+                "confidence": case(
+                    (stmt.excluded.confidence > Attendance.confidence, stmt.excluded.confidence),
+                    else_=Attendance.confidence
+                ),
+                "image_path": func.coalesce(stmt.excluded.image_path, Attendance.image_path)
+            }
+        ).returning(Attendance.id, Attendance.user_id, Attendance.schedule_id, Attendance.session_date)
+
+        ids = {(row.user_id, row.schedule_id, row.session_date): row.id for row in db.execute(stmt)}
+        db.commit()
+        return ids
+
+    def flush(self) -> int:
+        """Write every pending occurrence now; returns the number of rows written"""
+        from database import SessionLocal
+
+        with self._flush_lock:
+            batch = self._take_dirty()
+            if not batch:
+                self._prune()
+                return 0
+
+            start = datetime.now()
+            size = max(1, settings.ATTENDANCE_FLUSH_BATCH_SIZE)
+            written = 0
+            failed = []
+            db = SessionLocal()
+            try:
+                for offset in range(0, len(batch), size):
+                    chunk = batch[offset:offset + size]
+                    try:
+                        ids = self._write(db, [row for _, _, row in chunk])
+                    except TRANSIENT_ERRORS as e:
+                        db.rollback()
+                        logger.error(f"Attendance flush failed, will retry: {e}")
+                        ids = {}
+                        failed.extend((entry, e) for entry in chunk)
+                    except Exception as e:
+                        db.rollback()
+                        logger.error(f"Attendance flush failed, writing the batch row by row: {e}")
+                        ids, chunk_failed = self._write_rows(db, chunk)
+                        failed.extend(chunk_failed)
+                    with self._lock:
+                        for state, _, _ in chunk:
+                            if state.key in ids:
+                                state.id = ids[state.key]
+                                state.failures = 0
+                    written += len(ids)
+            finally:
+                db.close()
+
+            if failed:
+                self.failed_flushes += 1
+                self._requeue(failed)
+
+            self.flushes += 1
+            self.rows_written += written
+            self.total_flush_ms += (datetime.now() - start).total_seconds() * 1000
+            self._prune()
+            return written
+
+    def _write_rows(self, db: Session, chunk: list) -> tuple:
+        """Write a failed batch one row at a time; returns (key -> id, failed entries with their error)"""
+        ids = {}
+        failed = []
+        for entry in chunk:
+            try:
+                ids.update(self._write(db, [entry[2]]))
+            except Exception as e:
+                db.rollback()
+                failed.append((entry, e))
+        return ids, failed
+
+    def _requeue(self, failed: list):
+        """Put failed sightings back for the next flush, or drop them after too many attempts"""
+        max_retries = max(1, settings.ATTENDANCE_FLUSH_MAX_RETRIES)
+        with self._lock:
+            for (state, pending, row), error in failed:
+                if not isinstance(error, TRANSIENT_ERRORS):
+                    state.failures += 1
+                if state.failures >= max_retries:
+                    self.dead_lettered += 1
+                    logger.error(f"Attendance record dropped after {state.failures} failed writes ({error}): {row}")
+                    continue
+                state.pending += pending
+                self._dirty.add(state.key)
+
+    def _prune(self):
+        """Forget occurrences from previous days that are already written"""
+        today = get_current_time().date()
+        with self._lock:
+            for key in [key for key in self._states if key[2] < today and key not in self._dirty]:
+                del self._states[key]
+                session = (key[0], key[2])
+                if self._sessions[session] > 1:
+                    self._sessions[session] -= 1
+                else:
+                    del self._sessions[session]
+
+    def _run(self):
+        while not self._stopping:
+            self._wake.wait(settings.ATTENDANCE_FLUSH_INTERVAL_MS / 1000)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Attendance buffer error: {e}")
+
+    def stop(self, timeout: Optional[float] = 10.0):
+        """Write what is pending and stop the thread (application shutdown)"""
+        thread = self._thread
+        if thread is None:
+            return
+        self._stopping = True
+        self._wake.set()
+        thread.join(timeout)
+        written = self.flush()
+        pending = len(self._dirty)
+        if pending:
+            logger.error(f"Attendance buffer stopped with {pending} occurrences not written")
+        else:
+            logger.info(f"Attendance buffer stopped ({written} rows written on shutdown)")
+
+    def stats(self) -> dict:
+        with self._lock:
+            pending = len(self._dirty)
+            tracked = len(self._states)
+        return {
+            "enabled": self.enabled,
+            "pending": pending,
+            "tracked": tracked,
+            "sightings": self.sightings,
+            "rows_written": self.rows_written,
+            "flushes": self.flushes,
+            "failed_flushes": self.failed_flushes,
+            "dead_lettered": self.dead_lettered,
+            "avg_flush_ms": round(self.total_flush_ms / self.flushes, 2) if self.flushes else 0.0
+        }
+
+
+def _as_local(value: datetime, reference: datetime) -> datetime:
+    """Give a naive stored time the reference's timezone (SQLite drops it)"""
+    if value.tzinfo is None and reference.tzinfo is not None:
+        return value.replace(tzinfo=reference.tzinfo)
+    return value
+
+
+# Global instance
+attendance_buffer = AttendanceWriteBuffer()
@@ -0,0 +1,119 @@
+"""
+Attendance Policy - resolved check-in rules per schedule
+
+Merges, field by field, the schedule overrides, the active TimeSettings and
+the config.Settings fallback into one AttendancePolicy. Policies are cached
+until the time settings change (invalidate(), bumps the version) or the
+timetable is rebuilt after a schedule change.
+"""
+from collections import namedtuple
+from datetime import time
+from sqlalchemy.orm import Session
+from typing import Optional
+from config import settings
+from services.timetable import timetable_cache
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+AttendancePolicy = namedtuple("AttendancePolicy", [
+    "schedule_id",  # None when no schedule applies (global rules only)
+    "start_time", "end_time",  # Lesson time, None without a schedule
+    "work_start_time", "late_threshold_minutes", "duplicate_check_minutes"
+])
+
+
+class AttendancePolicyCache:
+    """Resolved policies keyed by schedule id, dropped on time settings or schedule changes"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._global = None  # (work_start_time, late_threshold_minutes, duplicate_check_minutes)
+        self._policies = {}  # schedule_id -> AttendancePolicy
+        self._timetable_version = None
+        self.version = 0
+
+    def invalidate(self):
+        """Drop resolved policies (time settings changed)"""
+        with self._lock:
+            self._global = None
+            self._policies = {}
+            self.version += 1
+
+    def _load_global(self, db: Session) -> tuple:
+        from models.time_settings import TimeSettings
+
+        row = db.query(TimeSettings).filter(
+            TimeSettings.is_active == 1
+        ).order_by(TimeSettings.created_at.desc()).first()
+
+        if row:
+            logger.info(f"Time settings loaded (id {row.id})")
+            return row.work_start_time, row.late_threshold_minutes, row.duplicate_check_minutes
+
+        hour, minute = map(int, settings.WORK_START_TIME.split(':'))
+        return time(hour, minute), settings.LATE_THRESHOLD_MINUTES, settings.DUPLICATE_CHECK_MINUTES
+
+    def _load_schedule(self, db: Session, schedule_id: int):
+        """Schedule overrides; the timetable already holds every active schedule"""
+        entry = timetable_cache.get(db).entries.get(schedule_id)
+        if entry is not None:
+            return entry
+
+        from models.schedule import Schedule
+        return db.query(Schedule).filter(Schedule.id == schedule_id).first()
+
+    def resolve(self, db: Session, schedule_id: Optional[int] = None) -> AttendancePolicy:
+        """
+        Policy for a check-in under schedule_id
+
+        The schedule's own late threshold and duplicate window win, then the
+        active TimeSettings, then config. An unknown schedule resolves to the
+        global rules with schedule_id None.
+        """
+        timetable_version = timetable_cache.version
+        with self._lock:
+            if self._timetable_version != timetable_version:
+                self._policies = {}
+                self._timetable_version = timetable_version
+
+            policy = self._policies.get(schedule_id)
+            if policy is not None:
+                return policy
+
+            if self._global is None:
+                self._global = self._load_global(db)
+            work_start_time, late_threshold_minutes, duplicate_check_minutes = self._global
+
+            schedule = self._load_schedule(db, schedule_id) if schedule_id else None
+            if schedule is None:
+                policy = AttendancePolicy(
+                    schedule_id=None,
+                    start_time=None,
+                    end_time=None,
+                    work_start_time=work_start_time,
+                    late_threshold_minutes=late_threshold_minutes,
+                    duplicate_check_minutes=duplicate_check_minutes
+                )
+            else:
+                policy = AttendancePolicy(
+                    schedule_id=schedule.id,
+                    start_time=schedule.start_time,
+                    end_time=schedule.end_time,
+                    work_start_time=schedule.start_time,
+                    late_threshold_minutes=(schedule.late_threshold_minutes
+                                            if schedule.late_threshold_minutes is not None
+                                            else late_threshold_minutes),
+                    duplicate_check_minutes=(schedule.duplicate_check_minutes
+                                             if schedule.duplicate_check_minutes is not None
+                                             else duplicate_check_minutes)
+                )
+
+            if timetable_version == timetable_cache.version:
+                self._policies[schedule_id] = policy
+            return policy
+
+
+# Global instance
+attendance_policies = AttendancePolicyCache()
@@ -4,14 +4,38 @@ Attendance Service
 from sqlalchemy.orm import Session
 from models.attendance import Attendance
 from models.user import User
-from datetime import datetime, time, timedelta
+from datetime import date, datetime, time, timedelta
 from config import settings
 from utils import get_current_time, get_today_range
 from typing import Optional
+import numpy as np
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Engine -> whether attendance has the unique session key INSERT ... ON CONFLICT needs
+_session_key_present = {}
+
+
+def supports_upsert(db: Session) -> bool:
+    """
+    True if check-ins can be upserted: PostgreSQL or SQLite, and the unique
+    (user_id, schedule_id, session_date) key exists (its migration may have
+    failed on an old table)
+    """
+    bind = db.get_bind()
+    if bind.dialect.name not in ("postgresql", "sqlite"):
+        return False
+    
+    present = _session_key_present.get(bind)
+    if present is None:
+        from utils.migrations import has_unique_key
+        present = has_unique_key(bind, "attendance", ["user_id", "schedule_id", "session_date"])
+        if not present:
+            logger.error("Attendance table has no unique session key - using the legacy duplicate check")
+        _session_key_present[bind] = present
+    return present
+
 
 class AttendanceService:
     @staticmethod
@@ -26,8 +50,21 @@ class AttendanceService:
         Returns:
             True if duplicate exists
         """
+        from services.attendance_buffer import attendance_buffer
+        
         today_start, today_end = get_today_range()
         
+        # Check-ins waiting in the write-behind buffer are not in the database yet. The buffer
+        # knows them by lesson occurrence: look up the one a check-in now would belong to
+        # (tomorrow's for an evening check-in to a lesson just after midnight)
+        if attendance_buffer.enabled:
+            from services.timetable import timetable_cache
+            now = get_current_time()
+            timetable = timetable_cache.get(db)
+            entry = timetable.resolve(now, user_id)
+            if attendance_buffer.seen_on(user_id, timetable.session_date(entry.id if entry else None, now)):
+                return True
+        
         existing = db.query(Attendance).filter(
             Attendance.user_id == user_id,
             Attendance.check_in_time >= today_start,
@@ -56,7 +93,8 @@ class AttendanceService:
         return settings
     
     @staticmethod
-    def determine_status(check_in_time: datetime, db: Session, schedule_id: Optional[int] = None) -> str:
+    def determine_status(check_in_time: datetime, db: Session, schedule_id: Optional[int] = None,
+                         session_date: Optional[date] = None) -> str:
         """
         Determine attendance status based on check-in time and dynamic settings
         
@@ -64,50 +102,21 @@ class AttendanceService:
             check_in_time: Check-in timestamp
             db: Database session
             schedule_id: Optional Schedule ID to check for specific settings
+            session_date: Date of the lesson occurrence (default: the check-in date)
             
         Returns:
             'present' or 'late'
         """
-        # Default values
-        late_threshold_minutes = None
-        work_start = None
-        
-        # 1. Check schedule-specific settings first
-        if schedule_id:
-            from models.schedule import Schedule
-            schedule = db.query(Schedule).filter(Schedule.id == schedule_id).first()
-            
-            if schedule:
-                # Use schedule start time
-                work_start = schedule.start_time
-                
-                # Use schedule-specific late threshold if set
-                if schedule.late_threshold_minutes is not None:
-                    late_threshold_minutes = schedule.late_threshold_minutes
+        from services.attendance_policy import attendance_policies
         
-        # 2. Fallback to global settings if not determined yet
-        settings = AttendanceService.get_current_settings(db)
-        
-        if settings:
-            if not work_start:
-                work_start = settings.work_start_time
-            
-            # Only use global late threshold if schedule didn't specify one
-            if late_threshold_minutes is None:
-                late_threshold_minutes = settings.late_threshold_minutes
-        else:
-            # Fallback to config settings
-            from config import settings as config_settings
-            if not work_start:
-                work_start_hour, work_start_minute = map(int, config_settings.WORK_START_TIME.split(':'))
-                work_start = time(work_start_hour, work_start_minute)
-            
-            if late_threshold_minutes is None:
-                late_threshold_minutes = config_settings.LATE_THRESHOLD_MINUTES
+        # Schedule overrides, active time settings and config, merged and cached
+        policy = attendance_policies.resolve(db, schedule_id)
+        work_start = policy.work_start_time
+        late_threshold_minutes = policy.late_threshold_minutes
         
         # Calculate late threshold
         late_threshold = datetime.combine(
-            check_in_time.date(),
+            session_date or check_in_time.date(),
             work_start
         ) + timedelta(minutes=late_threshold_minutes)
         
@@ -134,156 +143,19 @@ class AttendanceService:
         Returns:
             Schedule ID or None
         """
-        # 0=Monday, 6=Sunday
-        day_of_week = check_time.weekday()
-        current_time = check_time.time()
-        current_date = check_time.date()
-        
-        logger.info(f"=== JADVAL QIDIRUV BOSHLANDI ===")
-        logger.info(f"Vaqt: {check_time}")
-        logger.info(f"Hafta kuni: {day_of_week} (0=Dushanba, 6=Yakshanba)")
-        logger.info(f"Joriy vaqt: {current_time}")
-        logger.info(f"Joriy sana: {current_date}")
-        
-        # Find matching schedule
-        # We import here to avoid circular imports
-        from models.schedule import Schedule
-        from models.user import User
-        
-        # LOGICAL ERROR FIX #4: Allow early arrival (30 minutes before class)
-        # and prevent attendance after class ends
-        early_arrival_minutes = 30
-        
-        # First, get ALL schedules for debugging
-        all_schedules = db.query(Schedule).all()
-        logger.info(f"Bazada jami {len(all_schedules)} ta jadval mavjud")
-        
-        # Get schedules for this day
-        day_schedules = db.query(Schedule).filter(
-            Schedule.day_of_week == day_of_week
-        ).all()
-        logger.info(f"Hafta kuni {day_of_week} uchun {len(day_schedules)} ta jadval topildi")
-        for s in day_schedules:
-            logger.info(f"  Jadval {s.id}: {s.name}, vaqt: {s.start_time}-{s.end_time}, guruh: {s.group_id}, faol: {s.is_active}, effective_from: {s.effective_from}, effective_to: {s.effective_to}")
-        
-        # Get all schedules for this day
-        query = db.query(Schedule).filter(
-            Schedule.day_of_week == day_of_week,
-            Schedule.is_active == True
-        )
-        
-        
-        # Filter by effective dates
-        from sqlalchemy import or_, and_
-        from datetime import datetime as dt
-        
-        active_schedules = query.all()
-        logger.info(f"is_active=True filtridan keyin: {len(active_schedules)} ta jadval")
-        
-        # Convert current date to datetime for comparison (start of day)
-        # effective_from and effective_to are stored as datetime, so we need to compare with datetime
-        current_date_start = dt.combine(current_date, dt.min.time())
-        current_date_end = dt.combine(current_date, dt.max.time())
-        
-        logger.info(f"Sana solishtirish: current_date_start={current_date_start}, current_date_end={current_date_end}")
-        
-        query = query.filter(
-            and_(
-                or_(Schedule.effective_from.is_(None), Schedule.effective_from <= current_date_end),
-                or_(Schedule.effective_to.is_(None), Schedule.effective_to >= current_date_start)
-            )
-        )
-        
-        date_filtered_schedules = query.all()
-        logger.info(f"Sana filtridan keyin: {len(date_filtered_schedules)} ta jadval")
-        for s in date_filtered_schedules:
-            logger.info(f"  Jadval {s.id}: effective_from={s.effective_from}, effective_to={s.effective_to}, joriy_sana={current_date}")
-        
-        # If user_id provided, filter by user's groups
-        user_group_ids = []
-        if user_id:
-            user = db.query(User).filter(User.id == user_id).first()
-            if user:
-                logger.info(f"Foydalanuvchi: {user.id} ({user.full_name})")
-                if user.groups:
-                    user_group_ids = [g.id for g in user.groups]
-                    logger.info(f"Foydalanuvchi {user.id} guruhlari: {user_group_ids}")
-                else:
-                    logger.info(f"Foydalanuvchi {user.id} guruhga tegishli emas")
-            
-                # Only schedules for user's groups OR schedules without group (public)
-                before_group_filter = query.all()
-                logger.info(f"Guruh filtridan oldin: {len(before_group_filter)} ta jadval")
-                
-                query = query.filter(
-                    (Schedule.group_id.in_(user_group_ids)) | (Schedule.group_id == None)
-                )
-            else:
-                logger.warning(f"Foydalanuvchi {user_id} topilmadi")
-        
-        schedules = query.all()
-        logger.info(f"YAKUNIY NATIJA: Hafta kuni {day_of_week} uchun {len(schedules)} ta mos jadval topildi")
-        
-        if len(schedules) == 0:
-            logger.warning(f"OGOHLANTIRISH: Hech qanday jadval topilmadi!")
-            logger.warning(f"Qidiruv parametrlari: day_of_week={day_of_week}, is_active=True, sana={current_date}, guruhlar={user_group_ids}")
+        from services.timetable import timetable_cache
         
-        # Sort schedules to prioritize group-specific ones (group_id is not None)
-        # and then by start time
-        schedules.sort(key=lambda s: (s.group_id is None, s.start_time))
+        # Resolved from the compiled timetable: group schedules first, then by start time,
+        # check-in open from 30 minutes before start until end (no database access after
+        # the first call)
+        entry = timetable_cache.get(db).resolve(check_time, user_id)
         
-        # Find schedule within valid time range
-        for schedule in schedules:
-            # Check if schedule has specific settings
-            time_settings = AttendanceService.get_current_settings(db)
-            late_threshold = schedule.late_threshold_minutes or (time_settings.late_threshold_minutes if time_settings else 30)
-            
-            # Allow check-in 30 mins before start
-            earliest_time = (datetime.combine(check_time.date(), schedule.start_time) - timedelta(minutes=30))
-            # Allow check-in until end time
-            latest_time = datetime.combine(check_time.date(), schedule.end_time)
-            
-            # Handle midnight crossing schedules
-            # If earliest_time is before midnight but schedule starts after midnight
-            if earliest_time.date() < check_time.date():
-                # This means we crossed midnight backwards (e.g., 23:30 for 00:00 start)
-                # We need to check if current time is either:
-                # 1. After earliest_time on previous day (23:30-23:59)
-                # 2. Before latest_time on current day (00:00-end_time)
-                
-                # Check if we're in the late evening window (previous day)
-                if current_time >= earliest_time.time():
-                    # We're in the pre-midnight window
-                    pass  # Continue to group check
-                # Check if we're in the early morning window (current day)
-                elif current_time <= latest_time.time():
-                    # We're in the post-midnight window
-                    pass  # Continue to group check
-                else:
-                    logger.info(f"Checking Schedule {schedule.id}: {schedule.start_time}-{schedule.end_time} (Group: {schedule.group_id})")
-                    logger.info(f"  Skipping: Time {current_time} not in midnight-crossing window")
-                    continue
-            else:
-                # Normal case: no midnight crossing
-                if not (earliest_time.time() <= current_time <= latest_time.time()):
-                    logger.info(f"Checking Schedule {schedule.id}: {schedule.start_time}-{schedule.end_time} (Group: {schedule.group_id})")
-                    logger.info(f"  Skipping: Time {current_time} not in window {earliest_time.time()}-{latest_time.time()}")
-                    continue
-            
-            logger.info(f"Checking Schedule {schedule.id}: {schedule.start_time}-{schedule.end_time} (Group: {schedule.group_id})")
-            logger.info(f"  Window: {earliest_time.time()} - {latest_time.time()} vs Current: {current_time}")
-            
-            # Double check group authorization if it's a group schedule
-            if schedule.group_id and user_id:
-                 if schedule.group_id not in user_group_ids:
-                     logger.info(f"  Skipping: Schedule Group {schedule.group_id} not in User Groups {user_group_ids}")
-                     continue
-            
-            logger.info(f"  MATCH: Schedule {schedule.id}")
-            return schedule.id
+        if entry is None:
+            logger.info(f"Jadval topilmadi: vaqt={check_time}, hafta kuni={check_time.weekday()}, foydalanuvchi={user_id}")
+            return None
         
-        logger.info("No matching schedule found in loop")
-        return None
+        logger.info(f"Jadval topildi: {entry.id} ({entry.start_time}-{entry.end_time}, guruh: {entry.group_id}), foydalanuvchi={user_id}")
+        return entry.id
     
     @staticmethod
     def check_duplicate_attendance(db: Session, user_id: int, schedule_id: Optional[int] = None) -> tuple[bool, Attendance]:
@@ -303,108 +175,79 @@ class AttendanceService:
         logger.info(f"=== TAKRORIY DAVOMAT TEKSHIRUVI ===")
         logger.info(f"Foydalanuvchi: {user_id}, Jadval: {schedule_id}")
         
+        from services.attendance_policy import attendance_policies
+        from services.timetable import timetable_cache
+        
         current_time = get_current_time()
+        policy = attendance_policies.resolve(db, schedule_id)
+        duplicate_check_minutes = policy.duplicate_check_minutes
         
         # LOGICAL ERROR FIX #5: Check within class time range, not just today
-        if schedule_id:
-            from models.schedule import Schedule
-            schedule = db.query(Schedule).filter(Schedule.id == schedule_id).first()
+        if policy.schedule_id:
+            logger.info(f"Jadval sozlamalari: duplicate_check_minutes={duplicate_check_minutes}")
             
-            if schedule:
-                logger.info(f"Jadval topildi: {schedule.name}")
-                logger.info(f"Jadval sozlamalari: duplicate_check_minutes={schedule.duplicate_check_minutes}")
-                
-                # Get today's date
-                today = current_time.date()
-                
-                # Calculate class time range for today
-                class_start = datetime.combine(today, schedule.start_time)
-                class_end = datetime.combine(today, schedule.end_time)
-                
-                # Make them timezone aware if they aren't
-                if class_start.tzinfo is None:
-                    class_start = class_start.replace(tzinfo=current_time.tzinfo)
-                if class_end.tzinfo is None:
-                    class_end = class_end.replace(tzinfo=current_time.tzinfo)
+            # Date of this lesson occurrence (tomorrow for an evening check-in to a lesson just after midnight)
+            today = timetable_cache.get(db).session_date(schedule_id, current_time)
+            
+            # Calculate class time range for that date
+            class_start = datetime.combine(today, policy.start_time)
+            class_end = datetime.combine(today, policy.end_time)
+            
+            # Make them timezone aware if they aren't
+            if class_start.tzinfo is None:
+                class_start = class_start.replace(tzinfo=current_time.tzinfo)
+            if class_end.tzinfo is None:
+                class_end = class_end.replace(tzinfo=current_time.tzinfo)
+            
+            # Allow early arrival (30 minutes before)
+            early_arrival_minutes = 30
+            earliest_allowed = class_start - timedelta(minutes=early_arrival_minutes)
+            
+            logger.info(f"Dars vaqti oralig'i: {earliest_allowed} - {class_end}")
+            
+            # Check if user already attended THIS schedule within THIS class time range
+            # We strictly check for the SAME schedule_id
+            existing = db.query(Attendance).filter(
+                Attendance.user_id == user_id,
+                Attendance.schedule_id == schedule_id,
+                Attendance.check_in_time >= earliest_allowed,
+                Attendance.check_in_time <= class_end
+            ).first()
+            
+            if existing:
+                logger.info(f"Dars vaqti oralig'ida davomat topildi (ID: {existing.id})")
+                logger.info(f"Birinchi davomat: {existing.check_in_time}")
+                logger.info(f"Oxirgi ko'rilgan: {existing.last_seen_time}")
+                logger.info(f"Duplicate check: {duplicate_check_minutes} daqiqa")
                 
-                # Allow early arrival (30 minutes before)
-                early_arrival_minutes = 30
-                earliest_allowed = class_start - timedelta(minutes=early_arrival_minutes)
+                # Ensure last_seen_time is timezone aware for comparison
+                last_seen = existing.last_seen_time
+                if last_seen.tzinfo is None:
+                    # Assume it's in the same timezone as current_time
+                    last_seen = last_seen.replace(tzinfo=current_time.tzinfo)
                 
-                logger.info(f"Dars vaqti oralig'i: {earliest_allowed} - {class_end}")
+                time_since_last = current_time - last_seen
+                minutes_since_last = time_since_last.total_seconds() / 60
                 
-                # Check if user already attended THIS schedule within THIS class time range
-                # We strictly check for the SAME schedule_id
-                existing = db.query(Attendance).filter(
-                    Attendance.user_id == user_id,
-                    Attendance.schedule_id == schedule_id,
-                    Attendance.check_in_time >= earliest_allowed,
-                    Attendance.check_in_time <= class_end
-                ).first()
+                logger.info(f"Oxirgi ko'rilgandan beri: {minutes_since_last:.1f} daqiqa")
                 
-                if existing:
-                    logger.info(f"Dars vaqti oralig'ida davomat topildi (ID: {existing.id})")
-                    logger.info(f"Birinchi davomat: {existing.check_in_time}")
-                    logger.info(f"Oxirgi ko'rilgan: {existing.last_seen_time}")
-                    
-                    # Check if duplicate_check_minutes has passed since last_seen_time
-                    duplicate_check_minutes = schedule.duplicate_check_minutes
-                    if duplicate_check_minutes is None:
-                        # Use global settings
-                        settings_obj = AttendanceService.get_current_settings(db)
-                        duplicate_check_minutes = settings_obj.duplicate_check_minutes if settings_obj else 60
-                    
-                    logger.info(f"Duplicate check: {duplicate_check_minutes} daqiqa")
-                    
-                    # Ensure last_seen_time is timezone aware for comparison
-                    last_seen = existing.last_seen_time
-                    if last_seen.tzinfo is None:
-                        # Assume it's in the same timezone as current_time
-                        last_seen = last_seen.replace(tzinfo=current_time.tzinfo)
-                    
-                    time_since_last = current_time - last_seen
-                    minutes_since_last = time_since_last.total_seconds() / 60
-                    
-                    logger.info(f"Oxirgi ko'rilgandan beri: {minutes_since_last:.1f} daqiqa")
-                    
-                    if minutes_since_last >= duplicate_check_minutes:
-                        # Enough time has passed - should update
-                        logger.info(f"✅ Vaqt o'tgan - yangilash kerak")
-                        return True, existing, True  # (is_duplicate, record, should_update)
-                    else:
-                        # Not enough time - reject
-                        logger.warning(f"❌ Vaqt o'tmagan - rad etish")
-                        return True, existing, False  # (is_duplicate, record, should_update)
+                if minutes_since_last >= duplicate_check_minutes:
+                    # Enough time has passed - should update
+                    logger.info(f"✅ Vaqt o'tgan - yangilash kerak")
+                    return True, existing, True  # (is_duplicate, record, should_update)
                 else:
-                    logger.info(f"Dars vaqti oralig'ida takroriy davomat yo'q")
-                    # IMPORTANT: If we are in a specific schedule, we do NOT fall back to global time check
-                    # because that would merge attendance with previous classes.
-                    # If it's a new schedule, it's a NEW attendance.
-                    return False, None, False
-
-        # Fallback to time-based check ONLY if no schedule_id provided (legacy/manual mode)
-        if not schedule_id:
-            logger.info(f"Jadval aniqlanmadi - vaqtga asoslangan tekshiruvga o'tish...")
-
-        
-        if schedule_id:
-            from models.schedule import Schedule
-            schedule = db.query(Schedule).filter(Schedule.id == schedule_id).first()
-            if schedule and schedule.duplicate_check_minutes is not None:
-                duplicate_check_minutes = schedule.duplicate_check_minutes
-                logger.info(f"Jadval sozlamasi ishlatildi: {duplicate_check_minutes} daqiqa")
-        
-        # If not set in schedule, get from global settings
-        if duplicate_check_minutes is None:
-            settings = AttendanceService.get_current_settings(db)
-            
-            if settings:
-                duplicate_check_minutes = settings.duplicate_check_minutes
-                logger.info(f"Global sozlama ishlatildi: {duplicate_check_minutes} daqiqa")
+                    # Not enough time - reject
+                    logger.warning(f"❌ Vaqt o'tmagan - rad etish")
+                    return True, existing, False  # (is_duplicate, record, should_update)
             else:
-                # Default: check for today only (legacy behavior)
-                duplicate_check_minutes = 60  # Default 60 mins
-                logger.info(f"Default sozlama ishlatildi: {duplicate_check_minutes} daqiqa")
+                logger.info(f"Dars vaqti oralig'ida takroriy davomat yo'q")
+                # IMPORTANT: If we are in a specific schedule, we do NOT fall back to global time check
+                # because that would merge attendance with previous classes.
+                # If it's a new schedule, it's a NEW attendance.
+                return False, None, False
+
+        # Fallback to time-based check ONLY if no schedule applies (legacy/manual mode)
+        logger.info(f"Jadval aniqlanmadi - vaqtga asoslangan tekshiruvga o'tish ({duplicate_check_minutes} daqiqa)")
         
         # Calculate time window
         check_from = current_time - timedelta(minutes=duplicate_check_minutes)
@@ -449,12 +292,10 @@ class AttendanceService:
         Raises:
             ValueError: If no active schedule found or user not authorized
         """
-        from models.user import User
-        from models.schedule import Schedule
-        
         check_in_time = get_current_time()
         
-        # 1. Determine current schedule (with user group validation)
+        # 1. Determine current schedule (the timetable only returns the user's group schedules
+        #    and public ones, so this is also the group validation)
         schedule_id = AttendanceService.get_active_schedule_at_time(db, check_in_time, user_id)
         
         # LOGICAL ERROR FIX #3: Check if schedule exists
@@ -462,17 +303,21 @@ class AttendanceService:
             logger.warning(f"No active schedule found at {check_in_time} for user {user_id}")
             raise ValueError("Hozir hech qanday dars yo'q yoki siz bu darsga ruxsatingiz yo'q")
         
-        # LOGICAL ERROR FIX #2: Validate user is in the schedule's group
-        schedule = db.query(Schedule).filter(Schedule.id == schedule_id).first()
-        if schedule and schedule.group_id:
-            user = db.query(User).filter(User.id == user_id).first()
-            if user:
-                user_group_ids = [g.id for g in user.groups]
-                if schedule.group_id not in user_group_ids:
-                    logger.warning(f"User {user_id} not authorized for schedule {schedule_id} (group {schedule.group_id})")
-                    raise ValueError(f"Siz '{schedule.name}' darsiga ruxsatingiz yo'q (guruh mos emas)")
-        
-        # 2. Check for duplicate attendance
+        # 2. Insert or update the record of this lesson occurrence
+        from services.timetable import timetable_cache
+        upsert = supports_upsert(db)
+        if upsert and settings.ATTENDANCE_WRITE_BEHIND:
+            # In memory now, written by the buffer's next batch
+            from services.attendance_buffer import attendance_buffer
+            return attendance_buffer.record(
+                db, user_id, device_id, schedule_id, check_in_time, confidence, image_path
+            )
+        if upsert:
+            return AttendanceService.upsert_attendance(
+                db, user_id, device_id, schedule_id, check_in_time, confidence, image_path
+            )
+        
+        # Other databases (or no unique session key): check for duplicate attendance, then insert
         is_duplicate, last_attendance, should_update = AttendanceService.check_duplicate_attendance(db, user_id, schedule_id)
         
         if is_duplicate:
@@ -498,7 +343,8 @@ class AttendanceService:
                 logger.info(f"❌ Takroriy davomat rad etildi: user {user_id}. Last: {last_attendance.check_in_time}")
                 return last_attendance
         
-        status = AttendanceService.determine_status(check_in_time, db, schedule_id)
+        session_date = timetable_cache.get(db).session_date(schedule_id, check_in_time)
+        status = AttendanceService.determine_status(check_in_time, db, schedule_id, session_date)
         
         attendance = Attendance(
             user_id=user_id,
@@ -508,6 +354,7 @@ class AttendanceService:
             image_path=image_path,
             status=status,
             schedule_id=schedule_id,  # Link to schedule
+            session_date=session_date,
             detection_count=1,  # First detection
             last_seen_time=check_in_time  # Same as check_in_time initially
         )
@@ -520,6 +367,87 @@ class AttendanceService:
         
         return attendance
     
+    @staticmethod
+    def upsert_attendance(
+        db: Session,
+        user_id: int,
+        device_id: int,
+        schedule_id: int,
+        check_in_time: datetime,
+        confidence: float,
+        image_path: str = None
+    ) -> Attendance:
+        """
+        Record a sighting of the user in a lesson occurrence with one INSERT ... ON CONFLICT
+        
+        The first sighting inserts the record. Later ones bump detection_count and
+        last_seen_time, keep the highest confidence and the latest image, but only
+        once duplicate_check_minutes have passed since the user was last seen.
+        The unique (user_id, schedule_id, session_date) key makes concurrent
+        check-ins from several devices land on the same row.
+        
+        Returns:
+            The inserted or updated record, or the unchanged one if seen too recently
+        """
+        from sqlalchemy import case, func
+        from services.attendance_policy import attendance_policies
+        from services.timetable import timetable_cache
+        
+        if db.get_bind().dialect.name == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        
+        policy = attendance_policies.resolve(db, schedule_id)
+        # The occurrence's start date: a check-in the evening before a lesson just after midnight counts for that lesson
+        session_date = timetable_cache.get(db).session_date(schedule_id, check_in_time)
+        status = AttendanceService.determine_status(check_in_time, db, schedule_id, session_date)
+        seen_before = check_in_time - timedelta(minutes=policy.duplicate_check_minutes)
+        
+        stmt = insert(Attendance).values(
+            user_id=user_id,
+            device_id=device_id,
+            schedule_id=schedule_id,
+            session_date=session_date,
+            check_in_time=check_in_time,
+            confidence=confidence,
+            image_path=image_path,
+            status=status,
+            detection_count=1,
+            last_seen_time=check_in_time
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[Attendance.user_id, Attendance.schedule_id, Attendance.session_date],
+            set_={
+                "detection_count": Attendance.detection_count + 1,
+                "last_seen_time": stmt.excluded.last_seen_time,
+                "confidence": case(
+                    (stmt.excluded.confidence > Attendance.confidence, stmt.excluded.confidence),
+                    else_=Attendance.confidence
+                ),
+                "image_path": func.coalesce(stmt.excluded.image_path, Attendance.image_path)
+            },
+            where=Attendance.last_seen_time <= seen_before
+        ).returning(Attendance)
+        
+        attendance = db.scalars(stmt, execution_options={"populate_existing": True}).first()
+        db.commit()
+        
+        if attendance is None:
+            # Seen again within duplicate_check_minutes - the record is left as it is
+            attendance = db.query(Attendance).filter(
+                Attendance.user_id == user_id,
+                Attendance.schedule_id == schedule_id,
+                Attendance.session_date == session_date
+            ).first()
+            logger.info(f"❌ Takroriy davomat rad etildi: user {user_id}. Last: {attendance.last_seen_time if attendance else None}")
+        elif attendance.detection_count > 1:
+            logger.info(f"✅ Davomat yangilandi: user {user_id}, count={attendance.detection_count}")
+        else:
+            logger.info(f"Attendance created for user {user_id}: {status} at {check_in_time} (Schedule: {schedule_id})")
+        
+        return attendance
+    
     @staticmethod
     def get_today_attendance(db: Session):
         """Get all attendance records for today"""
@@ -570,105 +498,95 @@ class AttendanceService:
         """
         from models.schedule import Schedule
         from models.group import user_groups
-        from sqlalchemy import and_, or_
+        from services.timetable import EARLY_ARRIVAL_MINUTES
+        from sqlalchemy import or_, select
         
         end_date = get_current_time()
         start_date = end_date - timedelta(days=days)
+        first_day = start_date.date()
+        last_day = end_date.date()
+        now = datetime.now()
         
-        # Get user's groups to know which schedules apply
-        user_group_ids = [g[0] for g in db.query(user_groups.c.group_id).filter(user_groups.c.user_id == user_id).all()]
+        # Schedules of the user's groups and public ones that overlap the period (one query)
+        user_group_ids = select(user_groups.c.group_id).where(user_groups.c.user_id == user_id)
+        schedules = db.query(
+            Schedule.id, Schedule.day_of_week, Schedule.start_time, Schedule.end_time,
+            Schedule.effective_from, Schedule.effective_to
+        ).filter(
+            Schedule.is_active == True,
+            or_(Schedule.group_id.in_(user_group_ids), Schedule.group_id.is_(None)),
+            or_(Schedule.effective_from.is_(None), Schedule.effective_from <= datetime.combine(last_day, datetime.max.time())),
+            or_(Schedule.effective_to.is_(None), Schedule.effective_to >= datetime.combine(first_day, datetime.min.time()))
+        ).all()
         
-        # Get all attendance records in range
-        records = db.query(Attendance).filter(
+        # Attendance records in range (one query)
+        records = db.query(Attendance.schedule_id, Attendance.check_in_time, Attendance.status).filter(
             Attendance.user_id == user_id,
             Attendance.check_in_time >= start_date,
             Attendance.check_in_time <= end_date
         ).all()
         
-        present_count = len([r for r in records if r.status == "present"])
-        late_count = len([r for r in records if r.status == "late"])
+        present_count = sum(1 for r in records if r.status == "present")
+        late_count = sum(1 for r in records if r.status == "late")
         
-        # Calculate expected attendance (days with active schedules)
+        # Expected sessions: every (schedule, day) in the period on the schedule's weekday,
+        # inside its effective dates and already over
         expected_attendance_count = 0
-        
-        # Iterate through each day in the past 'days'
-        current_check_date = start_date.date()
-        end_check_date = end_date.date()
-        now = datetime.now()
-        
-        while current_check_date <= end_check_date:
-            day_of_week = current_check_date.weekday()
+        if schedules:
+            day_values = np.arange(np.datetime64(first_day, "D"), np.datetime64(last_day, "D") + 1)
+            weekdays = (day_values.astype(np.int64) + 3) % 7  # 1970-01-01 was a Thursday
             
-            # Get active schedules for this day
-            # We reuse the logic from get_active_schedule_at_time but simplified for stats
-            check_dt_start = datetime.combine(current_check_date, datetime.min.time())
-            check_dt_end = datetime.combine(current_check_date, datetime.max.time())
+            no_limit = np.iinfo(np.int64).max
+            schedule_ids = np.array([s.id for s in schedules], dtype=np.int64)
+            day_of_week = np.array([s.day_of_week for s in schedules], dtype=np.int64)
+            effective_from = np.array([
+                np.datetime64(s.effective_from.date(), "D").astype(np.int64) if s.effective_from else -no_limit
+                for s in schedules
+            ], dtype=np.int64)
+            effective_to = np.array([
+                np.datetime64(s.effective_to.date(), "D").astype(np.int64) if s.effective_to else no_limit
+                for s in schedules
+            ], dtype=np.int64)
+            start_offsets = np.array([_time_offset(s.start_time) for s in schedules], dtype="timedelta64[us]")
+            end_offsets = np.array([_time_offset(s.end_time) for s in schedules], dtype="timedelta64[us]")
             
-            day_schedules = db.query(Schedule).filter(
-                and_(
-                    Schedule.is_active == True,
-                    Schedule.day_of_week == day_of_week,
-                    or_(Schedule.effective_from.is_(None), Schedule.effective_from <= check_dt_end),
-                    or_(Schedule.effective_to.is_(None), Schedule.effective_to >= check_dt_start),
-                    or_(
-                        Schedule.group_id.in_(user_group_ids) if user_group_ids else Schedule.group_id.is_(None),
-                        Schedule.group_id.is_(None)
-                    )
-                )
-            ).all()
+            day_numbers = day_values.astype(np.int64)
+            matches = (
+                (weekdays[None, :] == day_of_week[:, None])
+                & (day_numbers[None, :] >= effective_from[:, None])
+                & (day_numbers[None, :] <= effective_to[:, None])
+            )
+            schedule_index, day_index = np.nonzero(matches)
             
-            for schedule in day_schedules:
-                # Check if this specific class time has passed
-                schedule_end_dt = datetime.combine(current_check_date, schedule.end_time)
-                
-                # If class is in the future, skip
-                if schedule_end_dt > now:
-                    continue
-                    
-                # Check if user attended THIS schedule
-                # We check if any record exists for this schedule_id on this date
-                # OR if any record exists within the time window (fallback)
-                
-                attended = False
-                
-                # 1. Check by schedule_id (most reliable)
-                attended_by_id = any(
-                    r.schedule_id == schedule.id and r.check_in_time.date() == current_check_date 
-                    for r in records
-                )
-                
-                if attended_by_id:
-                    attended = True
-                else:
-                    # 2. Fallback: Check by time overlap
-                    # If a record exists within start-30min and end time
-                    earliest = datetime.combine(current_check_date, schedule.start_time) - timedelta(minutes=30)
-                    latest = datetime.combine(current_check_date, schedule.end_time)
-                    
-                    attended_by_time = False
-                    for r in records:
-                        # Handle timezone awareness for comparison
-                        r_time = r.check_in_time
-                        local_earliest = earliest
-                        local_latest = latest
-                        
-                        if r_time.tzinfo is not None:
-                            if local_earliest.tzinfo is None:
-                                local_earliest = local_earliest.replace(tzinfo=r_time.tzinfo)
-                            if local_latest.tzinfo is None:
-                                local_latest = local_latest.replace(tzinfo=r_time.tzinfo)
-                        
-                        if local_earliest <= r_time <= local_latest:
-                            attended_by_time = True
-                            break
-                    if attended_by_time:
-                        attended = True
-                
-                if not attended:
-                    expected_attendance_count += 1
+            day_starts = day_values[day_index].astype("datetime64[us]")
+            earliest = day_starts + start_offsets[schedule_index] - np.timedelta64(EARLY_ARRIVAL_MINUTES, "m")
+            latest = day_starts + end_offsets[schedule_index]
+            
+            # Lessons still to come are not missed yet
+            past = latest <= np.datetime64(now, "us")
+            schedule_index, day_index = schedule_index[past], day_index[past]
+            earliest, latest = earliest[past], latest[past]
+            
+            # Record times as wall-clock local time, like the schedule times
+            record_times = [
+                r.check_in_time.replace(tzinfo=None) for r in records if r.check_in_time is not None
+            ]
+            
+            # 1. Attended by schedule id: a record of that schedule on that day
+            session_keys = schedule_ids[schedule_index] * 1000000 + day_numbers[day_index]
+            record_keys = np.array([
+                r.schedule_id * 1000000 + np.datetime64(r.check_in_time.date(), "D").astype(np.int64)
+                for r in records if r.schedule_id is not None and r.check_in_time is not None
+            ], dtype=np.int64)
+            attended = np.isin(session_keys, record_keys)
             
-            current_check_date += timedelta(days=1)
+            # 2. Fallback: any record inside the check-in window (sorted merge)
+            times = np.sort(np.array(record_times, dtype="datetime64[us]"))
+            in_window = np.searchsorted(times, latest, side="right") > np.searchsorted(times, earliest, side="left")
+            attended |= in_window
             
+            expected_attendance_count = int(np.count_nonzero(~attended))
+        
         absent_count = expected_attendance_count
         
         # Total "opportunities" is present + late + absent
@@ -686,5 +604,10 @@ class AttendanceService:
         }
 
 
+def _time_offset(value: time) -> int:
+    """Microseconds from midnight to a time of day"""
+    return ((value.hour * 60 + value.minute) * 60 + value.second) * 1000000 + value.microsecond
+
+
 # Global instance
 attendance_service = AttendanceService()
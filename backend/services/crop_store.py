@@ -0,0 +1,176 @@
+"""
+Crop Store - aligned face crops kept next to the embeddings
+
+The aligned crop (the recognition model input, 112x112 BGR) is what every
+embedding is computed from. With it stored, re-embedding with another model
+or an offline evaluation only runs the recognition network - no decoding of
+full frames and no detection.
+
+Layout under settings.CROP_DIR:
+    faces/user_<id>.npz         enrolled faces of one user: face_ids, crops
+    attendance/<YYYY-MM-DD>.crops  fixed-size records appended during the day
+                                (read back with read_attendance_crops)
+"""
+import numpy as np
+from datetime import date, datetime
+from typing import Dict, Optional, Sequence, Tuple
+from config import settings
+import os
+import threading
+import logging
+
+try:
+    import fcntl
+except ImportError:  # Windows - single worker, no cross-process lock needed
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+CROP_SIZE = 112
+ATTENDANCE_RECORD = np.dtype([
+    ("time", "<f8"),  # Unix timestamp
+    ("device_id", "<i8"),
+    ("user_id", "<i8"),  # -1 when the face was not recognized
+    ("face_id", "<i8"),  # Matched enrolled face, -1 if none
+    ("confidence", "<f4"),
+    ("crop", "u1", (CROP_SIZE, CROP_SIZE, 3)),
+])
+
+
+class CropStore:
+    """Per-user npz files of enrolled crops and daily append-only attendance crop files"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return settings.STORE_FACE_CROPS
+
+    def _user_path(self, user_id: int) -> str:
+        return os.path.join(settings.CROP_DIR, "faces", f"user_{user_id}.npz")
+
+    def _attendance_path(self, day: date) -> str:
+        return os.path.join(settings.CROP_DIR, "attendance", f"{day.isoformat()}.crops")
+
+    @staticmethod
+    def _valid(crop: Optional[np.ndarray]) -> bool:
+        return crop is not None and crop.shape == (CROP_SIZE, CROP_SIZE, 3)
+
+    # Enrolled faces
+
+    def load_user(self, user_id: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Enrolled crops of one user
+
+        Returns:
+            (face_ids, crops) - crops is (n, 112, 112, 3) uint8
+        """
+        try:
+            with np.load(self._user_path(user_id)) as data:
+                return data["face_ids"], data["crops"]
+        except (OSError, KeyError, ValueError):
+            return np.empty(0, dtype=np.int64), np.empty((0, CROP_SIZE, CROP_SIZE, 3), dtype=np.uint8)
+
+    def user_crops(self, user_id: int) -> Dict[int, np.ndarray]:
+        face_ids, crops = self.load_user(user_id)
+        return {int(face_id): crop for face_id, crop in zip(face_ids, crops)}
+
+    def _write_user(self, user_id: int, face_ids: np.ndarray, crops: np.ndarray):
+        path = self._user_path(user_id)
+        if len(face_ids) == 0:
+            if os.path.exists(path):
+                os.remove(path)
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez_compressed(tmp_path, face_ids=face_ids.astype(np.int64), crops=crops.astype(np.uint8))
+        os.replace(tmp_path, path)
+
+    def add_faces(self, user_id: int, face_ids: Sequence[int], crops: Sequence[np.ndarray]):
+        """Add the crops of newly enrolled faces (one file rewrite per call)"""
+        if not self.enabled:
+            return
+        pairs = [(int(f), c) for f, c in zip(face_ids, crops) if self._valid(c)]
+        if not pairs:
+            return
+        try:
+            with self._lock:
+                stored_ids, stored_crops = self.load_user(user_id)
+                new_ids = np.array([f for f, _ in pairs], dtype=np.int64)
+                keep = ~np.isin(stored_ids, new_ids)
+                self._write_user(
+                    user_id,
+                    np.concatenate([stored_ids[keep], new_ids]),
+                    np.concatenate([stored_crops[keep], np.stack([c for _, c in pairs])])
+                )
+        except Exception as e:
+            logger.error(f"Failed to store face crops of user {user_id}: {e}")
+
+    def add_face(self, user_id: int, face_id: int, crop: Optional[np.ndarray]):
+        self.add_faces(user_id, [face_id], [crop])
+
+    def remove_face(self, user_id: int, face_id: int):
+        """Drop the crop of a deleted face"""
+        try:
+            with self._lock:
+                face_ids, crops = self.load_user(user_id)
+                keep = face_ids != face_id
+                if not keep.all():
+                    self._write_user(user_id, face_ids[keep], crops[keep])
+        except Exception as e:
+            logger.error(f"Failed to remove face crop {face_id}: {e}")
+
+    # Attendance frames
+
+    def append_attendance(
+        self,
+        crop: Optional[np.ndarray],
+        device_id: int,
+        user_id: Optional[int] = None,
+        face_id: Optional[int] = None,
+        confidence: float = 0.0,
+        when: Optional[datetime] = None
+    ):
+        """Append one recognition crop to today's file"""
+        if not settings.STORE_ATTENDANCE_CROPS or not self._valid(crop):
+            return
+        when = when or datetime.now()
+
+        record = np.zeros(1, dtype=ATTENDANCE_RECORD)
+        record["time"] = when.timestamp()
+        record["device_id"] = device_id
+        record["user_id"] = -1 if user_id is None else user_id
+        record["face_id"] = -1 if face_id is None else face_id
+        record["confidence"] = confidence
+        record["crop"] = crop
+
+        path = self._attendance_path(when.date())
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with self._lock, open(path, "ab") as f:
+                # Whole records only, also with several workers appending
+                if fcntl is not None:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+                try:
+                    f.write(record.tobytes())
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+        except OSError as e:
+            logger.error(f"Failed to store attendance crop: {e}")
+
+    def read_attendance_crops(self, day: date) -> np.ndarray:
+        """Attendance records of a day (read-only memory map, empty if none)"""
+        path = self._attendance_path(day)
+        try:
+            rows = os.path.getsize(path) // ATTENDANCE_RECORD.itemsize
+        except OSError:
+            rows = 0
+        if rows == 0:
+            return np.empty(0, dtype=ATTENDANCE_RECORD)
+        return np.memmap(path, dtype=ATTENDANCE_RECORD, mode="r", shape=(rows,))
+
+
+# Global instance
+crop_store = CropStore()
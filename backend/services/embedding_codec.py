@@ -0,0 +1,134 @@
+"""
+Embedding Codec - compact float16 / int8 representations of face embeddings
+
+float32: 4 bytes per dimension (2048 bytes for 512-d), the original format
+float16: 2 bytes per dimension
+int8:    1 byte per dimension plus a float32 scale per vector
+"""
+import numpy as np
+from typing import Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+CODECS = ("float32", "float16", "int8")
+
+# Rows converted to float32 at a time when scoring a compact matrix
+# (small enough for the chunk to stay in cache)
+SCORE_CHUNK = 1024
+
+
+def check_codec(codec: str) -> str:
+    codec = (codec or "float32").lower()
+    if codec not in CODECS:
+        raise ValueError(f"Unknown embedding codec '{codec}', expected one of {CODECS}")
+    return codec
+
+
+def encode(embedding: np.ndarray, codec: str = "float32") -> bytes:
+    """Serialize one embedding for the faces.embedding column"""
+    codec = check_codec(codec)
+    vector = np.asarray(embedding, dtype=np.float32).ravel()
+
+    if codec == "float32":
+        return vector.tobytes()
+    if codec == "float16":
+        return vector.astype(np.float16).tobytes()
+
+    peak = float(np.abs(vector).max()) if len(vector) else 0.0
+    scale = np.float32(peak / 127 if peak > 0 else 1.0)
+    codes = np.clip(np.round(vector / scale), -127, 127).astype(np.int8)
+    return scale.tobytes() + codes.tobytes()
+
+
+def infer_codec(data: bytes, dim: int = 512) -> str:
+    """Guess the codec of a stored embedding from its length"""
+    if len(data) == dim * 4:
+        return "float32"
+    if len(data) == dim * 2:
+        return "float16"
+    if len(data) == dim + 4:
+        return "int8"
+    raise ValueError(f"Cannot infer embedding codec from {len(data)} bytes")
+
+
+def decode(data: bytes, codec: Optional[str] = None) -> np.ndarray:
+    """Deserialize a stored embedding to float32"""
+    codec = check_codec(codec) if codec else infer_codec(data)
+
+    if codec == "float32":
+        return np.frombuffer(data, dtype=np.float32)
+    if codec == "float16":
+        return np.frombuffer(data, dtype=np.float16).astype(np.float32)
+
+    scale = np.frombuffer(data[:4], dtype=np.float32)[0]
+    return np.frombuffer(data[4:], dtype=np.int8).astype(np.float32) * scale
+
+
+def to_memory(matrix: np.ndarray, codec: str = "float32") -> np.ndarray:
+    """
+    Convert a float32 matrix to the in-memory representation of a codec
+
+    int8 rows are a structured array (codes + scale), so slicing, masking,
+    np.insert and np.delete work the same way for every codec.
+    """
+    codec = check_codec(codec)
+    matrix = np.asarray(matrix, dtype=np.float32)
+
+    if codec == "float32":
+        return np.ascontiguousarray(matrix)
+    if codec == "float16":
+        return np.ascontiguousarray(matrix.astype(np.float16))
+
+    dtype = np.dtype([("codes", np.int8, (matrix.shape[1],)), ("scale", np.float32)])
+    rows = np.empty(len(matrix), dtype=dtype)
+    peaks = np.abs(matrix).max(axis=1) if len(matrix) else np.empty(0, dtype=np.float32)
+    scales = np.where(peaks > 0, peaks / 127, 1.0).astype(np.float32)
+    rows["scale"] = scales
+    rows["codes"] = np.clip(np.round(matrix / scales[:, None]), -127, 127).astype(np.int8)
+    return rows
+
+
+def as_float32(matrix: np.ndarray) -> np.ndarray:
+    """Decode an in-memory matrix (any codec) to float32"""
+    if matrix.dtype.names:
+        return matrix["codes"].astype(np.float32) * matrix["scale"][:, None]
+    return np.asarray(matrix, dtype=np.float32)
+
+
+def dimension(matrix: np.ndarray) -> int:
+    """Embedding dimension of an in-memory matrix (any codec)"""
+    if matrix.dtype.names:
+        return matrix.dtype["codes"].shape[0]
+    return matrix.shape[1]
+
+
+def memory_codec(matrix: np.ndarray) -> str:
+    if matrix.dtype.names:
+        return "int8"
+    return "float16" if matrix.dtype == np.float16 else "float32"
+
+
+def dot(matrix: np.ndarray, query: np.ndarray) -> np.ndarray:
+    """
+    Scores of every row against a float32 query
+
+    Compact matrices are converted in chunks so the float32 copy never exceeds
+    SCORE_CHUNK rows.
+    """
+    query = np.asarray(query, dtype=np.float32)
+    if matrix.dtype == np.float32:
+        return matrix @ query
+
+    scores = np.empty(len(matrix), dtype=np.float32)
+    buffer = np.empty((min(SCORE_CHUNK, len(matrix)), dimension(matrix)), dtype=np.float32)
+    for start in range(0, len(matrix), SCORE_CHUNK):
+        chunk = matrix[start:start + SCORE_CHUNK]
+        rows = buffer[:len(chunk)]
+        if chunk.dtype.names:
+            np.copyto(rows, chunk["codes"])
+            scores[start:start + len(chunk)] = (rows @ query) * chunk["scale"]
+        else:
+            np.copyto(rows, chunk)
+            scores[start:start + len(chunk)] = rows @ query
+    return scores
@@ -0,0 +1,276 @@
+"""
+Enrollment Service - bulk face registration from an archive or a directory
+
+Layout of the source (zip or directory):
+    <employee_id>/<any name>.jpg   one folder per user, any number of images
+    <employee_id>.jpg              or a single image named after the user
+"""
+import numpy as np
+import cv2
+from datetime import datetime
+from typing import AsyncIterator, Iterable, Iterator, Optional, Tuple
+from sqlalchemy.orm import Session
+from config import settings
+from models.face import Face
+from models.user import User
+from services.face_recognition_service import face_recognition_service
+from services.face_index import face_embedding_index
+from services.crop_store import crop_store
+from services.inference_pool import InferenceQueueFull
+import asyncio
+import hashlib
+import os
+import zipfile
+import logging
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".webp"}
+
+# Per-image result codes
+STATUS_OK = "ok"
+STATUS_NO_FACE = "no_face"
+STATUS_MULTI_FACE = "multi_face"
+STATUS_UNKNOWN_USER = "unknown_user"
+STATUS_INVALID_IMAGE = "invalid_image"
+STATUS_ERROR = "error"
+
+
+def _employee_id_from_path(name: str) -> Optional[str]:
+    """employee_id of an archive/directory entry, None if it is not an image"""
+    parts = [p for p in name.replace("\\", "/").split("/") if p]
+    if not parts or any(p.startswith(".") or p == "__MACOSX" for p in parts):
+        return None
+    stem, ext = os.path.splitext(parts[-1])
+    if ext.lower() not in IMAGE_EXTENSIONS:
+        return None
+    # Use the innermost folder; images at the top level are named after the user
+    return parts[-2] if len(parts) >= 2 else stem
+
+
+def iter_zip(source) -> Iterator[Tuple[str, str, bytes]]:
+    """Yield (employee_id, entry name, bytes) from a zip path or file object"""
+    with zipfile.ZipFile(source) as archive:
+        for info in archive.infolist():
+            if info.is_dir():
+                continue
+            employee_id = _employee_id_from_path(info.filename)
+            if employee_id:
+                yield employee_id, info.filename, archive.read(info)
+
+
+def iter_directory(root: str) -> Iterator[Tuple[str, str, bytes]]:
+    """Yield (employee_id, relative path, bytes) from a directory tree"""
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            path = os.path.join(dirpath, filename)
+            name = os.path.relpath(path, root)
+            employee_id = _employee_id_from_path(name)
+            if employee_id:
+                with open(path, "rb") as f:
+                    yield employee_id, name, f.read()
+
+
+def count_zip_images(source) -> int:
+    with zipfile.ZipFile(source) as archive:
+        return sum(1 for info in archive.infolist() if not info.is_dir() and _employee_id_from_path(info.filename))
+
+
+def count_directory_images(root: str) -> int:
+    return sum(
+        1 for dirpath, _, filenames in os.walk(root) for filename in filenames
+        if _employee_id_from_path(os.path.relpath(os.path.join(dirpath, filename), root))
+    )
+
+
+class EnrollmentService:
+    """Decode and embed images on the inference pool, insert faces in batches"""
+
+    @staticmethod
+    def process_image(contents: bytes, employee_id: str, name: str, app=None) -> dict:
+        """
+        Pool job: decode, detect, embed and store the image file
+
+        Returns:
+            {"status", "faces", "embedding", "crop", "image_path"}
+        """
+        image = cv2.imdecode(np.frombuffer(contents, np.uint8), cv2.IMREAD_COLOR)
+        if image is None:
+            return {"status": STATUS_INVALID_IMAGE, "faces": 0}
+
+        # A reference photo must show exactly one person
+        bboxes, kpss = face_recognition_service.detect_boxes(image, app=app)
+        if len(bboxes) == 0:
+            return {"status": STATUS_NO_FACE, "faces": 0}
+        if len(bboxes) > 1:
+            return {"status": STATUS_MULTI_FACE, "faces": len(bboxes)}
+
+        crop = face_recognition_service.align_face(image, kpss[0], app=app)
+        embedding = face_recognition_service.embed_aligned([crop], app=app)[0]
+
+        # Keep the original bytes (no re-encode)
+        ext = os.path.splitext(name)[1].lower() or ".jpg"
+        digest = hashlib.sha1(name.encode() + contents).hexdigest()[:8]
+        image_filename = f"{employee_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{digest}{ext}"
+        image_path = os.path.join(settings.UPLOAD_DIR, "faces", image_filename)
+        with open(image_path, "wb") as f:
+            f.write(contents)
+
+        return {"status": STATUS_OK, "faces": 1, "embedding": embedding, "crop": crop, "image_path": image_path}
+
+    async def _run_job(self, contents: bytes, employee_id: str, name: str) -> dict:
+        pool = face_recognition_service.pool
+        while True:
+            try:
+                return await pool.run(self.process_image, contents, employee_id, name)
+            except InferenceQueueFull:
+                # Live recognition traffic has priority - wait for room in the queue
+                await asyncio.sleep(0.2)
+
+    def _flush(self, db: Session, batch: list) -> list:
+        """Insert a batch of faces in one transaction and add them to the index"""
+        if not batch:
+            return []
+
+        faces = [
+            Face(
+                user_id=item["user_id"],
+                embedding=face_recognition_service.embedding_to_bytes(item["embedding"]),
+                embedding_codec=face_recognition_service.embedding_codec,
+                model_name=settings.INSIGHTFACE_MODEL,
+                image_path=item["image_path"]
+            )
+            for item in batch
+        ]
+        db.add_all(faces)
+        db.commit()
+
+        active = [(face, item) for face, item in zip(faces, batch) if item["is_active"]]
+        if active:
+            face_embedding_index.add_many(
+                [face.id for face, _ in active],
+                [face.user_id for face, _ in active],
+                [item["embedding"] for _, item in active]
+            )
+
+        by_user = {}
+        for face, item in zip(faces, batch):
+            by_user.setdefault(face.user_id, []).append((face.id, item["crop"]))
+        for user_id, pairs in by_user.items():
+            crop_store.add_faces(user_id, [face_id for face_id, _ in pairs], [crop for _, crop in pairs])
+        return [face.id for face in faces]
+
+    async def enroll(
+        self,
+        db: Session,
+        items: Iterable[Tuple[str, str, bytes]],
+        total: Optional[int] = None,
+        workers: Optional[int] = None,
+        batch_size: int = 100
+    ) -> AsyncIterator[dict]:
+        """
+        Enroll every image and yield progress events
+
+        Events:
+            {"type": "image", "employee_id", "file", "status", ...} per image
+            {"type": "summary", "total", "counts", "failures"} at the end
+        """
+        users = {
+            row.employee_id: (row.id, bool(row.is_active))
+            for row in db.query(User.employee_id, User.id, User.is_active).all()
+        }
+        workers = max(1, workers or face_recognition_service.pool.size)
+
+        counts = {}
+        failures = []
+        processed = 0
+        batch = []
+        in_flight = {}
+
+        def record(employee_id: str, name: str, result: dict, face_id: Optional[int] = None) -> dict:
+            nonlocal processed
+            processed += 1
+            counts[result["status"]] = counts.get(result["status"], 0) + 1
+            event = {
+                "type": "image",
+                "employee_id": employee_id,
+                "file": name,
+                "status": result["status"],
+                "faces": result.get("faces"),
+                "processed": processed,
+                "total": total
+            }
+            if face_id is not None:
+                event["face_id"] = face_id
+            if result.get("error"):
+                event["error"] = result["error"]
+            if result["status"] != STATUS_OK:
+                failures.append({k: event[k] for k in ("employee_id", "file", "status", "faces")})
+            return event
+
+        async def flush():
+            if not batch:
+                return []
+            # The commit and index update run off the event loop
+            face_ids = await asyncio.get_running_loop().run_in_executor(None, self._flush, db, list(batch))
+            events = [
+                record(item["employee_id"], item["file"], item, face_id)
+                for item, face_id in zip(batch, face_ids)
+            ]
+            batch.clear()
+            return events
+
+        async def collect(wait_all: bool):
+            events = []
+            if not in_flight:
+                return events
+            done, _ = await asyncio.wait(
+                in_flight.keys(), return_when=asyncio.ALL_COMPLETED if wait_all else asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                employee_id, name = in_flight.pop(task)
+                try:
+                    result = task.result()
+                except Exception as e:
+                    logger.error(f"Enrollment of {name} failed: {e}")
+                    result = {"status": STATUS_ERROR, "faces": None, "error": str(e)}
+
+                if result["status"] == STATUS_OK:
+                    user_id, is_active = users[employee_id]
+                    batch.append({**result, "user_id": user_id, "is_active": is_active,
+                                  "employee_id": employee_id, "file": name})
+                else:
+                    events.append(record(employee_id, name, result))
+
+            if len(batch) >= batch_size or (wait_all and batch):
+                events.extend(await flush())
+            return events
+
+        for employee_id, name, contents in items:
+            if employee_id not in users:
+                yield record(employee_id, name, {"status": STATUS_UNKNOWN_USER, "faces": None})
+                continue
+
+            task = asyncio.ensure_future(self._run_job(contents, employee_id, name))
+            in_flight[task] = (employee_id, name)
+            if len(in_flight) >= workers:
+                for event in await collect(wait_all=False):
+                    yield event
+
+        for event in await collect(wait_all=True):
+            yield event
+        for event in await flush():
+            yield event
+
+        logger.info(f"Bulk enrollment finished: {processed} images, {counts}")
+        yield {
+            "type": "summary",
+            "total": processed,
+            "counts": counts,
+            "failures": failures
+        }
+
+
+# Global instance
+enrollment_service = EnrollmentService()
@@ -0,0 +1,542 @@
+"""
+Face Embedding Index - process-resident matrix of enrolled face embeddings
+"""
+import numpy as np
+from sqlalchemy.orm import Session
+from typing import Optional, Tuple
+from config import settings
+from services.embedding_codec import as_float32, check_codec, decode, dot, memory_codec, to_memory
+import hashlib
+import os
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_DIM = 512
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """L2-normalize every row of a matrix (zero rows stay zero)"""
+    matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class FaceEmbeddingIndex:
+    """
+    Contiguous matrix of pre-normalized embeddings with parallel
+    face_id / user_id arrays. The matrix is float32, float16 or int8 with a
+    per-row scale (settings.EMBEDDING_MEMORY_CODEC).
+
+    Built once from the faces table, then kept up to date incrementally by the
+    face routes. Updates replace the arrays (copy-on-write), so a search always
+    sees a consistent snapshot without taking the lock.
+
+    With FACE_INDEX_SNAPSHOT the arrays are also published as a memory-mapped
+    snapshot file (services/face_snapshot.py): workers start from the file
+    instead of the database and remap it when another worker publishes a
+    newer generation.
+
+    Rows are kept sorted by face_id. For large enrolments an optional ANN
+    backend (settings.FACE_INDEX_BACKEND) proposes candidates that are then
+    re-scored exactly; the exact scan remains the fallback. Without an ANN
+    backend, users with several images are searched through their templates
+    (centroid first, then exemplars of the best users).
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._data = (
+            np.empty((0, EMBEDDING_DIM), dtype=np.float32),
+            np.empty(0, dtype=np.int64),
+            np.empty(0, dtype=np.int64)
+        )
+        self.loaded = False
+        self.version = 0
+        self.backend = None
+        self.templates = None
+        self._subset = None  # (version, user id array, row positions) of the last subset search
+
+        # Shared snapshot state
+        self.snapshot_generation = 0
+        self._force_rebuild = False
+        self._snapshot_timer = None
+        self._snapshot_checked_at = 0.0
+        self._snapshot_mtime = None
+        self._remapping = False
+
+    def __len__(self) -> int:
+        return len(self._data[1])
+
+    def _swap(self, matrix: np.ndarray, face_ids: np.ndarray, user_ids: np.ndarray):
+        """Publish new arrays and bump the index version"""
+        self._data = (matrix, face_ids, user_ids)
+        self.version += 1
+
+    @staticmethod
+    def _active_faces(db: Session, model_name: str, *columns):
+        """
+        Query over faces of active users that have an embedding from model_name:
+        their own (faces.model_name) or one added by a re-embedding job
+        """
+        from sqlalchemy import and_, or_
+        from models.face import Face
+        from models.face_embedding import FaceEmbedding
+        from models.user import User
+
+        return db.query(*columns).select_from(Face).join(User).outerjoin(
+            FaceEmbedding, and_(FaceEmbedding.face_id == Face.id, FaceEmbedding.model_name == model_name)
+        ).filter(
+            User.is_active == True,
+            or_(Face.model_name == model_name, FaceEmbedding.id != None)
+        )
+
+    def _load_rows(self, db: Session, model_name: Optional[str] = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Read the embeddings of active users from the database (for the active model by default)"""
+        from models.face import Face
+        from models.face_embedding import FaceEmbedding
+
+        model_name = model_name or settings.INSIGHTFACE_MODEL
+        rows = self._active_faces(
+            db, model_name,
+            Face.id, Face.user_id, Face.model_name, Face.embedding, Face.embedding_codec,
+            FaceEmbedding.embedding.label("model_embedding"),
+            FaceEmbedding.embedding_codec.label("model_embedding_codec")
+        ).order_by(Face.id).all()
+
+        if rows:
+            # Embeddings of another model are never compared with this one
+            matrix = np.vstack([
+                decode(r.embedding, r.embedding_codec) if r.model_name == model_name
+                else decode(r.model_embedding, r.model_embedding_codec)
+                for r in rows
+            ])
+            matrix = normalize_rows(matrix)
+        else:
+            matrix = np.empty((0, EMBEDDING_DIM), dtype=np.float32)
+        matrix = to_memory(matrix, self.codec)
+
+        face_ids = np.array([r.id for r in rows], dtype=np.int64)
+        user_ids = np.array([r.user_id for r in rows], dtype=np.int64)
+        return matrix, face_ids, user_ids
+
+    def build(self, db: Session):
+        """Load all embeddings of active users from the database"""
+        with self._lock:
+            matrix, face_ids, user_ids = self._load_rows(db)
+
+            self._swap(matrix, face_ids, user_ids)
+            self._build_backend()
+            self._build_templates()
+            self.loaded = True
+            self._force_rebuild = False
+            logger.info(f"Face index built: {len(face_ids)} embeddings ({self.codec}, {matrix.nbytes / 1e6:.1f} MB)")
+            self._warn_missing_model(db, len(face_ids))
+
+        if settings.FACE_INDEX_SNAPSHOT:
+            # Let the other workers pick up the fresh copy
+            self._schedule_snapshot()
+
+    @staticmethod
+    def _warn_missing_model(db: Session, indexed: int):
+        """Log faces left out because they have no embedding of the active model"""
+        from sqlalchemy import func
+        from models.face import Face
+        from models.user import User
+
+        total = db.query(func.count(Face.id)).join(User).filter(User.is_active == True).scalar() or 0
+        if total > indexed:
+            logger.warning(
+                f"{total - indexed} faces have no {settings.INSIGHTFACE_MODEL} embedding and cannot be matched; "
+                f"run the re-embedding job (POST /api/face/model/reembed)"
+            )
+
+    @property
+    def codec(self) -> str:
+        """In-memory codec (defaults to the storage codec)"""
+        return check_codec(settings.EMBEDDING_MEMORY_CODEC or settings.EMBEDDING_CODEC)
+
+    def _build_backend(self):
+        """(Re)create the ANN backend for the current rows"""
+        from services.ann_index import create_ann_backend
+
+        matrix, face_ids, _ = self._data
+        self.backend = None
+        if len(face_ids) < settings.FACE_INDEX_MIN_SIZE:
+            return
+
+        backend = create_ann_backend()
+        if backend is None:
+            return
+        try:
+            backend.build(as_float32(matrix), face_ids)
+            self.backend = backend
+            logger.info(f"ANN backend '{backend.name}' ready for {len(face_ids)} embeddings")
+        except Exception as e:
+            logger.error(f"Failed to build ANN backend, using exact search: {e}")
+
+    def _build_templates(self, stored: Optional[tuple] = None, stored_k: int = 0):
+        """(Re)compute the per-user templates for the current rows, or use stored ones of the same k"""
+        from services.face_templates import UserTemplates
+
+        self.templates = None
+        if settings.FACE_TEMPLATE_K <= 0:
+            return
+        if stored is not None and stored_k == settings.FACE_TEMPLATE_K:
+            self.templates = UserTemplates.from_arrays(stored_k, *stored)
+            return
+        templates = UserTemplates(k=settings.FACE_TEMPLATE_K)
+        templates.build(*self._data)
+        self.templates = templates
+
+    def _update_templates(self, user_id: int):
+        if self.templates is not None:
+            self.templates.update_user(user_id, *self._data)
+
+    def ensure_loaded(self, db: Session):
+        """Build the index on first use (from the snapshot when it is current)"""
+        if not self.loaded:
+            with self._lock:
+                if not self.loaded:
+                    if self._force_rebuild or not settings.FACE_INDEX_SNAPSHOT or not self._load_snapshot(db):
+                        self.build(db)
+        elif settings.FACE_INDEX_SNAPSHOT:
+            self._check_snapshot()
+
+    def invalidate(self):
+        """Drop the index so the next search rebuilds it from the database"""
+        with self._lock:
+            self.loaded = False
+            self._force_rebuild = True
+
+    def swap_model(self, db: Session, model_name: str, activate):
+        """
+        Replace the index with the embeddings of another model
+
+        The rows are loaded before taking the lock; activate() (which switches
+        the recognition model) and the array swap then happen together, so
+        queries never mix the two embedding spaces for longer than one search.
+        """
+        matrix, face_ids, user_ids = self._load_rows(db, model_name)
+        with self._lock:
+            activate()
+            self._swap(matrix, face_ids, user_ids)
+            self._build_backend()
+            self._build_templates()
+            self.loaded = True
+            self._force_rebuild = False
+            self.snapshot_generation = 0
+            self._snapshot_mtime = None
+        logger.info(f"Face index switched to model {model_name}: {len(face_ids)} embeddings")
+        self._schedule_snapshot()
+
+    # Shared snapshot
+
+    def _content_version(self, db: Session, model_name: Optional[str] = None) -> int:
+        """
+        Fingerprint of the rows the index is built from
+
+        Faces are never edited in place except by a codec migration, which
+        changes the stored length, so the ids, owners, re-embedding rows and
+        embedding lengths of the active faces identify the content.
+        """
+        from sqlalchemy import func
+        from models.face import Face
+        from models.face_embedding import FaceEmbedding
+
+        row = self._active_faces(
+            db, model_name or settings.INSIGHTFACE_MODEL,
+            func.count(Face.id), func.max(Face.id), func.sum(Face.id), func.sum(Face.user_id),
+            func.sum(func.coalesce(FaceEmbedding.id, 0)), func.sum(func.length(Face.embedding))
+        ).one()
+        digest = hashlib.blake2b(repr(tuple(int(v or 0) for v in row)).encode(), digest_size=8).digest()
+        return int.from_bytes(digest, "little")
+
+    def _load_snapshot(self, db: Session) -> bool:
+        """Map the snapshot file if it was built from the current database content"""
+        from services.face_snapshot import open_snapshot
+
+        opened = open_snapshot()
+        if opened is None:
+            return False
+        header = opened[3]
+        if header["codec"] != self.codec:
+            logger.info(f"Face snapshot codec {header['codec']} differs from {self.codec}, rebuilding")
+            return False
+
+        if header["content_version"] != self._content_version(db):
+            logger.info("Face snapshot is out of date, rebuilding from the database")
+            return False
+
+        self._apply_snapshot(*opened)
+        return True
+
+    def _apply_snapshot(self, matrix: np.ndarray, face_ids: np.ndarray, user_ids: np.ndarray, header: dict,
+                        templates: Optional[tuple] = None):
+        with self._lock:
+            self._swap(matrix, face_ids, user_ids)
+            self._build_backend()
+            self._build_templates(templates, header["template_k"])
+            self.snapshot_generation = header["generation"]
+            self.loaded = True
+            self._force_rebuild = False
+        logger.info(f"Face snapshot mapped: {len(face_ids)} embeddings, generation {header['generation']}")
+
+    def _check_snapshot(self):
+        """Remap in the background when another worker published a newer snapshot"""
+        from services.face_snapshot import read_header, snapshot_path
+
+        now = time.monotonic()
+        if self._remapping or now - self._snapshot_checked_at < settings.FACE_INDEX_SNAPSHOT_CHECK_SECONDS:
+            return
+        self._snapshot_checked_at = now
+
+        try:
+            mtime = os.stat(snapshot_path()).st_mtime_ns
+        except OSError:
+            return
+        if mtime == self._snapshot_mtime:
+            return
+        self._snapshot_mtime = mtime
+
+        header = read_header()
+        if header is None or header["generation"] <= self.snapshot_generation:
+            return
+
+        self._remapping = True
+        threading.Thread(target=self._remap, name="face-snapshot-remap", daemon=True).start()
+
+    def _remap(self):
+        from services.face_snapshot import open_snapshot
+
+        try:
+            opened = open_snapshot()
+            if opened is not None and opened[3]["generation"] > self.snapshot_generation and opened[3]["codec"] == self.codec:
+                self._apply_snapshot(*opened)
+        except Exception as e:
+            logger.error(f"Failed to remap face snapshot: {e}")
+        finally:
+            self._remapping = False
+
+    def _schedule_snapshot(self):
+        """Publish a new snapshot shortly after enrolment changes (debounced)"""
+        if not settings.FACE_INDEX_SNAPSHOT:
+            return
+        with self._lock:
+            if self._snapshot_timer is not None:
+                self._snapshot_timer.cancel()
+            self._snapshot_timer = threading.Timer(settings.FACE_INDEX_SNAPSHOT_DELAY_SECONDS, self._publish_snapshot)
+            self._snapshot_timer.daemon = True
+            self._snapshot_timer.start()
+
+    def _publish_snapshot(self):
+        """
+        Write the snapshot from the database (so changes made by every worker
+        are included), then map it in this worker too
+        """
+        from database import SessionLocal
+        from services.face_snapshot import open_snapshot, write_snapshot, writer_lock
+
+        from services.face_templates import UserTemplates
+
+        version = self.version
+        try:
+            with writer_lock():
+                db = SessionLocal()
+                try:
+                    # Fingerprint first: a change landing in between makes the file look older, never newer
+                    content_version = self._content_version(db)
+                    matrix, face_ids, user_ids = self._load_rows(db)
+                finally:
+                    db.close()
+                templates = None
+                if settings.FACE_TEMPLATE_K > 0:
+                    templates = UserTemplates(k=settings.FACE_TEMPLATE_K)
+                    templates.build(matrix, face_ids, user_ids)
+                write_snapshot(matrix, face_ids, user_ids, content_version=content_version, templates=templates)
+
+            opened = open_snapshot()
+            # Local changes made meanwhile have their own publish pending
+            if opened is not None and self.version == version:
+                self._apply_snapshot(*opened)
+        except Exception as e:
+            logger.error(f"Failed to publish face snapshot: {e}")
+
+    def add(self, face_id: int, user_id: int, embedding: np.ndarray):
+        """Append a newly registered face"""
+        self.add_many([face_id], [user_id], [embedding])
+
+    def add_many(self, new_face_ids, new_user_ids, embeddings):
+        """Append several newly registered faces with a single copy of the arrays"""
+        if len(new_face_ids) == 0:
+            return
+        with self._lock:
+            if not self.loaded:
+                # Nothing to update yet - the first build will pick it up
+                return
+            matrix, face_ids, user_ids = self._data
+            order = np.argsort(np.asarray(new_face_ids, dtype=np.int64), kind="stable")
+            new_face_ids = np.asarray(new_face_ids, dtype=np.int64)[order]
+            new_user_ids = np.asarray(new_user_ids, dtype=np.int64)[order]
+            vectors = normalize_rows(np.vstack([np.asarray(e, dtype=np.float32).ravel() for e in embeddings]))[order]
+
+            positions = np.searchsorted(face_ids, new_face_ids)
+            self._swap(
+                np.insert(matrix, positions, to_memory(vectors, memory_codec(matrix)), axis=0),
+                np.insert(face_ids, positions, new_face_ids),
+                np.insert(user_ids, positions, new_user_ids)
+            )
+            if self.backend is not None:
+                for face_id, vector in zip(new_face_ids, vectors):
+                    self.backend.add(int(face_id), vector)
+            for user_id in np.unique(new_user_ids):
+                self._update_templates(int(user_id))
+        self._schedule_snapshot()
+
+    def remove(self, face_id: int):
+        """Remove a deleted face"""
+        with self._lock:
+            matrix, face_ids, user_ids = self._data
+            keep = face_ids != face_id
+            if keep.all():
+                return
+            user_id = int(user_ids[~keep][0])
+            self._swap(matrix[keep], face_ids[keep], user_ids[keep])
+            if self.backend is not None:
+                self.backend.remove(np.array([face_id], dtype=np.int64))
+            self._update_templates(user_id)
+        self._schedule_snapshot()
+
+    def remove_user(self, user_id: int):
+        """Remove every face of a (deactivated) user"""
+        with self._lock:
+            matrix, face_ids, user_ids = self._data
+            keep = user_ids != user_id
+            if keep.all():
+                return
+            removed = face_ids[~keep]
+            self._swap(matrix[keep], face_ids[keep], user_ids[keep])
+            if self.backend is not None:
+                self.backend.remove(removed)
+            self._update_templates(user_id)
+        self._schedule_snapshot()
+
+    def get_user_id(self, face_id: int) -> Optional[int]:
+        """Look up the owner of an indexed face"""
+        _, face_ids, user_ids = self._data
+        position = int(np.searchsorted(face_ids, face_id))
+        if position >= len(face_ids) or face_ids[position] != face_id:
+            return None
+        return int(user_ids[position])
+
+    def search(self, query_embedding: np.ndarray) -> Optional[Tuple[int, int, float]]:
+        """
+        Find the most similar enrolled face
+
+        Args:
+            query_embedding: Embedding to match (normalized or not)
+
+        Returns:
+            (face_id, user_id, similarity) of the best row or None if the index is empty
+        """
+        matrix, face_ids, user_ids = self._data
+        if len(face_ids) == 0:
+            return None
+
+        query = np.asarray(query_embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm == 0:
+            return None
+
+        query = query / norm
+
+        backend = self.backend
+        templates = self.templates
+        if backend is not None:
+            result = self._search_candidates(backend, query)
+            if result is not None:
+                return result
+        elif templates is not None and len(templates) < len(face_ids):
+            # Fewer templates than faces: score one centroid per user first
+            candidates = templates.candidates(query, settings.FACE_TEMPLATE_TOP_USERS)
+            if candidates is not None:
+                top_users, exemplars = candidates
+                result = self._rescore(query, exemplars)
+                if result is not None and result[2] >= settings.FACE_MATCH_THRESHOLD:
+                    return result
+
+                # Exemplars are a sample of each user's faces: below the threshold
+                # every face of the same users is scored, never the whole index
+                positions = np.flatnonzero(np.isin(user_ids, top_users))
+                if len(positions):
+                    scores = dot(matrix[positions], query)
+                    best = int(np.argmax(scores))
+                    position = positions[best]
+                    return int(face_ids[position]), int(user_ids[position]), float(scores[best])
+
+        scores = dot(matrix, query)
+        best = int(np.argmax(scores))
+        return int(face_ids[best]), int(user_ids[best]), float(scores[best])
+
+    def search_users(self, query_embedding: np.ndarray, user_ids_subset: np.ndarray) -> Optional[Tuple[int, int, float]]:
+        """
+        Exact search restricted to the faces of the given users
+
+        Row positions are cached for the last subset, so repeated searches
+        with the same candidate array only score those rows.
+        """
+        version = self.version
+        matrix, face_ids, user_ids = self._data
+
+        subset = self._subset
+        if subset is not None and subset[0] == version and subset[1] is user_ids_subset:
+            positions = subset[2]
+        else:
+            positions = np.flatnonzero(np.isin(user_ids, user_ids_subset))
+            self._subset = (version, user_ids_subset, positions)
+
+        if len(positions) == 0:
+            return None
+
+        query = np.asarray(query_embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm == 0:
+            return None
+
+        scores = dot(matrix[positions], query / norm)
+        best = int(np.argmax(scores))
+        position = positions[best]
+        return int(face_ids[position]), int(user_ids[position]), float(scores[best])
+
+    def _search_candidates(self, backend, query: np.ndarray) -> Optional[Tuple[int, int, float]]:
+        """Re-score ANN candidates exactly; None means fall back to the full scan"""
+        try:
+            candidates = backend.search(query, settings.FACE_INDEX_RERANK)
+        except Exception as e:
+            logger.error(f"ANN search failed, using exact search: {e}")
+            return None
+        return self._rescore(query, candidates)
+
+    def _rescore(self, query: np.ndarray, candidates: np.ndarray) -> Optional[Tuple[int, int, float]]:
+        """Exact scores of the candidate face ids that are still indexed"""
+        matrix, face_ids, user_ids = self._data
+        if len(face_ids) == 0 or len(candidates) == 0:
+            return None
+
+        positions = np.searchsorted(face_ids, candidates)
+        positions = np.minimum(positions, len(face_ids) - 1)
+        positions = positions[face_ids[positions] == candidates]
+        if len(positions) == 0:
+            return None
+
+        scores = dot(matrix[positions], query)
+        best = int(np.argmax(scores))
+        position = positions[best]
+        return int(face_ids[position]), int(user_ids[position]), float(scores[best])
+
+
+# Global instance
+face_embedding_index = FaceEmbeddingIndex()
@@ -4,97 +4,550 @@ Face Recognition Service using InsightFace
 import numpy as np
 import cv2
 from insightface.app import FaceAnalysis
+from insightface.utils import face_align
 from typing import Optional, Tuple, List
-import os
+import threading
 from config import settings
+from services.inference_pool import InferencePool, InferenceQueueFull
+from services.onnx_profiles import apply_runtime_profile, pool_workers
+from services.embedding_codec import check_codec, decode, encode
+import asyncio
+import time
 import logging
 
 logger = logging.getLogger(__name__)
 
 
+class BatchingScheduler:
+    """
+    Dynamic micro-batching of concurrent embedding requests.
+    
+    Frames that arrive within max_wait_ms of each other (up to max_batch_size)
+    are detected one by one but share a single recognition-model run on their
+    stacked aligned crops. When no batch is in flight a frame is dispatched
+    immediately, so light traffic pays no extra latency.
+    """
+    
+    def __init__(self, service: "FaceRecognitionService", max_batch_size: int, max_wait_ms: float):
+        self.service = service
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000
+        self._queue = None
+        self._collector = None
+        self._in_flight = 0
+        
+        # Counters
+        self.batches = 0
+        self.items = 0
+        self.max_batch_seen = 0
+    
+    def _ensure_started(self):
+        if self._collector is None or self._collector.done():
+            self._queue = asyncio.Queue()
+            self._collector = asyncio.get_running_loop().create_task(self._collect())
+    
+    async def submit(self, image: np.ndarray, precropped: bool = False) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """Queue one frame and wait for its (embedding, aligned crop)"""
+        pool = self.service.pool
+        if pool.max_queue and self._queue is not None and self._queue.qsize() >= pool.max_queue:
+            pool.rejected += 1
+            raise InferenceQueueFull(f"Inference queue is full ({self._queue.qsize()} waiting)")
+        
+        self._ensure_started()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((image, precropped, future))
+        return await future
+    
+    async def _collect(self):
+        while True:
+            batch = [await self._queue.get()]
+            
+            if self._in_flight > 0:
+                deadline = time.monotonic() + self.max_wait
+                while len(batch) < self.max_batch_size:
+                    timeout = deadline - time.monotonic()
+                    if timeout <= 0:
+                        break
+                    try:
+                        batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                    except asyncio.TimeoutError:
+                        break
+            
+            # Take whatever else is already waiting
+            while len(batch) < self.max_batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            
+            asyncio.get_running_loop().create_task(self._dispatch(batch))
+    
+    async def _dispatch(self, batch: list):
+        self._in_flight += 1
+        self.batches += 1
+        self.items += len(batch)
+        self.max_batch_seen = max(self.max_batch_seen, len(batch))
+        
+        images = [image for image, _, _ in batch]
+        precropped = [flag for _, flag, _ in batch]
+        try:
+            results = await self.service.pool.run(
+                self.service.get_embeddings_batch, images, precropped=precropped, return_crops=True
+            )
+        except Exception as e:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            for (_, _, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+        finally:
+            self._in_flight -= 1
+    
+    def stats(self) -> dict:
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": round(self.max_wait * 1000, 2),
+            "batches": self.batches,
+            "items": self.items,
+            "avg_batch_size": round(self.items / self.batches, 2) if self.batches else 0.0,
+            "max_batch_seen": self.max_batch_seen,
+            "pending": self._queue.qsize() if self._queue is not None else 0
+        }
+
+
 class FaceRecognitionService:
     def __init__(self):
         """Initialize InsightFace model"""
         self.app = None
         self.model_loaded = False
+        self.model_state = "not_loaded"  # not_loaded, loading, loaded, warm, error
+        self.last_error = None
+        self._load_lock = threading.Lock()
+        self._app_pooled = False
+        self.loaded_at = None
+        self.last_used = None
+        self.loads = 0
+        self.unloads = 0
         # Do not load model on init to save memory and startup time
         # self.load_model()
+        
+        # Extra sessions for concurrent requests (one by default, see INFERENCE_WORKERS)
+        self.pool = InferencePool(
+            factory=self._create_pool_session,
+            size=pool_workers(),
+            max_queue=settings.INFERENCE_MAX_QUEUE
+        )
+        self.scheduler = BatchingScheduler(
+            self,
+            max_batch_size=settings.INFERENCE_BATCH_MAX_SIZE,
+            max_wait_ms=settings.INFERENCE_BATCH_MAX_WAIT_MS
+        )
+    
+    def _create_app(self, model_name: Optional[str] = None) -> FaceAnalysis:
+        """Create and prepare one InsightFace session (of the active model by default)"""
+        # Only load detection and recognition models to save memory
+        app = FaceAnalysis(
+            name=model_name or settings.INSIGHTFACE_MODEL,
+            allowed_modules=['detection', 'recognition'],
+            providers=['CPUExecutionProvider']
+        )
+        app.prepare(ctx_id=0, det_size=(320, 320))
+        
+        # Thread counts, graph optimization, arena and optional INT8 recognition model
+        return apply_runtime_profile(app)
+    
+    def _create_pool_session(self) -> FaceAnalysis:
+        """Pool factory: the first session is the shared app, others are new"""
+        with self._load_lock:
+            if not self.model_loaded:
+                self._load_model_locked()
+            if not self._app_pooled:
+                self._app_pooled = True
+                return self.app
+        logger.info("Creating additional InsightFace session for the inference pool")
+        return self._create_app()
     
     def load_model(self):
         """Load InsightFace model lazily"""
         if self.model_loaded:
             return
-
+        
+        with self._load_lock:
+            if not self.model_loaded:
+                self._load_model_locked()
+    
+    def _load_model_locked(self):
         try:
+            self.model_state = "loading"
             logger.info(f"Loading InsightFace model: {settings.INSIGHTFACE_MODEL}")
-            # Only load detection and recognition models to save memory
-            self.app = FaceAnalysis(
-                name=settings.INSIGHTFACE_MODEL,
-                allowed_modules=['detection', 'recognition'],
-                providers=['CPUExecutionProvider']
-            )
-            self.app.prepare(ctx_id=0, det_size=(320, 320))
+            self.app = self._create_app()
             
             # Force garbage collection
             import gc
             gc.collect()
             
             self.model_loaded = True
+            self.model_state = "loaded"
+            self.last_error = None
+            self.loaded_at = time.time()
+            self.last_used = time.monotonic()
+            self.loads += 1
             logger.info("InsightFace model loaded successfully (Lite mode)")
         except Exception as e:
+            self.model_state = "error"
+            self.last_error = str(e)
             logger.error(f"Failed to load InsightFace model: {e}")
             raise
     
-    def detect_faces(self, image: np.ndarray) -> List:
+    def unload_model(self) -> bool:
+        """
+        Release the InsightFace sessions (memory budget mode)
+        
+        The next request reloads the model through the same single-flight
+        lock as the first load.
+        
+        Returns:
+            False if the model is not loaded or inference is in progress
+        """
+        with self._load_lock:
+            if not self.model_loaded:
+                return False
+            if self.scheduler.stats()["pending"] or not self.pool.clear():
+                logger.info("Inference in progress, model unload postponed")
+                return False
+            
+            self.app = None
+            self._app_pooled = False
+            self.model_loaded = False
+            self.model_state = "not_loaded"
+            self.loaded_at = None
+            self.unloads += 1
+        
+        import gc
+        gc.collect()
+        logger.info("InsightFace model unloaded")
+        return True
+    
+    def switch_model(self, model_name: str, app: Optional[FaceAnalysis] = None):
+        """
+        Make model_name the active recognition model
+        
+        Sessions of the previous model are dropped (frames already running on
+        them finish first); app, if given, is a ready session of the new
+        model and becomes the shared one.
+        """
+        with self._load_lock:
+            previous = settings.INSIGHTFACE_MODEL
+            settings.INSIGHTFACE_MODEL = model_name
+            old_pool = self.pool
+            self.pool = InferencePool(
+                factory=self._create_pool_session,
+                size=old_pool.size,
+                max_queue=old_pool.max_queue
+            )
+            self.app = app
+            self._app_pooled = False
+            self.model_loaded = app is not None
+            self.model_state = "loaded" if app is not None else "not_loaded"
+            self.loaded_at = time.time() if app is not None else None
+            self.last_error = None
+        
+        old_pool.close()
+        import gc
+        gc.collect()
+        logger.info(f"Recognition model switched: {previous} -> {model_name}")
+        
+        if settings.PRELOAD_MODEL:
+            self._warm_up_in_background()
+    
+    def _warm_up_in_background(self):
+        """Load (if needed) and warm up the shared session on a separate thread"""
+        def run():
+            try:
+                self.warm_up()
+            except Exception as e:
+                logger.error(f"Model warm-up failed: {e}")
+        
+        threading.Thread(target=run, name="model-warm-up", daemon=True).start()
+    
+    def idle_seconds(self) -> Optional[float]:
+        """Seconds since the model was last used, None if it is not loaded"""
+        if not self.model_loaded or self.last_used is None:
+            return None
+        return time.monotonic() - self.last_used
+    
+    def warm_up(self, app: Optional[FaceAnalysis] = None):
+        """
+        Run a dummy detection and recognition so ONNX Runtime allocates its
+        buffers and picks kernels before the first real frame arrives
+        """
+        app = self._ensure_app(app)
+        start = time.perf_counter()
+        
+        self.detect_largest_face(np.zeros((320, 320, 3), dtype=np.uint8), app=app)
+        size = app.models['recognition'].input_size[0]
+        self.embed_aligned([np.zeros((size, size, 3), dtype=np.uint8)], app=app)
+        
+        self.model_state = "warm"
+        logger.info(f"InsightFace model warmed up in {(time.perf_counter() - start) * 1000:.0f} ms")
+    
+    def is_ready(self) -> bool:
+        """
+        Whether the model can take frames (readiness probe)
+        
+        A loaded model is ready, warmed up or not, and so is one unloaded after
+        having been loaded (idle eviction): the next request reloads it. With
+        PRELOAD_MODEL off the model loads on the first request, so only a
+        failed load is not ready.
+        """
+        state = self.model_state
+        if state in ("loaded", "warm"):
+            return True
+        if state == "not_loaded" and self.loads:
+            return True
+        return not settings.PRELOAD_MODEL and state != "error"
+    
+    def status(self) -> dict:
+        """Model state for health and readiness checks"""
+        return {
+            "state": self.model_state,
+            "ready": self.is_ready(),
+            "model": settings.INSIGHTFACE_MODEL,
+            "error": self.last_error,
+            "queue_depth": self.pool.queued + self.scheduler.stats()["pending"]
+        }
+    
+    def prefilter(self, image: np.ndarray, device_id: Optional[int] = None, precropped: bool = False) -> Optional[str]:
+        """
+        Cheap checks before detection (exposure, sharpness, optional Haar cascade)
+        
+        Returns:
+            Reason code if the frame cannot contain a usable face, None otherwise
+        """
+        from services.frame_filter import frame_filter
+        if not frame_filter.enabled:
+            return None
+        return frame_filter.filter(image, device_id=device_id, precropped=precropped)
+    
+    def detect_faces(self, image: np.ndarray, app: Optional[FaceAnalysis] = None) -> List:
         """
         Detect faces in image
         
         Args:
             image: numpy array (BGR format from cv2)
+            app: Optional session borrowed from the inference pool
             
         Returns:
             List of detected faces with bounding boxes and embeddings
         """
+        self.last_used = time.monotonic()
+        if app is None:
+            if not self.model_loaded:
+                self.load_model()
+                if not self.model_loaded:
+                    raise RuntimeError("Face recognition model not loaded")
+            app = self.app
+        
+        try:
+            faces = app.get(image)
+            return faces
+        except Exception as e:
+            logger.error(f"Face detection error: {e}")
+            return []
+    
+    def _ensure_app(self, app: Optional[FaceAnalysis]) -> FaceAnalysis:
+        self.last_used = time.monotonic()
+        if app is not None:
+            return app
         if not self.model_loaded:
             self.load_model()
             if not self.model_loaded:
                 raise RuntimeError("Face recognition model not loaded")
+        return self.app
+    
+    def detect_boxes(
+        self,
+        image: np.ndarray,
+        app: Optional[FaceAnalysis] = None,
+        input_size: Optional[Tuple[int, int]] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Run detection only
+        
+        Returns:
+            (bboxes, kpss): (n, 5) boxes with score and (n, 5, 2) landmarks, empty if none
+        """
+        app = self._ensure_app(app)
         
         try:
-            faces = self.app.get(image)
-            return faces
+            bboxes, kpss = app.det_model.detect(image, input_size=input_size, max_num=0, metric='default')
         except Exception as e:
             logger.error(f"Face detection error: {e}")
-            return []
+            bboxes, kpss = None, None
+        
+        if bboxes is None or len(bboxes) == 0 or kpss is None:
+            return np.empty((0, 5), dtype=np.float32), np.empty((0, 5, 2), dtype=np.float32)
+        return bboxes, kpss
+    
+    def detect_largest_face(
+        self,
+        image: np.ndarray,
+        app: Optional[FaceAnalysis] = None,
+        input_size: Optional[Tuple[int, int]] = None
+    ) -> Optional[Tuple[np.ndarray, np.ndarray, float]]:
+        """
+        Run detection only and return the largest face
+        
+        Args:
+            image: numpy array (BGR format)
+            app: Optional session borrowed from the inference pool
+            input_size: Optional detector input size (default: det_size from prepare)
+        
+        Returns:
+            (bbox, kps, det_score) or None if no face detected
+        """
+        bboxes, kpss = self.detect_boxes(image, app=app, input_size=input_size)
+        if len(bboxes) == 0:
+            if input_size is None:
+                logger.warning("No face detected in image")
+            return None
+        
+        if len(bboxes) > 1:
+            logger.warning(f"Multiple faces detected ({len(bboxes)}), using the largest one")
+        
+        # Use the face with largest bounding box
+        areas = (bboxes[:, 2] - bboxes[:, 0]) * (bboxes[:, 3] - bboxes[:, 1])
+        best = int(np.argmax(areas))
+        return bboxes[best, :4], kpss[best], float(bboxes[best, 4])
     
-    def get_embedding(self, image: np.ndarray) -> Optional[np.ndarray]:
+    def locate_face(
+        self,
+        image: np.ndarray,
+        app: Optional[FaceAnalysis] = None,
+        precropped: bool = False
+    ) -> Optional[Tuple[np.ndarray, np.ndarray, float]]:
+        """
+        Find the face to embed
+        
+        For images that are already a face crop, the detector runs at the small
+        FACE_CROP_DET_SIZE input (only the landmarks for alignment are needed);
+        full-size detection is used only when that is not confident enough.
+        """
+        if precropped:
+            size = settings.FACE_CROP_DET_SIZE
+            face = self.detect_largest_face(image, app=app, input_size=(size, size))
+            if face is not None and face[2] >= settings.FACE_CROP_MIN_DET_SCORE:
+                return face
+            logger.info("Low confidence on pre-cropped fast path, running full detection")
+        
+        return self.detect_largest_face(image, app=app)
+    
+    def align_face(self, image: np.ndarray, kps: np.ndarray, app: Optional[FaceAnalysis] = None) -> np.ndarray:
+        """Warp a face to the recognition model's aligned input (112x112)"""
+        app = self._ensure_app(app)
+        rec_model = app.models['recognition']
+        return face_align.norm_crop(image, landmark=kps, image_size=rec_model.input_size[0])
+    
+    def embed_aligned(self, crops: List[np.ndarray], app: Optional[FaceAnalysis] = None) -> np.ndarray:
+        """
+        Run the recognition model on aligned crops as one batch
+        
+        Returns:
+            (len(crops), 512) matrix of normalized embeddings
+        """
+        app = self._ensure_app(app)
+        rec_model = app.models['recognition']
+        
+        try:
+            embeddings = rec_model.get_feat(crops)
+        except Exception as e:
+            # Some exported models have a fixed batch size of 1
+            logger.debug(f"Batched recognition failed, running per crop: {e}")
+            embeddings = np.vstack([rec_model.get_feat(crop) for crop in crops])
+        
+        embeddings = np.asarray(embeddings, dtype=np.float32).reshape(len(crops), -1)
+        return embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+    
+    def get_embeddings_batch(
+        self,
+        images: List[np.ndarray],
+        app: Optional[FaceAnalysis] = None,
+        precropped: Optional[List[bool]] = None,
+        return_crops: bool = False
+    ) -> List:
+        """
+        Detect the largest face in every image, then embed all aligned crops together
+        
+        Args:
+            images: numpy arrays (BGR format)
+            app: Optional session borrowed from the inference pool
+            precropped: Optional per-image flags for the pre-cropped fast path
+            return_crops: Return (embedding, aligned crop) pairs
+        
+        Returns:
+            One normalized embedding (or None if no face detected) per image
+        """
+        app = self._ensure_app(app)
+        if precropped is None:
+            precropped = [False] * len(images)
+        
+        crops = []
+        owners = []
+        for i, image in enumerate(images):
+            face = self.locate_face(image, app=app, precropped=precropped[i])
+            if face is None:
+                continue
+            _, kps, _ = face
+            crops.append(self.align_face(image, kps, app=app))
+            owners.append(i)
+        
+        results = [None] * len(images)
+        if crops:
+            embeddings = self.embed_aligned(crops, app=app)
+            for i, embedding, crop in zip(owners, embeddings, crops):
+                results[i] = (embedding, crop) if return_crops else embedding
+        return results
+    
+    def get_embedding(
+        self,
+        image: np.ndarray,
+        app: Optional[FaceAnalysis] = None,
+        precropped: bool = False
+    ) -> Optional[np.ndarray]:
         """
         Extract face embedding from image
         
         Args:
             image: numpy array (BGR format)
+            app: Optional session borrowed from the inference pool
+            precropped: Image is already a face crop (fast path)
             
         Returns:
             512-dimensional embedding vector or None if no face detected
         """
-        faces = self.detect_faces(image)
-        
-        if not faces:
-            logger.warning("No face detected in image")
-            return None
-        
-        if len(faces) > 1:
-            logger.warning(f"Multiple faces detected ({len(faces)}), using the largest one")
-            # Use the face with largest bounding box
-            faces = sorted(faces, key=lambda x: (x.bbox[2] - x.bbox[0]) * (x.bbox[3] - x.bbox[1]), reverse=True)
+        return self.get_embeddings_batch([image], app=app, precropped=[precropped])[0]
+    
+    async def get_embedding_async(self, image: np.ndarray, precropped: bool = False, return_crop: bool = False):
+        """
+        Extract face embedding on the inference pool without blocking the event loop
         
-        # Get embedding from the first/largest face
-        embedding = faces[0].embedding
+        Concurrent calls are micro-batched by the scheduler when
+        INFERENCE_BATCH_MAX_SIZE > 1.
         
-        # Normalize embedding
-        embedding = embedding / np.linalg.norm(embedding)
+        Returns:
+            Embedding, or (embedding, aligned crop) with return_crop; None if no face
         
-        return embedding
+        Raises:
+            InferenceQueueFull: If too many frames are already waiting
+        """
+        if settings.INFERENCE_BATCH_MAX_SIZE > 1:
+            result = await self.scheduler.submit(image, precropped=precropped)
+        else:
+            result = (await self.pool.run(
+                self.get_embeddings_batch, [image], precropped=[precropped], return_crops=True
+            ))[0]
+        if result is None or return_crop:
+            return result
+        return result[0]
     
     def compare_embeddings(self, embedding1: np.ndarray, embedding2: np.ndarray) -> float:
         """
@@ -122,30 +575,51 @@ class FaceRecognitionService:
     def find_best_match(
         self, 
         query_embedding: np.ndarray, 
-        database_embeddings: List[Tuple[int, np.ndarray]]
+        database_embeddings: Optional[List[Tuple[int, np.ndarray]]] = None,
+        candidate_user_ids: Optional[np.ndarray] = None
     ) -> Optional[Tuple[int, float]]:
         """
         Find best matching face from database
         
         Args:
             query_embedding: Embedding to match
-            database_embeddings: List of (face_id, embedding) tuples
+            database_embeddings: Optional list of (face_id, embedding) tuples.
+                When omitted the process-wide face index is searched.
+            candidate_user_ids: Optional users to search first (e.g. students with
+                a lesson right now); the whole index is searched only if none
+                of them clears the threshold
             
         Returns:
             (face_id, confidence) or None if no match above threshold
         """
-        if not database_embeddings:
-            return None
-        
-        best_match_id = None
-        best_similarity = 0.0
-        
-        for face_id, db_embedding in database_embeddings:
-            similarity = self.compare_embeddings(query_embedding, db_embedding)
+        if database_embeddings is None:
+            from services.face_index import face_embedding_index
+            
+            if candidate_user_ids is not None and len(candidate_user_ids):
+                result = face_embedding_index.search_users(query_embedding, candidate_user_ids)
+                if result is not None and result[2] >= settings.FACE_MATCH_THRESHOLD:
+                    return (result[0], result[2])
             
-            if similarity > best_similarity:
-                best_similarity = similarity
-                best_match_id = face_id
+            result = face_embedding_index.search(query_embedding)
+            if result is None:
+                return None
+            best_match_id, _, best_similarity = result
+        else:
+            if not database_embeddings:
+                return None
+            
+            from services.face_index import normalize_rows
+            face_ids = [face_id for face_id, _ in database_embeddings]
+            matrix = normalize_rows(np.vstack([embedding for _, embedding in database_embeddings]))
+            
+            query = np.asarray(query_embedding, dtype=np.float32)
+            norm = np.linalg.norm(query)
+            if norm == 0:
+                return None
+            
+            scores = matrix @ (query / norm)
+            best = int(np.argmax(scores))
+            best_match_id, best_similarity = face_ids[best], float(scores[best])
         
         # Check if best match is above threshold
         if best_similarity >= settings.FACE_MATCH_THRESHOLD:
@@ -191,13 +665,18 @@ class FaceRecognitionService:
         
         return face_img
     
+    @property
+    def embedding_codec(self) -> str:
+        """Codec used for newly stored embeddings (float32, float16 or int8)"""
+        return check_codec(settings.EMBEDDING_CODEC)
+    
     def embedding_to_bytes(self, embedding: np.ndarray) -> bytes:
-        """Convert numpy embedding to bytes for database storage"""
-        return embedding.tobytes()
+        """Convert numpy embedding to bytes for database storage (settings.EMBEDDING_CODEC)"""
+        return encode(embedding, self.embedding_codec)
     
-    def bytes_to_embedding(self, embedding_bytes: bytes) -> np.ndarray:
-        """Convert bytes back to numpy embedding"""
-        return np.frombuffer(embedding_bytes, dtype=np.float32)
+    def bytes_to_embedding(self, embedding_bytes: bytes, codec: Optional[str] = None) -> np.ndarray:
+        """Convert bytes back to a float32 numpy embedding (codec inferred from the length if omitted)"""
+        return decode(embedding_bytes, codec)
 
 
 # Global instance
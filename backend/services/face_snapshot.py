@@ -0,0 +1,223 @@
+"""
+Face Snapshot - memory-mapped embedding file shared by all workers on a host
+
+Layout (little endian, sections aligned to 64 bytes):
+    header    64 bytes: magic, format, codec, rows, dim, generation,
+              content version, template k, template users, template exemplars
+    face_ids  int64[rows]
+    user_ids  int64[rows]
+    matrix    rows x dim in the in-memory codec (int8 rows carry their scale)
+    templates (optional, template k > 0) centroids float32[users x dim],
+              user ids int64[users], exemplar offsets int64[users + 1],
+              exemplar face ids int64[exemplars]
+
+The content version is a fingerprint of the database rows the snapshot was
+built from (see FaceEmbeddingIndex._content_version), so a worker can tell
+whether the file still matches the database.
+
+The file is written to a temporary path and renamed, so readers only ever
+see a complete snapshot. Readers open it with numpy.memmap (read-only), which
+lets every worker share one page-cache copy.
+"""
+import numpy as np
+from contextlib import contextmanager
+from typing import Optional, Tuple
+from config import settings
+from services.embedding_codec import dimension, memory_codec
+import os
+import struct
+import time
+import logging
+
+try:
+    import fcntl
+except ImportError:  # Windows - single worker, no cross-process lock needed
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"FACEIDX1"
+FORMAT_VERSION = 2
+# magic, format, codec, rows, dim, generation, content version, template k, template users, template exemplars
+HEADER = struct.Struct("<8sIIQIQQIQQ")
+HEADER_SIZE = 64
+ALIGN = 64
+CODEC_IDS = {"float32": 0, "float16": 1, "int8": 2}
+CODEC_NAMES = {v: k for k, v in CODEC_IDS.items()}
+
+
+def snapshot_path() -> str:
+    # One file per recognition model: embeddings of different models never mix
+    return os.path.join(settings.INDEX_DIR, f"face_index.{settings.INSIGHTFACE_MODEL}.snapshot")
+
+
+def _aligned(offset: int) -> int:
+    return (offset + ALIGN - 1) // ALIGN * ALIGN
+
+
+def _row_dtype(codec: str, dim: int) -> np.dtype:
+    if codec == "int8":
+        return np.dtype([("codes", np.int8, (dim,)), ("scale", np.float32)])
+    return np.dtype(np.float16 if codec == "float16" else np.float32)
+
+
+def _layout(rows: int) -> Tuple[int, int, int]:
+    """Byte offsets of the face_ids, user_ids and matrix sections"""
+    face_ids_at = HEADER_SIZE
+    user_ids_at = _aligned(face_ids_at + rows * 8)
+    matrix_at = _aligned(user_ids_at + rows * 8)
+    return face_ids_at, user_ids_at, matrix_at
+
+
+def _template_layout(end: int, users: int, exemplars: int, dim: int) -> Tuple[int, int, int, int]:
+    """Byte offsets of the template sections, which follow the matrix (ending at end)"""
+    centroids_at = _aligned(end)
+    users_at = _aligned(centroids_at + users * dim * 4)
+    offsets_at = _aligned(users_at + users * 8)
+    exemplars_at = _aligned(offsets_at + (users + 1) * 8)
+    return centroids_at, users_at, offsets_at, exemplars_at
+
+
+def read_header(path: Optional[str] = None) -> Optional[dict]:
+    """Header of the snapshot file, None if missing or invalid"""
+    path = path or snapshot_path()
+    try:
+        with open(path, "rb") as f:
+            data = f.read(HEADER.size)
+    except OSError:
+        return None
+
+    if len(data) < HEADER.size:
+        return None
+    magic, fmt, codec_id, rows, dim, generation, content_version, template_k, template_users, template_exemplars = \
+        HEADER.unpack(data)
+    if magic != MAGIC or fmt != FORMAT_VERSION or codec_id not in CODEC_NAMES:
+        return None
+    return {
+        "codec": CODEC_NAMES[codec_id],
+        "rows": rows,
+        "dim": dim,
+        "generation": generation,
+        "content_version": content_version,
+        "template_k": template_k,
+        "template_users": template_users,
+        "template_exemplars": template_exemplars
+    }
+
+
+def write_snapshot(matrix: np.ndarray, face_ids: np.ndarray, user_ids: np.ndarray,
+                   path: Optional[str] = None, content_version: int = 0, templates=None) -> int:
+    """
+    Atomically write a snapshot
+
+    Args:
+        content_version: Fingerprint of the database rows the arrays come from
+        templates: Optional UserTemplates of the same rows, stored so that
+            readers do not recompute them
+
+    Returns:
+        Generation number of the new snapshot
+    """
+    path = path or snapshot_path()
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    codec = memory_codec(matrix)
+    dim = dimension(matrix)
+    rows = len(face_ids)
+    generation = time.time_ns()
+    face_ids_at, user_ids_at, matrix_at = _layout(rows)
+
+    template_k, template_arrays = 0, None
+    if templates is not None:
+        template_k, template_arrays = templates.k, templates.arrays()
+    template_users = len(template_arrays[1]) if template_arrays else 0
+    template_exemplars = len(template_arrays[3]) if template_arrays else 0
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(
+            MAGIC, FORMAT_VERSION, CODEC_IDS[codec], rows, dim, generation,
+            content_version, template_k, template_users, template_exemplars
+        ).ljust(HEADER_SIZE, b"\0"))
+        f.write(np.ascontiguousarray(face_ids, dtype="<i8").tobytes())
+        f.seek(user_ids_at)
+        f.write(np.ascontiguousarray(user_ids, dtype="<i8").tobytes())
+        f.seek(matrix_at)
+        f.write(np.ascontiguousarray(matrix).tobytes())
+        if template_arrays:
+            centroids, users, offsets, exemplars = template_arrays
+            sections = _template_layout(f.tell(), template_users, template_exemplars, dim)
+            for offset, array, dtype in zip(sections, (centroids, users, offsets, exemplars), ("<f4", "<i8", "<i8", "<i8")):
+                f.seek(offset)
+                f.write(np.ascontiguousarray(array, dtype=dtype).tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+    logger.info(f"Face snapshot written: {rows} embeddings ({codec}) -> {path}")
+    return generation
+
+
+def open_snapshot(path: Optional[str] = None) -> Optional[Tuple[np.ndarray, np.ndarray, np.ndarray, dict, Optional[tuple]]]:
+    """
+    Map a snapshot read-only
+
+    Returns:
+        (matrix, face_ids, user_ids, header, templates) or None if there is no
+        valid snapshot; templates is (centroids, user ids, exemplar offsets,
+        exemplar face ids) or None if the snapshot has none
+    """
+    path = path or snapshot_path()
+    header = read_header(path)
+    if header is None:
+        return None
+
+    rows, dim, codec = header["rows"], header["dim"], header["codec"]
+    face_ids_at, user_ids_at, matrix_at = _layout(rows)
+    row_dtype = _row_dtype(codec, dim)
+
+    try:
+        if rows == 0:
+            shape = (0, dim) if row_dtype.names is None else (0,)
+            matrix = np.empty(shape, dtype=row_dtype)
+            face_ids = np.empty(0, dtype=np.int64)
+            user_ids = np.empty(0, dtype=np.int64)
+        else:
+            face_ids = np.memmap(path, dtype="<i8", mode="r", offset=face_ids_at, shape=(rows,))
+            user_ids = np.memmap(path, dtype="<i8", mode="r", offset=user_ids_at, shape=(rows,))
+            shape = (rows, dim) if row_dtype.names is None else (rows,)
+            matrix = np.memmap(path, dtype=row_dtype, mode="r", offset=matrix_at, shape=shape)
+
+        templates = None
+        users, exemplars = header["template_users"], header["template_exemplars"]
+        if header["template_k"] and users:
+            centroids_at, users_at, offsets_at, exemplars_at = _template_layout(
+                matrix_at + rows * row_dtype.itemsize * (dim if row_dtype.names is None else 1), users, exemplars, dim
+            )
+            templates = (
+                np.memmap(path, dtype="<f4", mode="r", offset=centroids_at, shape=(users, dim)),
+                np.memmap(path, dtype="<i8", mode="r", offset=users_at, shape=(users,)),
+                np.memmap(path, dtype="<i8", mode="r", offset=offsets_at, shape=(users + 1,)),
+                np.memmap(path, dtype="<i8", mode="r", offset=exemplars_at, shape=(exemplars,))
+                if exemplars else np.empty(0, dtype=np.int64)
+            )
+    except (OSError, ValueError) as e:
+        logger.error(f"Failed to map face snapshot: {e}")
+        return None
+
+    return matrix, face_ids, user_ids, header, templates
+
+
+@contextmanager
+def writer_lock(path: Optional[str] = None):
+    """Serialize snapshot writers across processes (no-op without fcntl)"""
+    path = (path or snapshot_path()) + ".lock"
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "a") as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
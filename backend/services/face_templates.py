@@ -0,0 +1,166 @@
+"""
+Face Templates - per-user centroid and exemplar embeddings
+"""
+import numpy as np
+from typing import Optional, Tuple
+from services.embedding_codec import as_float32, dimension
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def select_exemplars(vectors: np.ndarray, k: int, iterations: int = 5) -> np.ndarray:
+    """
+    Pick up to k representative rows of a user's normalized embeddings
+
+    Spherical k-means seeded by farthest-point sampling; the member closest
+    to each cluster centre is the exemplar, so exemplars are real faces.
+
+    Returns:
+        Row indices of the exemplars
+    """
+    n = len(vectors)
+    if n <= k:
+        return np.arange(n)
+
+    # Farthest-point seeding (deterministic)
+    seeds = [0]
+    closest = vectors @ vectors[0]
+    for _ in range(1, k):
+        seeds.append(int(np.argmin(closest)))
+        closest = np.maximum(closest, vectors @ vectors[seeds[-1]])
+    centres = vectors[seeds].copy()
+
+    for _ in range(iterations):
+        assign = np.argmax(vectors @ centres.T, axis=1)
+        for c in range(k):
+            members = vectors[assign == c]
+            if len(members):
+                centre = members.sum(axis=0)
+                norm = np.linalg.norm(centre)
+                if norm > 0:
+                    centres[c] = centre / norm
+
+    scores = vectors @ centres.T
+    assign = np.argmax(scores, axis=1)
+    exemplars = []
+    for c in range(k):
+        members = np.flatnonzero(assign == c)
+        if len(members):
+            exemplars.append(int(members[np.argmax(scores[members, c])]))
+    return np.unique(exemplars)
+
+
+class UserTemplates:
+    """
+    One normalized centroid per user plus up to k exemplar face ids.
+
+    Searching scores the query against the centroids (one row per user),
+    then re-checks only the exemplars of the best users. Updates recompute
+    a single user and publish new arrays (copy-on-write), like the face index.
+    """
+
+    def __init__(self, k: int = 3):
+        self.k = max(1, k)
+        self._data = (
+            np.empty((0, 0), dtype=np.float32),
+            np.empty(0, dtype=np.int64),
+            []
+        )
+
+    def __len__(self) -> int:
+        return len(self._data[1])
+
+    def arrays(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """(centroids, user ids, exemplar offsets, exemplar face ids) for persisting"""
+        centroids, users, exemplars = self._data
+        offsets = np.zeros(len(users) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(e) for e in exemplars])
+        flat = np.concatenate(exemplars).astype(np.int64) if exemplars else np.empty(0, dtype=np.int64)
+        return centroids, users, offsets, flat
+
+    @classmethod
+    def from_arrays(cls, k: int, centroids: np.ndarray, users: np.ndarray,
+                    offsets: np.ndarray, exemplars: np.ndarray) -> "UserTemplates":
+        """Templates from arrays() output (e.g. mapped from the face snapshot)"""
+        templates = cls(k=k)
+        templates._data = (
+            centroids,
+            users,
+            [exemplars[offsets[i]:offsets[i + 1]] for i in range(len(users))]
+        )
+        return templates
+
+    def _template(self, vectors: np.ndarray, face_ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        centroid = vectors.mean(axis=0)
+        norm = np.linalg.norm(centroid)
+        if norm > 0:
+            centroid = centroid / norm
+        exemplars = face_ids[select_exemplars(vectors, self.k)]
+        return centroid.astype(np.float32), np.sort(exemplars)
+
+    def build(self, matrix: np.ndarray, face_ids: np.ndarray, user_ids: np.ndarray):
+        """Compute the templates of every user"""
+        if len(user_ids) == 0:
+            self._data = (np.empty((0, dimension(matrix)), dtype=np.float32), np.empty(0, dtype=np.int64), [])
+            return
+
+        order = np.argsort(user_ids, kind="stable")
+        users, starts = np.unique(user_ids[order], return_index=True)
+        bounds = list(starts) + [len(order)]
+
+        centroids = np.empty((len(users), dimension(matrix)), dtype=np.float32)
+        exemplars = []
+        for i in range(len(users)):
+            rows = order[bounds[i]:bounds[i + 1]]
+            centroids[i], user_exemplars = self._template(as_float32(matrix[rows]), face_ids[rows])
+            exemplars.append(user_exemplars)
+
+        self._data = (centroids, users.astype(np.int64), exemplars)
+        logger.info(f"Face templates built: {len(users)} users, k={self.k}")
+
+    def update_user(self, user_id: int, matrix: np.ndarray, face_ids: np.ndarray, user_ids: np.ndarray):
+        """Recompute (or drop) one user's template after a face was added or removed"""
+        rows = np.flatnonzero(user_ids == user_id)
+        centroids, users, exemplars = self._data
+        position = int(np.searchsorted(users, user_id))
+        exists = position < len(users) and users[position] == user_id
+
+        if len(rows) == 0:
+            if exists:
+                self._data = (
+                    np.delete(centroids, position, axis=0),
+                    np.delete(users, position),
+                    exemplars[:position] + exemplars[position + 1:]
+                )
+            return
+
+        centroid, user_exemplars = self._template(as_float32(matrix[rows]), face_ids[rows])
+        if exists:
+            centroids = centroids.copy()
+            centroids[position] = centroid
+            self._data = (centroids, users, exemplars[:position] + [user_exemplars] + exemplars[position + 1:])
+        else:
+            if centroids.shape[1] != len(centroid):
+                centroids = np.empty((0, len(centroid)), dtype=np.float32)
+            self._data = (
+                np.insert(centroids, position, centroid, axis=0),
+                np.insert(users, position, np.int64(user_id)),
+                exemplars[:position] + [user_exemplars] + exemplars[position + 1:]
+            )
+
+    def candidates(self, query: np.ndarray, top_users: int) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """
+        The top_users users closest to the normalized query
+
+        Returns:
+            (user_ids, exemplar face ids of those users) or None without templates
+        """
+        centroids, users, exemplars = self._data
+        if len(users) == 0:
+            return None
+
+        scores = centroids @ query
+        top_users = min(top_users, len(users))
+        best = np.argpartition(-scores, top_users - 1)[:top_users]
+        return users[best], np.concatenate([exemplars[int(i)] for i in best])
@@ -0,0 +1,137 @@
+"""
+Frame Cache - per-device short-term cache of near-identical faceless uploads
+"""
+import numpy as np
+import cv2
+from collections import OrderedDict, deque
+from typing import Optional
+from config import settings
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def difference_hash(contents: bytes) -> Optional[int]:
+    """
+    64-bit dHash of an encoded image
+
+    JPEGs are decoded at 1/8 scale in grayscale, which is much cheaper than a
+    full decode. Returns None if the bytes are not a readable image.
+    """
+    image = cv2.imdecode(np.frombuffer(contents, np.uint8), cv2.IMREAD_REDUCED_GRAYSCALE_8)
+    if image is None:
+        return None
+
+    small = cv2.resize(image, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int(np.packbits(bits).view(">u8")[0])
+
+
+class CachedFrame:
+    """A recent frame of one device in which no face was found"""
+
+    __slots__ = ("frame_hash", "precropped", "created_at")
+
+    def __init__(self, frame_hash: int, precropped: bool):
+        self.frame_hash = frame_hash
+        self.precropped = precropped
+        self.created_at = time.monotonic()
+
+
+class FrameCache:
+    """
+    Remembers the last few faceless frames of every device.
+
+    A frame whose dHash is within FRAME_CACHE_MAX_DISTANCE bits of a faceless
+    frame from the same device seen less than FRAME_CACHE_TTL_SECONDS ago is
+    answered "no face" without decoding or detection. Frames with a face are
+    never cached: a different student in front of the same fixed camera can
+    be a few bits away, and for a face the index search is cheap next to the
+    inference it would have to run anyway.
+
+    Off by default: a student stepping into an empty scene can also hash
+    within a few bits of it, so enable it only for cameras that upload
+    frames continuously.
+    """
+
+    def __init__(self, max_devices: int = 1024):
+        self.max_devices = max_devices
+        self._devices = OrderedDict()
+        self._lock = threading.Lock()
+
+        # Counters
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+
+    @property
+    def enabled(self) -> bool:
+        return settings.FRAME_CACHE_TTL_SECONDS > 0
+
+    def lookup(self, device_id: int, frame_hash: Optional[int], precropped: bool = False) -> Optional[CachedFrame]:
+        """Return the closest cached faceless frame of this device, or None on a miss"""
+        if not self.enabled or frame_hash is None:
+            return None
+
+        now = time.monotonic()
+        best, best_distance = None, settings.FRAME_CACHE_MAX_DISTANCE + 1
+        with self._lock:
+            entries = self._devices.get(device_id)
+            if entries:
+                for entry in list(entries):
+                    if now - entry.created_at > settings.FRAME_CACHE_TTL_SECONDS:
+                        entries.remove(entry)
+                        self.expired += 1
+                        continue
+                    if entry.precropped != precropped:
+                        continue
+                    distance = bin(entry.frame_hash ^ frame_hash).count("1")
+                    if distance < best_distance:
+                        best, best_distance = entry, distance
+
+            if best is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return best
+
+    def store(self, device_id: int, frame_hash: Optional[int], precropped: bool):
+        """Remember a frame in which full inference found no face"""
+        if not self.enabled or frame_hash is None:
+            return
+
+        with self._lock:
+            entries = self._devices.get(device_id)
+            if entries is None:
+                entries = deque(maxlen=max(1, settings.FRAME_CACHE_ENTRIES_PER_DEVICE))
+                self._devices[device_id] = entries
+            self._devices.move_to_end(device_id)
+            entries.append(CachedFrame(frame_hash, precropped))
+
+            while len(self._devices) > self.max_devices:
+                self._devices.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._devices.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "ttl_seconds": settings.FRAME_CACHE_TTL_SECONDS,
+                "max_distance": settings.FRAME_CACHE_MAX_DISTANCE,
+                "devices": len(self._devices),
+                "entries": sum(len(entries) for entries in self._devices.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "expired": self.expired
+            }
+
+
+# Global instance
+frame_cache = FrameCache()
@@ -0,0 +1,224 @@
+"""
+Idempotency Store - replay the stored response of a retried device upload
+"""
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Optional
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from config import settings
+from database import SessionLocal
+import asyncio
+import hashlib
+import json
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Marks a stored client error (4xx) instead of a response body
+STORED_ERROR = "_idempotent_error"
+
+
+class IdempotencyStore:
+    """
+    Remembers the response of every recognized upload for
+    IDEMPOTENCY_TTL_SECONDS.
+
+    The key comes from the device's X-Request-ID header or, when the device
+    does not send one, from a hash of the image bytes. Responses live in a
+    bounded in-process LRU ("memory") or in the upload_responses table
+    ("database", shared by several workers). Identical requests that arrive
+    while the first one is still being processed wait for its result.
+
+    Client errors (4xx, e.g. an unreadable image) are stored and replayed
+    like responses: the same bytes would fail the same way. Server errors
+    (500, 503 when the inference queue is full) are not, so a retry runs
+    the pipeline again.
+    """
+
+    def __init__(self):
+        self._responses = OrderedDict()  # key -> (stored_at, response)
+        self._pending = {}  # key -> Future of the request in progress
+        self._lock = threading.Lock()
+        self._last_purge = 0.0
+
+        # Counters
+        self.replayed = 0
+        self.joined = 0
+        self.stored = 0
+
+    @property
+    def backend(self) -> str:
+        return settings.IDEMPOTENCY_BACKEND.lower()
+
+    @property
+    def enabled(self) -> bool:
+        return self.backend in ("memory", "database") and settings.IDEMPOTENCY_TTL_SECONDS > 0
+
+    @staticmethod
+    def make_key(device_id: int, request_id: Optional[str], contents: bytes) -> str:
+        """Key of one upload: device + request id, or device + image hash"""
+        digest = hashlib.sha256(f"{device_id}:".encode())
+        if request_id:
+            digest.update(b"id:" + request_id.encode())
+        else:
+            digest.update(b"content:" + contents)
+        return digest.hexdigest()
+
+    async def key_for(self, device_id: int, request_id: Optional[str], contents: bytes) -> Optional[str]:
+        """
+        Key of one upload, None when replay is off
+
+        Hashing a multi-megabyte body is done on a worker thread; with an
+        X-Request-ID the body is not hashed at all.
+        """
+        if not self.enabled:
+            return None
+        if request_id:
+            return self.make_key(device_id, request_id, contents)
+        return await asyncio.to_thread(self.make_key, device_id, request_id, contents)
+
+    # Memory backend
+
+    def _get_memory(self, key: str) -> Optional[dict]:
+        with self._lock:
+            entry = self._responses.get(key)
+            if entry is None:
+                return None
+            stored_at, response = entry
+            if time.monotonic() - stored_at > settings.IDEMPOTENCY_TTL_SECONDS:
+                del self._responses[key]
+                return None
+            self._responses.move_to_end(key)
+            return response
+
+    def _put_memory(self, key: str, response: dict):
+        with self._lock:
+            self._responses[key] = (time.monotonic(), response)
+            self._responses.move_to_end(key)
+            while len(self._responses) > settings.IDEMPOTENCY_MAX_ENTRIES:
+                self._responses.popitem(last=False)
+
+    # Database backend
+
+    def _get_database(self, key: str) -> Optional[dict]:
+        from models.upload_response import UploadResponse
+
+        db = SessionLocal()
+        try:
+            cutoff = datetime.utcnow() - timedelta(seconds=settings.IDEMPOTENCY_TTL_SECONDS)
+            row = db.query(UploadResponse).filter(
+                UploadResponse.key == key,
+                UploadResponse.created_at >= cutoff
+            ).first()
+            return json.loads(row.response) if row else None
+        finally:
+            db.close()
+
+    def _put_database(self, key: str, device_id: int, response: dict):
+        from models.upload_response import UploadResponse
+
+        db = SessionLocal()
+        try:
+            # Old rows are purged at most once a minute
+            if time.monotonic() - self._last_purge > 60:
+                self._last_purge = time.monotonic()
+                cutoff = datetime.utcnow() - timedelta(seconds=settings.IDEMPOTENCY_TTL_SECONDS)
+                db.query(UploadResponse).filter(UploadResponse.created_at < cutoff).delete()
+
+            db.merge(UploadResponse(
+                key=key,
+                device_id=device_id,
+                response=json.dumps(response),
+                created_at=datetime.utcnow()
+            ))
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Failed to store upload response: {e}")
+        finally:
+            db.close()
+
+    async def get(self, key: str) -> Optional[dict]:
+        if self.backend == "database":
+            return await asyncio.to_thread(self._get_database, key)
+        return self._get_memory(key)
+
+    async def put(self, key: str, device_id: int, response: dict):
+        self.stored += 1
+        if self.backend == "database":
+            await asyncio.to_thread(self._put_database, key, device_id, response)
+        else:
+            self._put_memory(key, response)
+
+    @staticmethod
+    def _replay(response: dict) -> dict:
+        """Return a stored response, or raise the stored client error again"""
+        error = response.get(STORED_ERROR)
+        if error is not None:
+            raise HTTPException(status_code=error["status_code"], detail=error["detail"])
+        return response
+
+    async def run_once(self, key: Optional[str], device_id: int, handler: Callable[[], Awaitable[dict]]) -> tuple:
+        """
+        Run handler unless a response for key is stored or already in progress
+
+        HTTPExceptions with a 4xx status are stored and raised again on
+        replay. Other exceptions (e.g. 503 when the server is busy) are not
+        stored, so the device can retry them.
+
+        Returns:
+            (response, replayed)
+        """
+        if not self.enabled or key is None:
+            return await handler(), False
+
+        response = await self.get(key)
+        if response is not None:
+            self.replayed += 1
+            return self._replay(response), True
+
+        pending = self._pending.get(key)
+        if pending is not None:
+            self.joined += 1
+            return await asyncio.shield(pending), True
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending[key] = future
+        try:
+            response = jsonable_encoder(await handler())
+            await self.put(key, device_id, response)
+            future.set_result(response)
+            return response, False
+        except Exception as e:
+            if isinstance(e, HTTPException) and e.status_code < 500:
+                await self.put(key, device_id, {
+                    STORED_ERROR: jsonable_encoder({"status_code": e.status_code, "detail": e.detail})
+                })
+            future.set_exception(e)
+            # Nobody may be waiting - mark the exception as retrieved
+            future.exception()
+            raise
+        finally:
+            if not future.done():
+                future.cancel()
+            del self._pending[key]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "backend": self.backend,
+                "ttl_seconds": settings.IDEMPOTENCY_TTL_SECONDS,
+                "entries": len(self._responses) if self.backend == "memory" else None,
+                "in_progress": len(self._pending),
+                "stored": self.stored,
+                "replayed": self.replayed,
+                "joined": self.joined
+            }
+
+
+# Global instance
+idempotency_store = IdempotencyStore()
@@ -0,0 +1,260 @@
+"""
+Image Writer - stores uploaded images off the request path
+
+Files are the original uploaded bytes (no decode / re-encode). A background
+thread drains a bounded queue and writes whatever has accumulated as one
+batch: every file goes to a temporary name, the batch is fsynced, then the
+files are renamed into place and each directory is fsynced once. Readers
+never see a partial file.
+
+When the queue is full the image is dropped (counted in stats), so a slow
+disk never stalls a request. Callers reserve a slot before they record the
+path in the database and submit after the commit, so a dropped image is
+never referenced and a failed commit leaves no file behind. A queued write
+can be cancelled (the face it belongs to was deleted); the file is then
+never moved into place.
+"""
+from typing import List, Optional, Tuple
+from config import settings
+import os
+import queue
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class ImageWriter:
+    """Bounded background queue of (path, bytes) writes with batched fsync"""
+
+    def __init__(self):
+        self._queue = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._pending = {}  # path -> queued writes not yet moved into place
+        self._cancelled = set()  # Pending paths whose writes must be discarded
+        self._reserved = 0  # Queue slots promised to callers that have not submitted yet
+
+        # Counters
+        self.written = 0
+        self.failed = 0
+        self.dropped = 0  # Queue was full
+        self.cancelled = 0
+        self.batches = 0
+        self.bytes_written = 0
+        self.total_batch_ms = 0.0
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._queue = queue.Queue(maxsize=max(1, settings.IMAGE_WRITER_QUEUE_SIZE))
+            self._thread = threading.Thread(target=self._run, name="image-writer", daemon=True)
+            self._thread.start()
+
+    def _has_room(self) -> bool:
+        """Lock held"""
+        return self._queue.qsize() + self._reserved < self._queue.maxsize
+
+    def reserve(self) -> bool:
+        """
+        Promise a queue slot to a write that will be submitted later
+
+        Returns:
+            False if the queue is full (the image is dropped: record no path)
+        """
+        if self._thread is None or not self._thread.is_alive():
+            self.start()
+        with self._lock:
+            if not self._has_room():
+                self.dropped += 1
+                logger.warning("Image writer queue full, image not stored")
+                return False
+            self._reserved += 1
+            return True
+
+    def release(self):
+        """Give back a reserved slot that will not be used (e.g. the commit failed)"""
+        with self._lock:
+            self._reserved = max(0, self._reserved - 1)
+
+    def submit(self, path: str, data: bytes, reserved: bool = False) -> bool:
+        """
+        Queue a file write, in the slot taken by reserve() when reserved is True
+
+        Returns:
+            False if the queue is full and the image was dropped
+        """
+        if self._thread is None or not self._thread.is_alive():
+            self.start()
+        with self._lock:
+            if reserved:
+                self._reserved = max(0, self._reserved - 1)
+            elif not self._has_room():
+                self.dropped += 1
+                logger.warning(f"Image writer queue full, image not stored: {path}")
+                return False
+            self._queue.put_nowait((path, data))
+            self._pending[path] = self._pending.get(path, 0) + 1
+            self._cancelled.discard(path)
+        return True
+
+    def cancel(self, path: str) -> bool:
+        """
+        Discard queued writes of path (e.g. its face was deleted)
+
+        Returns:
+            True if a write was pending; otherwise any file is already in place
+        """
+        with self._lock:
+            if path not in self._pending:
+                return False
+            self._cancelled.add(path)
+            return True
+
+    def _done(self, path: str) -> bool:
+        """Mark one write of path as finished (lock held); True if it was cancelled"""
+        count = self._pending.get(path, 0) - 1
+        if count > 0:
+            self._pending[path] = count
+        else:
+            self._pending.pop(path, None)
+        if path in self._cancelled:
+            if count <= 0:
+                self._cancelled.discard(path)
+            return True
+        return False
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                return
+
+            batch = [item]
+            stop = False
+            while len(batch) < settings.IMAGE_WRITER_BATCH_SIZE:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+
+            try:
+                self._write_batch(batch)
+            finally:
+                for _ in range(len(batch) + (1 if stop else 0)):
+                    self._queue.task_done()
+            if stop:
+                return
+
+    def _write_batch(self, batch: List[Tuple[str, bytes]]):
+        start = time.perf_counter()
+        opened = []
+        for path, data in batch:
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            try:
+                f = open(tmp_path, "wb")
+            except OSError as e:
+                self._failed(path, e)
+                continue
+            try:
+                f.write(data)
+            except OSError as e:
+                f.close()
+                os.remove(tmp_path)
+                self._failed(path, e)
+                continue
+            opened.append((f, tmp_path, path, len(data)))
+
+        # Sync the whole batch after all writes are issued, so the disk sees them together
+        staged = []
+        for f, tmp_path, path, size in opened:
+            try:
+                f.flush()
+                if settings.IMAGE_WRITER_FSYNC:
+                    os.fsync(f.fileno())
+                f.close()
+                staged.append((tmp_path, path, size))
+            except OSError as e:
+                f.close()
+                self._failed(path, e)
+
+        directories = set()
+        for tmp_path, path, size in staged:
+            # Under the lock: cancel() either sees the write pending or finds the file in place
+            with self._lock:
+                try:
+                    if self._done(path):
+                        os.remove(tmp_path)
+                        self.cancelled += 1
+                        continue
+                    os.replace(tmp_path, path)
+                    directories.add(os.path.dirname(os.path.abspath(path)))
+                    self.written += 1
+                    self.bytes_written += size
+                except OSError as e:
+                    self.failed += 1
+                    logger.error(f"Failed to move image into place {path}: {e}")
+
+        # One directory fsync per batch makes the renames durable
+        if settings.IMAGE_WRITER_FSYNC and hasattr(os, "O_DIRECTORY"):
+            for directory in directories:
+                try:
+                    fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+                    try:
+                        os.fsync(fd)
+                    finally:
+                        os.close(fd)
+                except OSError:
+                    pass
+
+        self.batches += 1
+        self.total_batch_ms += (time.perf_counter() - start) * 1000
+
+    def _failed(self, path: str, error: Exception):
+        with self._lock:
+            self._done(path)
+            self.failed += 1
+        logger.error(f"Failed to write image {path}: {error}")
+
+    def flush(self):
+        """Block until every queued image is on disk"""
+        if self._queue is not None:
+            self._queue.join()
+
+    def stop(self, timeout: Optional[float] = 10.0):
+        """Write what is queued and stop the thread (application shutdown)"""
+        with self._lock:
+            thread = self._thread
+            if thread is None or not thread.is_alive():
+                return
+            self._queue.put(None)
+        thread.join(timeout)
+        if thread.is_alive():
+            logger.warning(f"Image writer still busy after {timeout} s, {self._queue.qsize()} images pending")
+        else:
+            logger.info(f"Image writer stopped ({self.written} images written)")
+
+    def stats(self) -> dict:
+        return {
+            "pending": self._queue.qsize() if self._queue is not None else 0,
+            "reserved": self._reserved,
+            "written": self.written,
+            "failed": self.failed,
+            "dropped": self.dropped,
+            "cancelled": self.cancelled,
+            "batches": self.batches,
+            "avg_batch_size": round((self.written + self.failed) / self.batches, 2) if self.batches else 0.0,
+            "avg_batch_ms": round(self.total_batch_ms / self.batches, 2) if self.batches else 0.0,
+            "bytes_written": self.bytes_written
+        }
+
+
+# Global instance
+image_writer = ImageWriter()
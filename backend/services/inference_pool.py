@@ -0,0 +1,156 @@
+"""
+Inference Pool - bounded executor backed by a pool of model sessions
+"""
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+import asyncio
+import queue
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class InferenceQueueFull(Exception):
+    """Raised when too many inference jobs are already waiting"""
+    pass
+
+
+class InferencePool:
+    """
+    Runs blocking inference off the event loop.
+
+    Every worker thread borrows one session (e.g. an InsightFace FaceAnalysis
+    app) from the pool for the duration of a job, so up to `size` frames are
+    processed in parallel. Sessions are created lazily by `factory`.
+    """
+
+    def __init__(self, factory: Callable[[], Any], size: int, max_queue: int):
+        self._factory = factory
+        self.size = max(1, size)
+        self.max_queue = max_queue
+        self._sessions = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=self.size, thread_name_prefix="inference")
+
+        # Counters
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.total_wait_ms = 0.0
+        self.max_wait_ms = 0.0
+
+    def _acquire(self):
+        """Borrow a session, creating one if the pool is not full yet"""
+        try:
+            return self._sessions.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            create = self._created < self.size
+            if create:
+                self._created += 1
+
+        if create:
+            try:
+                return self._factory()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+
+        return self._sessions.get()
+
+    def _release(self, session):
+        self._sessions.put(session)
+
+    def _run(self, fn: Callable, args: tuple, kwargs: dict, submitted_at: float):
+        wait_ms = (time.perf_counter() - submitted_at) * 1000
+        with self._lock:
+            self.queued -= 1
+            self.running += 1
+            self.total_wait_ms += wait_ms
+            self.max_wait_ms = max(self.max_wait_ms, wait_ms)
+
+        try:
+            session = self._acquire()
+            try:
+                result = fn(*args, app=session, **kwargs)
+            finally:
+                self._release(session)
+            with self._lock:
+                self.completed += 1
+            return result
+        except Exception:
+            with self._lock:
+                self.failed += 1
+            raise
+        finally:
+            with self._lock:
+                self.running -= 1
+
+    async def run(self, fn: Callable, *args, **kwargs):
+        """
+        Run fn(*args, app=<session>, **kwargs) on a pool thread
+
+        Raises:
+            InferenceQueueFull: If max_queue jobs are already waiting
+        """
+        with self._lock:
+            if self.max_queue and self.queued >= self.max_queue:
+                self.rejected += 1
+                raise InferenceQueueFull(f"Inference queue is full ({self.queued} waiting)")
+            self.queued += 1
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, self._run, fn, args, kwargs, time.perf_counter()
+        )
+
+    def clear(self) -> bool:
+        """
+        Drop every idle session so their memory can be reclaimed
+        
+        Returns:
+            False (and nothing is dropped) while jobs are queued or running
+        """
+        with self._lock:
+            if self.queued or self.running:
+                return False
+            while True:
+                try:
+                    self._sessions.get_nowait()
+                except queue.Empty:
+                    break
+            self._created = 0
+            return True
+    
+    def close(self):
+        """Stop accepting work; running jobs finish, then the sessions are released"""
+        self._executor.shutdown(wait=False)
+        while True:
+            try:
+                self._sessions.get_nowait()
+            except queue.Empty:
+                break
+    
+    def stats(self) -> dict:
+        """Queue depth and wait-time counters"""
+        with self._lock:
+            started = self.completed + self.failed + self.running
+            return {
+                "workers": self.size,
+                "sessions": self._created,
+                "queue_depth": self.queued,
+                "running": self.running,
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "avg_wait_ms": round(self.total_wait_ms / started, 2) if started else 0.0,
+                "max_wait_ms": round(self.max_wait_ms, 2)
+            }
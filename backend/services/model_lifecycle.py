@@ -0,0 +1,157 @@
+"""
+Model Lifecycle - idle eviction and schedule-based preload of the face model
+"""
+from datetime import datetime, timedelta
+from typing import Optional
+from config import settings
+from database import SessionLocal
+from models.schedule import Schedule
+from services.face_recognition_service import face_recognition_service
+from utils import get_current_time
+import asyncio
+import os
+import resource
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def memory_usage_mb() -> dict:
+    """Resident and peak resident memory of this process in MB"""
+    rss = peak = None
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    rss = int(line.split()[1]) / 1024
+                elif line.startswith("VmHWM:"):
+                    peak = int(line.split()[1]) / 1024
+    except OSError:
+        pass
+
+    if peak is None:
+        # ru_maxrss is in KB on Linux and bytes on macOS
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        peak = maxrss / (1024 * 1024) if os.uname().sysname == "Darwin" else maxrss / 1024
+
+    return {
+        "rss_mb": round(rss, 1) if rss is not None else None,
+        "peak_rss_mb": round(peak, 1)
+    }
+
+
+class ModelLifecycleManager:
+    """
+    Background watchdog for memory-constrained deployments.
+
+    Unloads the InsightFace model after MODEL_IDLE_UNLOAD_MINUTES without
+    requests and loads it again MODEL_PRELOAD_BEFORE_SCHEDULE_MINUTES before
+    the first active lesson of the day.
+    """
+
+    def __init__(self, check_interval: float = 60.0):
+        self.check_interval = check_interval
+        self._task = None
+        self._preloaded_for = None  # Date of the last schedule-based preload
+        self.next_lesson_start = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(settings.MODEL_IDLE_UNLOAD_MINUTES or settings.MODEL_PRELOAD_BEFORE_SCHEDULE_MINUTES)
+
+    def start(self):
+        if not self.enabled or (self._task is not None and not self._task.done()):
+            return
+        self._task = asyncio.create_task(self._watch())
+        logger.info(
+            f"Model lifecycle watchdog started (idle unload: {settings.MODEL_IDLE_UNLOAD_MINUTES} min, "
+            f"preload before lessons: {settings.MODEL_PRELOAD_BEFORE_SCHEDULE_MINUTES} min)"
+        )
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _watch(self):
+        while True:
+            try:
+                await self.check()
+            except Exception as e:
+                logger.error(f"Model lifecycle check failed: {e}")
+            await asyncio.sleep(self.check_interval)
+
+    def first_lesson_today(self, now: datetime) -> Optional[datetime]:
+        """Start of today's first active lesson, None if there is none"""
+        db = SessionLocal()
+        try:
+            schedule = db.query(Schedule).filter(
+                Schedule.is_active == True,
+                Schedule.day_of_week == now.weekday(),
+                (Schedule.effective_from == None) | (Schedule.effective_from <= now),
+                (Schedule.effective_to == None) | (Schedule.effective_to >= now.replace(hour=0, minute=0, second=0, microsecond=0))
+            ).order_by(Schedule.start_time).first()
+        finally:
+            db.close()
+
+        if schedule is None:
+            return None
+        return datetime.combine(now.date(), schedule.start_time)
+
+    def in_preload_window(self, now: datetime) -> bool:
+        """True from PRELOAD minutes before the first lesson until the model is used"""
+        minutes = settings.MODEL_PRELOAD_BEFORE_SCHEDULE_MINUTES
+        if not minutes or self._preloaded_for == now.date():
+            return False
+
+        self.next_lesson_start = self.first_lesson_today(now)
+        if self.next_lesson_start is None:
+            return False
+
+        preload_at = self.next_lesson_start - timedelta(minutes=minutes)
+        return preload_at <= now < self.next_lesson_start
+
+    async def check(self):
+        """One watchdog pass: preload or unload if needed"""
+        service = face_recognition_service
+        # Naive local (Tashkent) time, like the schedule start times
+        now = get_current_time().replace(tzinfo=None)
+
+        if not service.model_loaded:
+            loop = asyncio.get_running_loop()
+            if await loop.run_in_executor(None, self.in_preload_window, now):
+                logger.info(f"Preloading face model for the lesson at {self.next_lesson_start:%H:%M}")
+                self._preloaded_for = now.date()
+                await service.pool.run(service.warm_up)
+            return
+
+        idle = service.idle_seconds()
+        if settings.MODEL_IDLE_UNLOAD_MINUTES and idle is not None and idle >= settings.MODEL_IDLE_UNLOAD_MINUTES * 60:
+            logger.info(f"Face model idle for {idle / 60:.0f} min, unloading")
+            await asyncio.get_running_loop().run_in_executor(None, service.unload_model)
+
+    def stats(self) -> dict:
+        service = face_recognition_service
+        idle = service.idle_seconds()
+        return {
+            "state": service.model_state,
+            "model": settings.INSIGHTFACE_MODEL,
+            "loaded_at": datetime.fromtimestamp(service.loaded_at).isoformat() if service.loaded_at else None,
+            "idle_seconds": round(idle, 1) if idle is not None else None,
+            "sessions": service.pool.stats()["sessions"],
+            "loads": service.loads,
+            "unloads": service.unloads,
+            "idle_unload_minutes": settings.MODEL_IDLE_UNLOAD_MINUTES,
+            "preload_before_schedule_minutes": settings.MODEL_PRELOAD_BEFORE_SCHEDULE_MINUTES,
+            "next_lesson_start": self.next_lesson_start.isoformat() if self.next_lesson_start else None,
+            "watchdog_running": self._task is not None and not self._task.done(),
+            **memory_usage_mb()
+        }
+
+
+# Global instance
+model_lifecycle = ModelLifecycleManager()
@@ -0,0 +1,164 @@
+"""
+ONNX Runtime tuning profiles for the InsightFace sessions
+"""
+import onnxruntime as ort
+from typing import Optional
+from config import settings
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+GRAPH_OPTIMIZATION_LEVELS = {
+    "disable": ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+    "basic": ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    "extended": ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    "all": ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+}
+
+
+def _cpu_count() -> int:
+    return os.cpu_count() or 1
+
+
+def pool_workers() -> int:
+    """Number of InsightFace sessions in the inference pool"""
+    return settings.INFERENCE_WORKERS or _cpu_count()
+
+
+def _threads_per_session() -> int:
+    return max(1, _cpu_count() // pool_workers())
+
+
+# Profile defaults - each value can be overridden by the ONNX_* settings
+PROFILES = {
+    # Several sessions in parallel: split the cores between them
+    "throughput": lambda: {
+        "intra_op_threads": _threads_per_session(),
+        "inter_op_threads": 1,
+        "graph_optimization": "all",
+        "mem_arena": True,
+    },
+    # One frame as fast as possible: every core on a single session
+    "latency": lambda: {
+        "intra_op_threads": _cpu_count(),
+        "inter_op_threads": 1,
+        "graph_optimization": "all",
+        "mem_arena": True,
+    },
+    # Small instances: no arena pre-allocation, single thread
+    "low_memory": lambda: {
+        "intra_op_threads": 1,
+        "inter_op_threads": 1,
+        "graph_optimization": "all",
+        "mem_arena": False,
+    },
+}
+
+
+def resolve_profile() -> Optional[dict]:
+    """
+    Merge the selected profile with explicit ONNX_* overrides
+
+    Returns:
+        Option dict, or None when the default InsightFace sessions should be kept
+    """
+    name = settings.ONNX_PROFILE.lower()
+    if name not in PROFILES and name != "default":
+        logger.warning(f"Unknown ONNX_PROFILE '{name}', using default sessions")
+        name = "default"
+
+    options = PROFILES[name]() if name in PROFILES else {}
+    if name == "default" and pool_workers() > 1:
+        # Each ORT session otherwise starts a thread pool sized to every core
+        options["intra_op_threads"] = _threads_per_session()
+
+    if settings.ONNX_INTRA_OP_THREADS:
+        options["intra_op_threads"] = settings.ONNX_INTRA_OP_THREADS
+    if settings.ONNX_INTER_OP_THREADS:
+        options["inter_op_threads"] = settings.ONNX_INTER_OP_THREADS
+    if settings.ONNX_GRAPH_OPTIMIZATION:
+        options["graph_optimization"] = settings.ONNX_GRAPH_OPTIMIZATION.lower()
+    if settings.ONNX_ENABLE_MEM_ARENA is not None:
+        options["mem_arena"] = settings.ONNX_ENABLE_MEM_ARENA
+    if settings.ONNX_OPTIMIZED_MODEL_DIR:
+        options["optimized_model_dir"] = settings.ONNX_OPTIMIZED_MODEL_DIR
+
+    return options or None
+
+
+def create_session(model_file: str, options: dict) -> ort.InferenceSession:
+    """
+    Create an InferenceSession with the given profile options
+
+    When optimized_model_dir is set the graph optimized for this host is
+    serialized on first load and reused (with optimizations disabled) afterwards.
+    """
+    sess_options = ort.SessionOptions()
+
+    if options.get("intra_op_threads"):
+        sess_options.intra_op_num_threads = int(options["intra_op_threads"])
+    if options.get("inter_op_threads"):
+        sess_options.inter_op_num_threads = int(options["inter_op_threads"])
+    if options.get("inter_op_threads", 1) > 1:
+        sess_options.execution_mode = ort.ExecutionMode.ORT_PARALLEL
+
+    if "mem_arena" in options:
+        sess_options.enable_cpu_mem_arena = bool(options["mem_arena"])
+        sess_options.enable_mem_pattern = bool(options["mem_arena"])
+
+    level = options.get("graph_optimization", "all")
+    if level not in GRAPH_OPTIMIZATION_LEVELS:
+        logger.warning(f"Unknown graph optimization level '{level}', using 'all'")
+        level = "all"
+    sess_options.graph_optimization_level = GRAPH_OPTIMIZATION_LEVELS[level]
+
+    path = model_file
+    optimized_dir = options.get("optimized_model_dir")
+    if optimized_dir:
+        os.makedirs(optimized_dir, exist_ok=True)
+        base = os.path.splitext(os.path.basename(model_file))[0]
+        optimized_path = os.path.join(optimized_dir, f"{base}.{level}.opt.onnx")
+
+        if os.path.exists(optimized_path) and os.path.getmtime(optimized_path) >= os.path.getmtime(model_file):
+            path = optimized_path
+            sess_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+            logger.info(f"Using pre-optimized model: {optimized_path}")
+        else:
+            sess_options.optimized_model_filepath = optimized_path
+
+    return ort.InferenceSession(path, sess_options=sess_options, providers=['CPUExecutionProvider'])
+
+
+def apply_runtime_profile(app):
+    """
+    Rebuild the sessions of a prepared FaceAnalysis app with the configured
+    profile, and swap in a custom (e.g. INT8-quantized) recognition model.
+    """
+    options = resolve_profile()
+    recognition_path = settings.FACE_RECOGNITION_MODEL_PATH
+
+    if options is None and not recognition_path:
+        return app
+
+    options = options or {}
+    for taskname, model in list(app.models.items()):
+        model_file = getattr(model, "model_file", None)
+
+        if taskname == "recognition" and recognition_path:
+            from insightface.model_zoo.arcface_onnx import ArcFaceONNX
+
+            if not os.path.exists(recognition_path):
+                raise FileNotFoundError(f"Recognition model not found: {recognition_path}")
+            rec_model = ArcFaceONNX(model_file=recognition_path, session=create_session(recognition_path, options))
+            rec_model.prepare(ctx_id=0)
+            app.models[taskname] = rec_model
+            logger.info(f"Custom recognition model loaded: {recognition_path}")
+            continue
+
+        if model_file and hasattr(model, "session"):
+            model.session = create_session(model_file, options)
+
+    app.det_model = app.models["detection"]
+    logger.info(f"ONNX Runtime profile applied: {settings.ONNX_PROFILE} {options}")
+    return app
@@ -0,0 +1,271 @@
+"""
+Re-embedding Job - embed every enrolled face with a new InsightFace model
+
+The new embeddings go to the face_embeddings table next to the existing ones,
+so the live system keeps matching with the current model while the job runs.
+The job is resumable: a restart only processes faces that have no embedding
+of the target model yet. When everything is done the recognition model and
+the face index are switched together (FaceEmbeddingIndex.swap_model).
+"""
+import numpy as np
+import cv2
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Optional
+from sqlalchemy import and_
+from config import settings
+from database import SessionLocal
+from models.face import Face
+from models.face_embedding import FaceEmbedding
+from services.face_recognition_service import face_recognition_service
+from services.face_index import face_embedding_index
+from services.crop_store import crop_store
+import queue
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+MAX_REPORTED_FAILURES = 100
+
+
+class ReembedJob:
+    """Background re-embedding of the stored face images with bounded parallelism"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread = None
+        self._cancel = threading.Event()
+        self._reset(None)
+
+    def _reset(self, target_model: Optional[str]):
+        self.state = "idle"  # idle, running, completed, cancelled, failed
+        self.target_model = target_model
+        self.source_model = settings.INSIGHTFACE_MODEL
+        self.total = 0
+        self.processed = 0
+        self.embedded = 0
+        self.failed = 0
+        self.from_crops = 0  # Embedded from stored aligned crops (no detection)
+        self.failures = []
+        self.activated = False
+        self.error = None
+        self.started_at = None
+        self.finished_at = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(
+        self,
+        target_model: str,
+        batch_size: Optional[int] = None,
+        workers: Optional[int] = None,
+        activate: bool = True,
+        force: bool = False
+    ):
+        """
+        Start the job in a background thread
+
+        Args:
+            target_model: InsightFace model pack to embed with, e.g. buffalo_l
+            activate: Switch to the new model when every face is embedded
+            force: Switch even if some images could not be embedded
+                (those faces are not matched until they are re-enrolled)
+
+        Raises:
+            ValueError: If a job is already running
+        """
+        with self._lock:
+            if self.running:
+                raise ValueError(f"Re-embedding to {self.target_model} is already running")
+            self._reset(target_model)
+            self.state = "running"
+            self.started_at = datetime.now()
+            self._cancel.clear()
+            self._thread = threading.Thread(
+                target=self._run,
+                args=(
+                    target_model,
+                    max(1, batch_size or settings.REEMBED_BATCH_SIZE),
+                    max(1, workers or settings.REEMBED_WORKERS),
+                    activate,
+                    force
+                ),
+                name="face-reembed",
+                daemon=True
+            )
+            self._thread.start()
+        logger.info(f"Re-embedding started: {self.source_model} -> {target_model}")
+
+    def cancel(self) -> bool:
+        """Stop after the current batch (progress is kept, start again to resume)"""
+        if not self.running:
+            return False
+        self._cancel.set()
+        return True
+
+    @staticmethod
+    def _pending(db, target_model: str):
+        """Faces without an embedding of the target model"""
+        return db.query(Face).outerjoin(
+            FaceEmbedding, and_(FaceEmbedding.face_id == Face.id, FaceEmbedding.model_name == target_model)
+        ).filter(
+            (Face.model_name == None) | (Face.model_name != target_model),
+            FaceEmbedding.id == None
+        )
+
+    def _record_failure(self, face_id: int, reason: str):
+        self.failed += 1
+        if len(self.failures) < MAX_REPORTED_FAILURES:
+            self.failures.append({"face_id": face_id, "reason": reason})
+
+    def _run(self, target_model: str, batch_size: int, workers: int, activate: bool, force: bool):
+        sessions = queue.Queue()
+        created = []
+        created_lock = threading.Lock()
+
+        def acquire():
+            try:
+                return sessions.get_nowait()
+            except queue.Empty:
+                pass
+            with created_lock:
+                if len(created) < workers:
+                    app = face_recognition_service._create_app(target_model)
+                    created.append(app)
+                    return app
+            return sessions.get()
+
+        def embed(face_id: int, image_path: Optional[str], crop: Optional[np.ndarray]):
+            if crop is not None:
+                # Stored aligned crop: only the recognition network runs
+                app = acquire()
+                try:
+                    return face_id, face_recognition_service.embed_aligned([crop], app=app)[0], None, None
+                finally:
+                    sessions.put(app)
+
+            if not image_path:
+                return face_id, None, "no_image", None
+            image = cv2.imread(image_path)
+            if image is None:
+                return face_id, None, "image_not_found", None
+            app = acquire()
+            try:
+                result = face_recognition_service.get_embeddings_batch([image], app=app, return_crops=True)[0]
+            finally:
+                sessions.put(app)
+            if result is None:
+                return face_id, None, "no_face", None
+            # Keep the crop so the next migration skips detection
+            return face_id, result[0], None, result[1]
+
+        failed_ids = set()
+        db = SessionLocal()
+        try:
+            self.total = self._pending(db, target_model).count()
+            logger.info(f"Re-embedding {self.total} faces with {target_model} ({workers} workers)")
+
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="reembed") as executor:
+                # Repeat until a pass finds nothing new: faces enrolled meanwhile are included
+                while not self._cancel.is_set():
+                    last_id = 0
+                    found = False
+                    while not self._cancel.is_set():
+                        batch = self._pending(db, target_model).with_entities(
+                            Face.id, Face.user_id, Face.image_path
+                        ).filter(
+                            Face.id > last_id
+                        ).order_by(Face.id).limit(batch_size).all()
+                        if not batch:
+                            break
+                        last_id = batch[-1].id
+                        batch = [row for row in batch if row.id not in failed_ids]
+
+                        crops = {}
+                        for user_id in {row.user_id for row in batch}:
+                            crops.update(crop_store.user_crops(user_id))
+                        self.from_crops += sum(1 for row in batch if row.id in crops)
+
+                        results = list(executor.map(
+                            lambda row: embed(row.id, row.image_path, crops.get(row.id)), batch
+                        ))
+                        owners = {row.id: row.user_id for row in batch}
+                        new_crops = {}
+                        for face_id, embedding, reason, crop in results:
+                            self.processed += 1
+                            if embedding is None:
+                                failed_ids.add(face_id)
+                                self._record_failure(face_id, reason)
+                                continue
+                            db.add(FaceEmbedding(
+                                face_id=face_id,
+                                model_name=target_model,
+                                embedding=face_recognition_service.embedding_to_bytes(embedding),
+                                embedding_codec=face_recognition_service.embedding_codec
+                            ))
+                            self.embedded += 1
+                            found = True
+                            if crop is not None:
+                                new_crops.setdefault(owners[face_id], []).append((face_id, crop))
+                        db.commit()
+                        for user_id, pairs in new_crops.items():
+                            crop_store.add_faces(user_id, [f for f, _ in pairs], [c for _, c in pairs])
+                        logger.info(f"Re-embedding progress: {self.processed}/{self.total}")
+
+                    if not found:
+                        break
+                    self.total = max(self.total, self.processed)
+
+            if self._cancel.is_set():
+                self.state = "cancelled"
+                logger.info(f"Re-embedding cancelled after {self.processed} faces")
+                return
+
+            if activate and target_model != settings.INSIGHTFACE_MODEL:
+                if self.failed and not force:
+                    logger.warning(
+                        f"Re-embedding finished with {self.failed} failures, model not switched (use force)"
+                    )
+                else:
+                    # A session of the new model is already loaded: it becomes the shared one
+                    app = created[0] if created else None
+                    face_embedding_index.swap_model(
+                        db, target_model, lambda: face_recognition_service.switch_model(target_model, app)
+                    )
+                    self.activated = True
+
+            self.state = "completed"
+            logger.info(f"Re-embedding completed: {self.embedded} embedded, {self.failed} failed")
+        except Exception as e:
+            db.rollback()
+            self.state = "failed"
+            self.error = str(e)
+            logger.error(f"Re-embedding failed: {e}")
+        finally:
+            db.close()
+            self.finished_at = datetime.now()
+
+    def status(self) -> dict:
+        return {
+            "state": self.state,
+            "source_model": self.source_model,
+            "target_model": self.target_model,
+            "active_model": settings.INSIGHTFACE_MODEL,
+            "total": self.total,
+            "processed": self.processed,
+            "embedded": self.embedded,
+            "failed": self.failed,
+            "from_crops": self.from_crops,
+            "failures": self.failures,
+            "activated": self.activated,
+            "error": self.error,
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None
+        }
+
+
+# Global instance
+reembed_job = ReembedJob()
@@ -0,0 +1,87 @@
+"""
+Schedule Candidates - users who can attend a lesson right now
+
+Used to narrow face matching to the members of groups that have an active
+schedule in the current check-in window.
+"""
+import numpy as np
+from datetime import datetime
+from sqlalchemy.orm import Session
+from typing import Optional
+from config import settings
+from services.timetable import timetable_cache
+from utils import get_current_time
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class ScheduleCandidateCache:
+    """
+    Candidate users per (minute, room), resolved from the compiled timetable.
+
+    Resolved entries are dropped whenever the timetable is rebuilt after a
+    schedule or group membership change.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._resolved = {}  # (minute, room) -> candidates
+        self._version = None  # Timetable version the resolved entries belong to
+
+    def invalidate(self):
+        """Drop the compiled timetable and the resolved candidates"""
+        timetable_cache.invalidate()
+
+    def active_schedules(self, db: Session, check_time: datetime) -> tuple:
+        """Active schedules whose check-in window contains check_time"""
+        return timetable_cache.get(db).open_at(check_time)
+
+    def candidate_user_ids(self, db: Session, check_time: Optional[datetime] = None, room: Optional[str] = None) -> Optional[np.ndarray]:
+        """
+        Users who belong to a group with a lesson in the current window
+
+        check_time is local (Tashkent) time like the schedules, now by default.
+        When room is given and some active schedule is held in that room, only
+        those schedules are used.
+
+        Returns:
+            Sorted user id array, or None when matching cannot be narrowed
+            (no active schedule, or a lesson open to every user)
+        """
+        if check_time is None:
+            check_time = get_current_time()
+        room = room.strip().lower() if room and settings.FACE_CANDIDATE_MATCH_ROOM else None
+        key = (check_time.replace(second=0, microsecond=0), room)
+        version = timetable_cache.version
+
+        if self._version == version:
+            cached = self._resolved.get(key, False)
+            if cached is not False:
+                return cached
+
+        timetable = timetable_cache.get(db)
+        schedules = timetable.open_at(check_time)
+        if room:
+            in_room = [s for s in schedules if s.room == room]
+            if in_room:
+                schedules = in_room
+
+        candidates = None
+        if schedules and all(s.group_id is not None for s in schedules):
+            groups = [timetable.members.get(s.group_id) for s in schedules]
+            groups = [g for g in groups if g is not None]
+            candidates = np.unique(np.concatenate(groups)) if groups else np.empty(0, dtype=np.int64)
+
+        with self._lock:
+            if version == timetable_cache.version:
+                if self._version != version or len(self._resolved) > 256:
+                    self._resolved = {}
+                    self._version = version
+                self._resolved[key] = candidates
+        return candidates
+
+
+# Global instance
+schedule_candidates = ScheduleCandidateCache()
@@ -7,6 +7,7 @@ from models.attendance import Attendance
 from models.user import User
 from datetime import datetime, date, time, timedelta
 from typing import List, Dict, Optional
+from services.timetable import timetable_cache
 import logging
 
 logger = logging.getLogger(__name__)
@@ -65,6 +66,7 @@ class ScheduleService:
         db.add(schedule)
         db.commit()
         db.refresh(schedule)
+        timetable_cache.invalidate()
         
         logger.info(f"Schedule created: {name} on day {day_of_week} at {start_time}-{end_time}")
         
@@ -191,6 +193,7 @@ class ScheduleService:
         
         db.commit()
         db.refresh(schedule)
+        timetable_cache.invalidate()
         
         logger.info(f"Schedule updated: {schedule.id}")
         
@@ -215,6 +218,7 @@ class ScheduleService:
         
         db.delete(schedule)
         db.commit()
+        timetable_cache.invalidate()
         
         logger.info(f"Schedule deleted: {schedule_id}")
         
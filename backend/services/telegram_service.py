@@ -642,8 +642,8 @@ API Base: <code>{settings.TELEGRAM_API_BASE_URL}</code>"""
             finally:
                 db.close()
     
-    async def notify_attendance(self, user_name: str, employee_id: str, check_in_time: str, confidence: float, status: str, image_path: str = None):
-        """Send attendance notification to admin chats"""
+    async def notify_attendance(self, user_name: str, employee_id: str, check_in_time: str, confidence: float, status: str, image_path: str = None, image_bytes: bytes = None):
+        """Send attendance notification to admin chats (image_bytes: photo that may not be on disk yet)"""
         try:
             status_emoji = "✅" if status == "present" else "⏰"
             status_text = "Keldi" if status == "present" else "Kechikdi"
@@ -657,16 +657,24 @@ API Base: <code>{settings.TELEGRAM_API_BASE_URL}</code>"""
 🎯 Ishonch: {confidence:.1f}%"""
             
             # Send photo with caption if image exists
-            if image_path and os.path.exists(image_path):
+            if image_bytes or (image_path and os.path.exists(image_path)):
                 for chat_id in settings.admin_chat_ids:
                     try:
-                        with open(image_path, 'rb') as photo:
+                        if image_bytes:
                             await self.bot.send_photo(
                                 chat_id=chat_id,
-                                photo=photo,
+                                photo=image_bytes,
                                 caption=message,
                                 parse_mode="HTML"
                             )
+                        else:
+                            with open(image_path, 'rb') as photo:
+                                await self.bot.send_photo(
+                                    chat_id=chat_id,
+                                    photo=photo,
+                                    caption=message,
+                                    parse_mode="HTML"
+                                )
                     except Exception as e:
                         logger.error(f"Failed to send photo to admin {chat_id}: {e}")
                         # Fallback to text message
@@ -677,7 +685,7 @@ API Base: <code>{settings.TELEGRAM_API_BASE_URL}</code>"""
         except Exception as e:
             logger.error(f"Admin notification error: {e}")
     
-    async def notify_user_attendance(self, user_id: int, schedule_name: str, check_in_time: str, status: str, late_minutes: int = 0, image_path: str = None):
+    async def notify_user_attendance(self, user_id: int, schedule_name: str, check_in_time: str, status: str, late_minutes: int = 0, image_path: str = None, image_bytes: bytes = None):
         """Send personal attendance notification to user"""
         db = SessionLocal()
         try:
@@ -713,15 +721,23 @@ Bugun: {today_count} ta davomat"""
             
             # Send photo with caption if image exists
             chat_id = int(user.telegram_chat_id)
-            if image_path and os.path.exists(image_path):
+            if image_bytes or (image_path and os.path.exists(image_path)):
                 try:
-                    with open(image_path, 'rb') as photo:
+                    if image_bytes:
                         await self.bot.send_photo(
                             chat_id=chat_id,
-                            photo=photo,
+                            photo=image_bytes,
                             caption=message,
                             parse_mode="HTML"
                         )
+                    else:
+                        with open(image_path, 'rb') as photo:
+                            await self.bot.send_photo(
+                                chat_id=chat_id,
+                                photo=photo,
+                                caption=message,
+                                parse_mode="HTML"
+                            )
                 except Exception as e:
                     logger.error(f"Failed to send photo to user {user_id}: {e}")
                     # Fallback to text message
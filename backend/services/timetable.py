@@ -0,0 +1,217 @@
+"""
+Timetable - in-memory copy of the active schedules for check-in resolution
+
+Schedules are compiled once into per-weekday check-in windows (30 minutes
+before start until end; a lesson starting just after midnight opens the
+evening before, on the previous weekday).
+The windows are cut into non-overlapping segments, each holding the
+schedules open during it in priority order, so "which schedule applies to
+user U at time T" is one bisect plus a short scan without touching the
+database.
+"""
+from bisect import bisect_right
+from collections import namedtuple
+from datetime import date, datetime, timedelta
+from sqlalchemy.orm import Session
+from typing import Optional
+import numpy as np
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+EARLY_ARRIVAL_MINUTES = 30  # Check-in opens this long before a lesson starts
+DAY_MICROSECONDS = 24 * 3600 * 1000000
+
+TimetableEntry = namedtuple("TimetableEntry", [
+    "id", "day_of_week", "start_time", "end_time", "group_id", "room",
+    "late_threshold_minutes", "duplicate_check_minutes", "effective_from", "effective_to"
+])
+
+
+def _microseconds(value) -> int:
+    """Time of day in microseconds since midnight"""
+    return ((value.hour * 60 + value.minute) * 60 + value.second) * 1000000 + value.microsecond
+
+
+def check_in_intervals(start_time, end_time) -> list:
+    """
+    Check-in window as (day offset, from, to) half-open microsecond ranges
+
+    Open from 30 minutes before start until end (inclusive). A lesson starting
+    before 00:30 opens the previous evening: that part has day offset -1 (the
+    weekday before the lesson's). A window that would end before it opens
+    (lesson ending after midnight) never matches.
+    """
+    early = EARLY_ARRIVAL_MINUTES * 60 * 1000000
+    start = _microseconds(start_time) - early
+    end = _microseconds(end_time) + 1
+
+    if start < 0:
+        return [(0, 0, end), (-1, DAY_MICROSECONDS + start, DAY_MICROSECONDS)]
+    if start < end:
+        return [(0, start, end)]
+    return []
+
+
+def occurrence_date(entry, check_time: datetime) -> date:
+    """
+    Date of the lesson occurrence a check-in inside entry's window belongs to
+
+    Only a lesson starting before 00:30 has an evening part; a check-in there
+    (after the lesson's end time of day) belongs to the next day's lesson.
+    """
+    opens_evening_before = _microseconds(entry.start_time) < EARLY_ARRIVAL_MINUTES * 60 * 1000000
+    if opens_evening_before and _microseconds(check_time.time()) > _microseconds(entry.end_time):
+        return check_time.date() + timedelta(days=1)
+    return check_time.date()
+
+
+class Timetable:
+    """
+    Compiled active schedules and group memberships
+
+    Immutable once built; TimetableCache swaps in a new one after changes.
+    """
+
+    def __init__(self, entries: list, memberships: list):
+        self.entries = {entry.id: entry for entry in entries}
+
+        user_groups = {}
+        members = {}
+        for group_id, user_id in memberships:
+            user_groups.setdefault(user_id, set()).add(group_id)
+            members.setdefault(group_id, []).append(user_id)
+        self.user_groups = {user_id: frozenset(groups) for user_id, groups in user_groups.items()}
+        self.members = {
+            group_id: np.unique(np.array(user_ids, dtype=np.int64))
+            for group_id, user_ids in members.items()
+        }
+
+        # Same order as the original resolution: group schedules first, then by start time
+        ordered = sorted(entries, key=lambda e: (e.group_id is None, e.start_time, e.id))
+
+        self._bounds = {}  # day_of_week -> sorted segment start points
+        self._segments = {}  # day_of_week -> entries open in [bounds[i], bounds[i + 1])
+        intervals_by_day = {}
+        for entry in ordered:
+            for offset, start, end in check_in_intervals(entry.start_time, entry.end_time):
+                intervals_by_day.setdefault((entry.day_of_week + offset) % 7, []).append(((start, end), entry))
+
+        for day, intervals in intervals_by_day.items():
+            bounds = sorted({point for (start, end), _ in intervals for point in (start, end)})
+            segments = []
+            for left, right in zip(bounds, bounds[1:]):
+                segments.append(tuple(
+                    entry for (start, end), entry in intervals
+                    if start <= left and end >= right
+                ))
+            self._bounds[day] = bounds
+            self._segments[day] = segments
+
+    @classmethod
+    def load(cls, db: Session) -> "Timetable":
+        from models.schedule import Schedule
+        from models.group import user_groups
+
+        rows = db.query(
+            Schedule.id, Schedule.day_of_week, Schedule.start_time, Schedule.end_time,
+            Schedule.group_id, Schedule.room, Schedule.late_threshold_minutes,
+            Schedule.duplicate_check_minutes, Schedule.effective_from, Schedule.effective_to
+        ).filter(Schedule.is_active == True).all()
+
+        entries = [
+            TimetableEntry(
+                id=row.id,
+                day_of_week=row.day_of_week,
+                start_time=row.start_time,
+                end_time=row.end_time,
+                group_id=row.group_id,
+                room=row.room.strip().lower() if row.room else None,
+                late_threshold_minutes=row.late_threshold_minutes,
+                duplicate_check_minutes=row.duplicate_check_minutes,
+                # Effective dates are compared by calendar day
+                effective_from=row.effective_from.date() if row.effective_from else None,
+                effective_to=row.effective_to.date() if row.effective_to else None
+            )
+            for row in rows
+        ]
+        memberships = db.query(user_groups.c.group_id, user_groups.c.user_id).all()
+
+        timetable = cls(entries, memberships)
+        logger.info(f"Timetable compiled: {len(entries)} schedules, {len(timetable.members)} groups")
+        return timetable
+
+    def open_at(self, check_time: datetime) -> tuple:
+        """Schedules whose check-in window contains check_time, in priority order"""
+        day = check_time.weekday()
+        bounds = self._bounds.get(day)
+        if not bounds:
+            return ()
+
+        index = bisect_right(bounds, _microseconds(check_time.time())) - 1
+        if index < 0 or index >= len(self._segments[day]):
+            return ()
+
+        # Effective dates apply to the lesson's own date (the next day for an evening check-in)
+        result = []
+        for entry in self._segments[day][index]:
+            lesson_date = occurrence_date(entry, check_time)
+            if (entry.effective_from is None or entry.effective_from <= lesson_date) \
+                    and (entry.effective_to is None or entry.effective_to >= lesson_date):
+                result.append(entry)
+        return tuple(result)
+
+    def resolve(self, check_time: datetime, user_id: Optional[int] = None) -> Optional[TimetableEntry]:
+        """
+        Schedule a check-in at check_time belongs to
+
+        With user_id only the user's group schedules and schedules without a
+        group are considered; group schedules win over public ones, then the
+        earliest start.
+        """
+        schedules = self.open_at(check_time)
+        if not user_id:
+            return schedules[0] if schedules else None
+
+        groups = self.user_groups.get(user_id, frozenset())
+        for entry in schedules:
+            if entry.group_id is None or entry.group_id in groups:
+                return entry
+        return None
+
+    def session_date(self, schedule_id: Optional[int], check_time: datetime) -> date:
+        """Lesson occurrence date of a check-in under schedule_id (its own date without one)"""
+        entry = self.entries.get(schedule_id)
+        if entry is None:
+            return check_time.date()
+        return occurrence_date(entry, check_time)
+
+
+class TimetableCache:
+    """Compiled on first use, rebuilt after schedule or group membership changes"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._timetable = None
+        self.version = 0
+
+    def invalidate(self):
+        """Drop the compiled timetable"""
+        with self._lock:
+            self._timetable = None
+            self.version += 1
+
+    def get(self, db: Session) -> Timetable:
+        timetable = self._timetable
+        if timetable is not None:
+            return timetable
+
+        with self._lock:
+            if self._timetable is None:
+                self._timetable = Timetable.load(db)
+            return self._timetable
+
+
+# Global instance
+timetable_cache = TimetableCache()
@@ -0,0 +1,104 @@
+"""
+Write-behind attendance buffer: sightings are coalesced per lesson
+occurrence, the duplicate check sees them on both sides of midnight, and a
+record that keeps failing is dropped instead of being retried forever
+"""
+from datetime import date, datetime, timedelta
+import pytest
+from sqlalchemy.exc import IntegrityError, OperationalError
+import database
+from config import settings
+from models.attendance import Attendance
+from models.user import User
+import services.attendance_buffer as buffer_module
+import services.attendance_service as attendance_module
+from services.attendance_buffer import AttendanceWriteBuffer
+from services.attendance_service import AttendanceService
+from test_attendance_upsert import MORNING_CHECK_IN, TASHKENT, fresh_caches, make_engine  # noqa: F401
+
+
+@pytest.fixture
+def setup(tmp_path, monkeypatch):
+    engine, Session = make_engine(tmp_path)
+    db = Session()
+    db.add(User(id=2, full_name="Second", employee_id="S002"))
+    db.commit()
+
+    buffer = AttendanceWriteBuffer()
+    monkeypatch.setattr(buffer, "start", lambda: None)  # Flushed by the test, not a thread
+    monkeypatch.setattr(buffer_module, "attendance_buffer", buffer)
+    monkeypatch.setattr(database, "SessionLocal", Session)
+    monkeypatch.setattr(settings, "ATTENDANCE_WRITE_BEHIND", True)
+    monkeypatch.setattr(settings, "ATTENDANCE_FLUSH_MAX_RETRIES", 3)
+    yield buffer, db
+    db.close()
+    engine.dispose()
+
+
+def test_sightings_are_coalesced(setup):
+    buffer, db = setup
+    for minutes in (0, 2, 6, 12):  # The 2-minute one is inside the 5-minute duplicate window
+        buffer.record(db, 1, None, 2, MORNING_CHECK_IN + timedelta(minutes=minutes), 0.8, None)
+
+    assert buffer.flush() == 1
+    row = db.query(Attendance).one()
+    assert (row.detection_count, row.session_date) == (3, date(2026, 10, 20))
+
+    # Later sightings add to the written row
+    buffer.record(db, 1, None, 2, MORNING_CHECK_IN + timedelta(minutes=20), 0.8, None)
+    buffer.flush()
+    db.expire_all()
+    assert db.query(Attendance).one().detection_count == 4
+
+
+def test_duplicate_check_across_midnight(setup, monkeypatch):
+    buffer, db = setup
+    monday_evening = datetime(2026, 10, 19, 23, 45, tzinfo=TASHKENT)
+    buffer.record(db, 1, None, 1, monday_evening, 0.8, None)  # Tuesday's 00:10 lesson
+
+    for now in (monday_evening + timedelta(minutes=5), datetime(2026, 10, 20, 0, 5, tzinfo=TASHKENT)):
+        monkeypatch.setattr(attendance_module, "get_current_time", lambda now=now: now)
+        assert AttendanceService.check_duplicate_today(db, 1)
+    assert not AttendanceService.check_duplicate_today(db, 2)
+
+
+def test_failing_record_is_dropped(setup, monkeypatch):
+    buffer, db = setup
+    write = buffer._write
+
+    def reject_second_user(session, rows):
+        if any(row["user_id"] == 2 for row in rows):
+            raise IntegrityError("INSERT INTO attendance", {}, Exception("constraint failed"))
+        return write(session, rows)
+
+    monkeypatch.setattr(buffer, "_write", reject_second_user)
+    buffer.record(db, 1, None, 2, MORNING_CHECK_IN, 0.8, None)
+    buffer.record(db, 2, None, 2, MORNING_CHECK_IN, 0.8, None)
+
+    # The good record is written on the first attempt, the bad one is retried then dropped
+    assert buffer.flush() == 1
+    assert buffer.flush() == 0 and buffer.stats()["pending"] == 1
+    buffer.flush()
+    assert buffer.stats()["pending"] == 0 and buffer.stats()["dead_lettered"] == 1
+    assert [row.user_id for row in db.query(Attendance).all()] == [1]
+
+
+def test_connection_errors_are_retried_without_limit(setup, monkeypatch):
+    buffer, db = setup
+    write = buffer._write
+    outage = {"flushes": 5}
+
+    def unreachable(session, rows):
+        if outage["flushes"]:
+            raise OperationalError("INSERT INTO attendance", {}, Exception("database is locked"))
+        return write(session, rows)
+
+    monkeypatch.setattr(buffer, "_write", unreachable)
+    buffer.record(db, 1, None, 2, MORNING_CHECK_IN, 0.8, None)
+    while outage["flushes"]:
+        assert buffer.flush() == 0
+        outage["flushes"] -= 1
+
+    assert buffer.stats()["dead_lettered"] == 0
+    assert buffer.flush() == 1
+    assert db.query(Attendance).count() == 1
@@ -0,0 +1,151 @@
+"""
+Attendance upsert: one row per lesson occurrence, even for concurrent
+check-ins, with repeated sightings counted only after the duplicate window;
+the migration dates existing rows by lesson occurrence, and without the
+unique session key check-ins fall back to the legacy insert
+"""
+import threading
+from datetime import date, datetime, time, timedelta, timezone
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+from database import Base
+import models  # noqa: F401 - registers every table
+from models.attendance import Attendance
+from models.schedule import Schedule
+from models.user import User
+import services.attendance_service as attendance_module
+from services.attendance_policy import attendance_policies
+from services.attendance_service import AttendanceService, supports_upsert
+from services.timetable import timetable_cache
+from utils.migrations import has_unique_key, migrate_attendance_table
+
+TASHKENT = timezone(timedelta(hours=5))
+# Tuesday 2026-10-20 is weekday 1
+MORNING_CHECK_IN = datetime(2026, 10, 20, 8, 55, tzinfo=TASHKENT)
+
+LEGACY_ATTENDANCE = """
+CREATE TABLE attendance (
+    id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL, device_id INTEGER, schedule_id INTEGER,
+    check_in_time DATETIME, confidence FLOAT, image_path VARCHAR(500), status VARCHAR(20),
+    detection_count INTEGER, last_seen_time DATETIME{extra}
+)
+"""
+
+
+def make_engine(tmp_path, legacy_columns: str = None):
+    engine = create_engine(f"sqlite:///{tmp_path}/attendance.db", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(engine)
+    if legacy_columns is not None:
+        with engine.begin() as conn:
+            conn.execute(text("DROP TABLE attendance"))
+            conn.execute(text(LEGACY_ATTENDANCE.format(extra=legacy_columns)))
+
+    Session = sessionmaker(bind=engine)
+    db = Session()
+    db.add(User(id=1, full_name="Student", employee_id="S001"))
+    db.add_all([
+        Schedule(id=1, name="Night", day_of_week=1, start_time=time(0, 10), end_time=time(1, 0), is_active=True),
+        Schedule(id=2, name="Morning", day_of_week=1, start_time=time(9, 0), end_time=time(10, 20),
+                 duplicate_check_minutes=5, late_threshold_minutes=10, is_active=True)
+    ])
+    db.commit()
+    db.close()
+    return engine, Session
+
+
+@pytest.fixture(autouse=True)
+def fresh_caches():
+    timetable_cache.invalidate()
+    attendance_policies.invalidate()
+    yield
+    timetable_cache.invalidate()
+    attendance_policies.invalidate()
+
+
+def upsert(Session, check_in: datetime, confidence: float = 0.8, image_path: str = None) -> Attendance:
+    db = Session()
+    try:
+        return AttendanceService.upsert_attendance(db, 1, None, 2, check_in, confidence, image_path)
+    finally:
+        db.close()
+
+
+def test_repeat_sightings_respect_the_duplicate_window(tmp_path):
+    engine, Session = make_engine(tmp_path)
+
+    first = upsert(Session, MORNING_CHECK_IN, 0.7, "a.jpg")
+    assert first.detection_count == 1 and first.status == "present"
+    assert first.session_date == date(2026, 10, 20)
+
+    # Within duplicate_check_minutes: left as it is
+    again = upsert(Session, MORNING_CHECK_IN + timedelta(minutes=2), 0.9, "b.jpg")
+    assert (again.id, again.detection_count, again.image_path) == (first.id, 1, "a.jpg")
+
+    later = upsert(Session, MORNING_CHECK_IN + timedelta(minutes=6), 0.9, "c.jpg")
+    assert (later.id, later.detection_count, later.confidence, later.image_path) == (first.id, 2, 0.9, "c.jpg")
+    assert later.last_seen_time.replace(tzinfo=TASHKENT) == MORNING_CHECK_IN + timedelta(minutes=6)
+
+    # Lower confidence and no image keep the best confidence and the last image
+    last = upsert(Session, MORNING_CHECK_IN + timedelta(minutes=12), 0.5, None)
+    assert (last.detection_count, last.confidence, last.image_path) == (3, 0.9, "c.jpg")
+    engine.dispose()
+
+
+def test_concurrent_check_ins_share_one_row(tmp_path):
+    engine, Session = make_engine(tmp_path)
+    barrier = threading.Barrier(4)
+    ids = []
+
+    def check_in():
+        barrier.wait()
+        ids.append(upsert(Session, MORNING_CHECK_IN).id)
+
+    threads = [threading.Thread(target=check_in) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    db = Session()
+    rows = db.query(Attendance).all()
+    db.close()
+    assert len(rows) == 1 and rows[0].detection_count == 1
+    assert ids == [rows[0].id] * 4
+    engine.dispose()
+
+
+def test_migration_dates_rows_by_lesson_occurrence(tmp_path):
+    engine, Session = make_engine(tmp_path, legacy_columns="")
+    with engine.begin() as conn:
+        conn.execute(text(
+            "INSERT INTO attendance (id, user_id, schedule_id, check_in_time) VALUES "
+            "(1, 1, 1, '2026-10-19 23:45:00.000000'), "  # Monday evening, Tuesday's night lesson
+            "(2, 1, 1, '2026-10-20 00:05:00.000000'), "  # Same occurrence after midnight
+            "(3, 1, 2, '2026-10-20 08:50:00.000000'), "
+            "(4, 1, NULL, '2026-10-20 12:00:00.000000')"
+        ))
+
+    migrate_attendance_table(engine)
+
+    with engine.connect() as conn:
+        dates = dict(conn.execute(text("SELECT id, session_date FROM attendance ORDER BY id")).all())
+    # The later duplicate of the first occurrence is left without a session key
+    assert dates == {1: "2026-10-20", 2: None, 3: "2026-10-20", 4: None}
+    assert has_unique_key(engine, "attendance", ["user_id", "schedule_id", "session_date"])
+    engine.dispose()
+
+
+def test_without_session_key_the_legacy_insert_is_used(tmp_path, monkeypatch):
+    engine, Session = make_engine(tmp_path, legacy_columns=", session_date DATE")
+    monkeypatch.setattr(attendance_module, "get_current_time", lambda: MORNING_CHECK_IN)
+
+    db = Session()
+    assert not supports_upsert(db)
+    first = AttendanceService.create_attendance(db, 1, None, 0.8)
+    again = AttendanceService.create_attendance(db, 1, None, 0.8)
+    assert again.id == first.id
+    assert first.session_date == date(2026, 10, 20)
+    assert db.query(Attendance).count() == 1
+    db.close()
+    engine.dispose()
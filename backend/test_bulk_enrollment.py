@@ -0,0 +1,146 @@
+"""
+Bulk enrolment: every image of an archive gets one event, good images are
+inserted in batches and the summary lists the failures
+
+Detection and embedding are replaced by a stub keyed on the file name, so no
+model files are needed.
+"""
+import asyncio
+import io
+import zipfile
+import numpy as np
+import pytest
+from fastapi import HTTPException, UploadFile
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from database import Base
+import models  # noqa: F401 - registers every table
+from models.face import Face
+from models.user import User
+from utils.image_io import spool_upload
+import services.enrollment_service as enrollment_module
+from services.enrollment_service import (
+    EnrollmentService, count_zip_images, iter_zip,
+    STATUS_MULTI_FACE, STATUS_NO_FACE, STATUS_OK, STATUS_UNKNOWN_USER
+)
+
+
+class StubPool:
+    size = 2
+
+    async def run(self, fn, *args, **kwargs):
+        return fn(*args, **kwargs)
+
+
+class StubRecognition:
+    pool = StubPool()
+    embedding_codec = "float32"
+
+    @staticmethod
+    def embedding_to_bytes(embedding: np.ndarray) -> bytes:
+        return embedding.astype(np.float32).tobytes()
+
+
+class StubIndex:
+    def __init__(self):
+        self.added = []
+
+    def add_many(self, face_ids, user_ids, embeddings):
+        self.added.extend(zip(face_ids, user_ids))
+
+
+class StubCrops:
+    def add_faces(self, user_id, face_ids, crops):
+        pass
+
+
+def process_image(contents: bytes, employee_id: str, name: str, app=None) -> dict:
+    """Outcome chosen by the file name: no_face*, group*, anything else is one face"""
+    if "no_face" in name:
+        return {"status": STATUS_NO_FACE, "faces": 0}
+    if "group" in name:
+        return {"status": STATUS_MULTI_FACE, "faces": 3}
+    return {
+        "status": STATUS_OK, "faces": 1, "embedding": np.ones(512, np.float32),
+        "crop": None, "image_path": f"faces/{employee_id}_{name.replace('/', '_')}"
+    }
+
+
+@pytest.fixture
+def db(monkeypatch):
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    session.add_all([
+        User(full_name="Active", employee_id="S001"),
+        User(full_name="Inactive", employee_id="S002", is_active=False)
+    ])
+    session.commit()
+
+    monkeypatch.setattr(enrollment_module, "face_recognition_service", StubRecognition())
+    monkeypatch.setattr(enrollment_module, "face_embedding_index", StubIndex())
+    monkeypatch.setattr(enrollment_module, "crop_store", StubCrops())
+    monkeypatch.setattr(EnrollmentService, "process_image", staticmethod(process_image))
+    yield session
+    session.close()
+    engine.dispose()
+
+
+def archive(names: list) -> io.BytesIO:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as zf:
+        for name in names:
+            zf.writestr(name, b"\xff\xd8\xff image")
+    buffer.seek(0)
+    return buffer
+
+
+def enroll(db, source, batch_size: int) -> list:
+    async def run():
+        return [event async for event in EnrollmentService().enroll(
+            db, iter_zip(source), total=count_zip_images(source), batch_size=batch_size
+        )]
+
+    return asyncio.run(run())
+
+
+def test_archive_layout():
+    source = archive(["S001/a.jpg", "S002.png", "S001/notes.txt", "__MACOSX/S001/._a.jpg", ".hidden/x.jpg"])
+    assert count_zip_images(source) == 2
+    source.seek(0)
+    assert [(employee_id, name) for employee_id, name, _ in iter_zip(source)] == [("S001", "S001/a.jpg"), ("S002", "S002.png")]
+
+
+def test_enroll_reports_every_image(db):
+    names = ["S001/1.jpg", "S001/2.jpg", "S001/no_face.jpg", "S001/group.jpg", "S002/1.jpg", "S999/1.jpg"]
+    source = archive(names)
+    events = enroll(db, source, batch_size=2)
+
+    images = [event for event in events if event["type"] == "image"]
+    summary = events[-1]
+    assert sorted(event["file"] for event in images) == sorted(names)
+    assert images[-1]["processed"] == len(names) and images[-1]["total"] == len(names)
+    assert summary["type"] == "summary" and summary["total"] == len(names)
+    assert summary["counts"] == {STATUS_OK: 3, STATUS_NO_FACE: 1, STATUS_MULTI_FACE: 1, STATUS_UNKNOWN_USER: 1}
+    assert sorted(f["file"] for f in summary["failures"]) == ["S001/group.jpg", "S001/no_face.jpg", "S999/1.jpg"]
+
+    # Faces are inserted, but only active users go into the search index
+    faces = db.query(Face).all()
+    assert len(faces) == 3
+    assert {event["face_id"] for event in images if event["status"] == STATUS_OK} == {face.id for face in faces}
+    added_users = {user_id for _, user_id in enrollment_module.face_embedding_index.added}
+    assert added_users == {db.query(User).filter(User.employee_id == "S001").one().id}
+
+
+def test_spool_upload_cap():
+    async def spool(data: bytes, max_size: int) -> bytes:
+        target = io.BytesIO()
+        await spool_upload(UploadFile(io.BytesIO(data)), target, max_size)
+        return target.getvalue()
+
+    data = bytes(range(256)) * 8192  # 2 MB, more than one chunk
+    assert asyncio.run(spool(data, len(data))) == data
+    with pytest.raises(HTTPException) as raised:
+        asyncio.run(spool(data, len(data) - 1))
+    assert raised.value.status_code == 413
@@ -0,0 +1,126 @@
+"""
+Recall test for the ANN face index backends
+
+Compares the top-1 match of each ANN backend against the exact matrix scan
+on synthetic clustered embeddings (several images per identity).
+"""
+import numpy as np
+import pytest
+from config import settings
+from services.face_index import FaceEmbeddingIndex, normalize_rows
+
+MIN_RECALL = 0.95
+
+
+def make_dataset(identities: int = 4000, faces_per_identity: int = 5, queries: int = 500, seed: int = 0):
+    """Enrolled embeddings scattered around one random direction per identity"""
+    rng = np.random.default_rng(seed)
+    centers = normalize_rows(rng.normal(size=(identities, 512)))
+
+    owners = np.repeat(np.arange(identities), faces_per_identity)
+    enrolled = normalize_rows(centers[owners] + 0.04 * rng.normal(size=(len(owners), 512)))
+
+    query_owners = rng.choice(identities, queries, replace=False)
+    query_vectors = normalize_rows(centers[query_owners] + 0.04 * rng.normal(size=(queries, 512)))
+    return enrolled, owners, query_vectors
+
+
+def build_index(monkeypatch, backend_name: str, enrolled: np.ndarray, owners: np.ndarray,
+                template_k: int = 0) -> FaceEmbeddingIndex:
+    monkeypatch.setattr(settings, "FACE_INDEX_BACKEND", backend_name)
+    monkeypatch.setattr(settings, "FACE_INDEX_MIN_SIZE", 0)
+    monkeypatch.setattr(settings, "FACE_TEMPLATE_K", template_k)
+
+    index = FaceEmbeddingIndex()
+    face_ids = np.arange(1, len(enrolled) + 1, dtype=np.int64)
+    index._swap(enrolled, face_ids, owners.astype(np.int64))
+    index._build_backend()
+    index._build_templates()
+    index.loaded = True
+    return index
+
+
+def measure_recall(monkeypatch, backend_name: str) -> float:
+    enrolled, owners, queries = make_dataset()
+
+    exact = build_index(monkeypatch, "exact", enrolled, owners)
+    approximate = build_index(monkeypatch, backend_name, enrolled, owners)
+    assert approximate.backend is not None
+
+    hits = 0
+    for query in queries:
+        hits += exact.search(query)[0] == approximate.search(query)[0]
+    return hits / len(queries)
+
+
+def test_ivf_recall(monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, "INDEX_DIR", str(tmp_path))
+    recall = measure_recall(monkeypatch, "ivf")
+    print(f"IVF recall@1: {recall:.3f}")
+    assert recall >= MIN_RECALL
+
+
+def test_ivf_returns_top_k(monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, "INDEX_DIR", str(tmp_path))
+    enrolled, owners, queries = make_dataset(identities=500, queries=20)
+    index = build_index(monkeypatch, "ivf", enrolled, owners)
+
+    for query in queries:
+        candidates = index.backend.search(query, 8)
+        assert len(candidates) == 8
+        scores = enrolled[candidates - 1] @ query
+        assert np.all(np.diff(scores) <= 1e-3)  # Best first
+
+
+def test_ivf_retrains_after_growth(monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, "INDEX_DIR", str(tmp_path))
+    monkeypatch.setattr(settings, "FACE_INDEX_SNAPSHOT", False)
+    enrolled, owners, _ = make_dataset(identities=200, faces_per_identity=5, queries=20)
+    initial = len(enrolled) // 4
+    index = build_index(monkeypatch, "ivf", enrolled[:initial], owners[:initial])
+    assert index.backend.trained_size == initial
+
+    index.add_many(np.arange(initial + 1, len(enrolled) + 1), owners[initial:], enrolled[initial:])
+    assert index.backend.trained_size > initial * settings.FACE_INDEX_IVF_RETRAIN_GROWTH
+
+
+def test_hnsw_recall(monkeypatch, tmp_path):
+    pytest.importorskip("hnswlib")
+    monkeypatch.setattr(settings, "INDEX_DIR", str(tmp_path))
+    recall = measure_recall(monkeypatch, "hnsw")
+    print(f"HNSW recall@1: {recall:.3f}")
+    assert recall >= MIN_RECALL
+
+
+def test_template_recall(monkeypatch):
+    """Centroid pass + exemplar re-check must find the same user as the full scan"""
+    enrolled, owners, queries = make_dataset()
+
+    exact = build_index(monkeypatch, "exact", enrolled, owners)
+    templates = build_index(monkeypatch, "exact", enrolled, owners, template_k=3)
+
+    hits = 0
+    for query in queries:
+        hits += exact.search(query)[1] == templates.search(query)[1]
+    recall = hits / len(queries)
+    print(f"Template user recall@1: {recall:.3f}")
+    assert recall >= MIN_RECALL
+
+
+def test_template_fallback_stays_within_top_users(monkeypatch):
+    """Below the threshold on the exemplars, all faces of the best users are scored"""
+    monkeypatch.setattr(settings, "FACE_MATCH_THRESHOLD", 0.4)
+    enrolled, owners, _ = make_dataset(identities=200, queries=1)
+
+    # User 0 gets a second, distant look whose face is not an exemplar (k=1)
+    rng = np.random.default_rng(1)
+    other_look = normalize_rows(rng.normal(size=(1, 512)))
+    enrolled = np.vstack([enrolled, normalize_rows(0.3 * enrolled[:1] + other_look)])
+    owners = np.append(owners, 0)
+    index = build_index(monkeypatch, "exact", enrolled, owners, template_k=1)
+
+    face_id, user_id, similarity = index.search(enrolled[-1])
+    assert (face_id, user_id) == (len(enrolled), 0) and similarity > 0.99
+
+    # An unknown face stays below the threshold without a full scan
+    assert index.search(normalize_rows(rng.normal(size=(1, 512)))[0])[2] < settings.FACE_MATCH_THRESHOLD
@@ -0,0 +1,98 @@
+"""
+Face snapshot: templates round-trip and the content version catches changes
+that keep the row count and newest face id
+"""
+import numpy as np
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from config import settings
+from database import Base
+import models  # noqa: F401 - registers every table
+from models.face import Face
+from models.user import User
+from services.face_index import FaceEmbeddingIndex, normalize_rows
+from services.face_snapshot import open_snapshot, write_snapshot
+from services.face_templates import UserTemplates
+
+
+@pytest.fixture
+def snapshot_settings(monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, "INDEX_DIR", str(tmp_path))
+    monkeypatch.setattr(settings, "FACE_INDEX_BACKEND", "exact")
+    monkeypatch.setattr(settings, "FACE_TEMPLATE_K", 2)
+    monkeypatch.setattr(settings, "EMBEDDING_CODEC", "float32")
+    monkeypatch.setattr(settings, "EMBEDDING_MEMORY_CODEC", None)
+
+
+@pytest.fixture
+def db(snapshot_settings):
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    rng = np.random.default_rng(0)
+    users = [User(full_name=f"Student {i}", employee_id=f"S{i:03d}") for i in range(3)]
+    session.add_all(users)
+    session.flush()
+    for i in range(9):
+        session.add(Face(
+            user_id=users[i % 3].id,
+            embedding=rng.normal(size=512).astype(np.float32).tobytes(),
+            embedding_codec="float32",
+            model_name=settings.INSIGHTFACE_MODEL
+        ))
+    session.commit()
+    yield session
+    session.close()
+    engine.dispose()
+
+
+def test_templates_round_trip(snapshot_settings):
+    rng = np.random.default_rng(1)
+    matrix = normalize_rows(rng.normal(size=(40, 512))).astype(np.float32)
+    face_ids = np.arange(1, 41, dtype=np.int64)
+    user_ids = np.repeat(np.arange(10, dtype=np.int64), 4)
+    templates = UserTemplates(k=2)
+    templates.build(matrix, face_ids, user_ids)
+
+    write_snapshot(matrix, face_ids, user_ids, content_version=123, templates=templates)
+    mapped_matrix, mapped_face_ids, mapped_user_ids, header, stored = open_snapshot()
+
+    assert header["content_version"] == 123 and header["template_k"] == 2
+    assert np.array_equal(mapped_matrix, matrix) and np.array_equal(mapped_face_ids, face_ids)
+    mapped = UserTemplates.from_arrays(header["template_k"], *stored)
+    query = matrix[5]
+    assert np.array_equal(mapped.candidates(query, 3)[0], templates.candidates(query, 3)[0])
+    assert np.array_equal(mapped.candidates(query, 3)[1], templates.candidates(query, 3)[1])
+
+
+def test_snapshot_rejected_after_reassignment(db):
+    index = FaceEmbeddingIndex()
+    index.build(db)
+    version = index._content_version(db)
+    write_snapshot(*index._data, content_version=version, templates=index.templates)
+
+    assert FaceEmbeddingIndex()._load_snapshot(db)
+
+    # Same row count and newest id, different owner
+    face = db.query(Face).order_by(Face.id).first()
+    face.user_id = db.query(User).order_by(User.id.desc()).first().id
+    db.commit()
+    assert index._content_version(db) != version
+    assert not FaceEmbeddingIndex()._load_snapshot(db)
+
+
+def test_mapped_templates_are_not_rebuilt(db, monkeypatch):
+    index = FaceEmbeddingIndex()
+    index.build(db)
+    write_snapshot(*index._data, content_version=index._content_version(db), templates=index.templates)
+
+    def rebuild(*args):
+        raise AssertionError("templates recomputed")
+
+    monkeypatch.setattr(UserTemplates, "build", rebuild)
+    mapped = FaceEmbeddingIndex()
+    assert mapped._load_snapshot(db)
+    assert len(mapped.templates) == 3
+    assert mapped.search(index._data[0][4])[0] == index._data[1][4]
@@ -0,0 +1,70 @@
+"""
+Frame cache: only faceless frames are cached, so a near-duplicate hash never
+stands for another student's match
+
+Two different (synthetic) faces in front of the same fixed-camera background
+are within a couple of dHash bits of each other.
+"""
+import cv2
+import numpy as np
+import pytest
+from config import settings
+from services.frame_cache import FrameCache, difference_hash
+
+DEVICE_ID = 1
+
+
+def camera_frame(face: int) -> bytes:
+    """JPEG of the same scene with one of two different faces in the middle"""
+    image = np.zeros((480, 640, 3), np.uint8)
+    for x in range(640):
+        image[:, x] = (40 + x * 0.3, 90, 160 - x * 0.1)
+    cv2.rectangle(image, (50, 300), (250, 470), (30, 60, 120), -1)  # Desk
+    cv2.rectangle(image, (420, 80), (600, 260), (200, 200, 190), -1)  # Board
+
+    cx, cy = 320, 200
+    if face == 1:
+        cv2.ellipse(image, (cx, cy), (28, 36), 0, 0, 360, (150, 180, 220), -1)
+        cv2.circle(image, (cx - 10, cy - 8), 4, (20, 20, 20), -1)
+        cv2.circle(image, (cx + 10, cy - 8), 4, (20, 20, 20), -1)
+    else:
+        cv2.ellipse(image, (cx, cy), (30, 38), 0, 0, 360, (90, 110, 150), -1)
+        cv2.rectangle(image, (cx - 18, cy - 14), (cx + 18, cy - 6), (10, 10, 10), -1)
+    return cv2.imencode(".jpg", image)[1].tobytes()
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    monkeypatch.setattr(settings, "FRAME_CACHE_TTL_SECONDS", 5.0)
+    monkeypatch.setattr(settings, "FRAME_CACHE_MAX_DISTANCE", 2)
+    return FrameCache()
+
+
+def test_off_by_default():
+    assert type(settings).model_fields["FRAME_CACHE_TTL_SECONDS"].default == 0
+
+
+def test_different_faces_hash_alike(cache):
+    # Why a frame with a face is never answered from the cache
+    first, second = difference_hash(camera_frame(1)), difference_hash(camera_frame(2))
+    assert bin(first ^ second).count("1") <= settings.FRAME_CACHE_MAX_DISTANCE
+
+
+def test_faceless_frame_is_reused(cache):
+    frame_hash = difference_hash(camera_frame(1))
+    cache.store(DEVICE_ID, frame_hash, False)
+
+    assert cache.lookup(DEVICE_ID, difference_hash(camera_frame(2)), False) is not None
+    # Not for another device or for pre-cropped uploads
+    assert cache.lookup(DEVICE_ID + 1, frame_hash, False) is None
+    assert cache.lookup(DEVICE_ID, frame_hash, True) is None
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 2
+
+
+def test_entries_expire(cache, monkeypatch):
+    frame_hash = difference_hash(camera_frame(1))
+    cache.store(DEVICE_ID, frame_hash, False)
+
+    monkeypatch.setattr(settings, "FRAME_CACHE_TTL_SECONDS", 1e-9)
+    assert cache.lookup(DEVICE_ID, frame_hash, False) is None
+    assert cache.stats()["expired"] == 1
@@ -0,0 +1,120 @@
+"""
+Idempotent upload replay: a retried upload gets the stored response without
+running recognition again
+"""
+import asyncio
+import pytest
+from fastapi import HTTPException
+from config import settings
+from services.idempotency import IdempotencyStore
+
+DEVICE_ID = 1
+
+
+@pytest.fixture
+def store(monkeypatch):
+    monkeypatch.setattr(settings, "IDEMPOTENCY_BACKEND", "memory")
+    monkeypatch.setattr(settings, "IDEMPOTENCY_TTL_SECONDS", 120)
+    return IdempotencyStore()
+
+
+class Handler:
+    """Recognition stand-in that counts how often it ran"""
+
+    def __init__(self, result=None, error: Exception = None, delay: float = 0.0):
+        self.calls = 0
+        self.result = result or {"success": True, "recognized": True}
+        self.error = error
+        self.delay = delay
+
+    async def __call__(self) -> dict:
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+def test_retry_is_replayed(store):
+    handler = Handler()
+
+    async def scenario():
+        key = await store.key_for(DEVICE_ID, None, b"jpeg bytes")
+        first = await store.run_once(key, DEVICE_ID, handler)
+        retry = await store.run_once(await store.key_for(DEVICE_ID, None, b"jpeg bytes"), DEVICE_ID, handler)
+        return first, retry
+
+    first, retry = asyncio.run(scenario())
+    assert first == (handler.result, False)
+    assert retry == (handler.result, True)
+    assert handler.calls == 1
+
+
+def test_concurrent_retry_joins_the_first_request(store):
+    handler = Handler(delay=0.05)
+
+    async def scenario():
+        key = await store.key_for(DEVICE_ID, "3f2a9c01", b"")
+        return await asyncio.gather(
+            store.run_once(key, DEVICE_ID, handler),
+            store.run_once(key, DEVICE_ID, handler)
+        )
+
+    results = asyncio.run(scenario())
+    assert sorted(replayed for _, replayed in results) == [False, True]
+    assert handler.calls == 1 and store.joined == 1
+
+
+def test_request_id_key_ignores_the_body(store):
+    async def keys():
+        return (
+            await store.key_for(DEVICE_ID, "3f2a9c01", b"first"),
+            await store.key_for(DEVICE_ID, "3f2a9c01", b"second"),
+            await store.key_for(DEVICE_ID + 1, "3f2a9c01", b"first"),
+            await store.key_for(DEVICE_ID, None, b"first")
+        )
+
+    same, resent, other_device, by_content = asyncio.run(keys())
+    assert same == resent
+    assert len({same, other_device, by_content}) == 3
+
+
+def test_no_key_when_disabled(store, monkeypatch):
+    monkeypatch.setattr(settings, "IDEMPOTENCY_BACKEND", "off")
+    handler = Handler()
+
+    async def scenario():
+        key = await store.key_for(DEVICE_ID, None, b"jpeg bytes")
+        assert key is None
+        await store.run_once(key, DEVICE_ID, handler)
+        await store.run_once(key, DEVICE_ID, handler)
+
+    asyncio.run(scenario())
+    assert handler.calls == 2
+
+
+def test_client_error_is_replayed(store):
+    handler = Handler(error=HTTPException(status_code=400, detail="Invalid image file"))
+
+    async def scenario():
+        key = await store.key_for(DEVICE_ID, "bad", b"")
+        for _ in range(2):
+            with pytest.raises(HTTPException) as raised:
+                await store.run_once(key, DEVICE_ID, handler)
+            assert raised.value.status_code == 400 and raised.value.detail == "Invalid image file"
+
+    asyncio.run(scenario())
+    assert handler.calls == 1 and store.replayed == 1
+
+
+def test_server_error_is_retried(store):
+    handler = Handler(error=HTTPException(status_code=503, detail="Server is busy, please retry"))
+
+    async def scenario():
+        key = await store.key_for(DEVICE_ID, "busy", b"")
+        for _ in range(2):
+            with pytest.raises(HTTPException):
+                await store.run_once(key, DEVICE_ID, handler)
+
+    asyncio.run(scenario())
+    assert handler.calls == 2 and store.replayed == 0
@@ -0,0 +1,55 @@
+"""
+Upload reading and decoding: uploads over the cap are cut off, large JPEGs
+are decoded at reduced resolution but never below FACE_DECODE_MIN_SIDE
+"""
+import asyncio
+import io
+import cv2
+import numpy as np
+import pytest
+from fastapi import HTTPException, UploadFile
+from utils.image_io import decode_image, jpeg_size, read_upload, reduction_factor
+
+
+def jpeg(width: int, height: int, progressive: bool = False) -> bytes:
+    image = np.zeros((height, width, 3), np.uint8)
+    cv2.circle(image, (width // 2, height // 2), min(width, height) // 4, (200, 160, 120), -1)
+    params = [cv2.IMWRITE_JPEG_PROGRESSIVE, 1] if progressive else []
+    return cv2.imencode(".jpg", image, params)[1].tobytes()
+
+
+def read(data: bytes, max_size: int) -> bytes:
+    return asyncio.run(read_upload(UploadFile(io.BytesIO(data)), max_size))
+
+
+def test_read_upload_cap():
+    data = b"x" * 200_000
+    assert read(data, len(data)) == data
+    with pytest.raises(HTTPException) as raised:
+        read(data, len(data) - 1)
+    assert raised.value.status_code == 413
+
+
+def test_jpeg_size_from_header():
+    assert jpeg_size(jpeg(1600, 1200)) == (1600, 1200)
+    assert jpeg_size(jpeg(800, 600, progressive=True)) == (800, 600)
+    assert jpeg_size(cv2.imencode(".png", np.zeros((10, 10, 3), np.uint8))[1].tobytes()) is None
+    assert jpeg_size(b"\xff\xd8\xff") is None
+
+
+def test_reduction_keeps_the_minimum_side():
+    assert reduction_factor(2592, 1944, 640) == 4
+    assert reduction_factor(1600, 1200, 640) == 2
+    assert reduction_factor(640, 480, 640) == 1
+    assert reduction_factor(5000, 5000, 0) == 1
+
+
+def test_decode_at_reduced_resolution():
+    image = decode_image(jpeg(2592, 1944), min_side=640)
+    assert image.shape == (486, 648, 3)
+
+    # Small frames and non-JPEG images are decoded at full size
+    assert decode_image(jpeg(400, 400), min_side=640).shape == (400, 400, 3)
+    png = cv2.imencode(".png", np.zeros((1200, 1600, 3), np.uint8))[1].tobytes()
+    assert decode_image(png, min_side=640).shape == (1200, 1600, 3)
+    assert decode_image(b"not an image") is None
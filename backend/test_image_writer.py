@@ -0,0 +1,76 @@
+"""
+Background image writer: a full queue drops images before any path is
+recorded, and a deleted face's queued write never reaches the disk
+"""
+import os
+import threading
+import time
+import pytest
+from config import settings
+from services.image_writer import ImageWriter
+
+
+@pytest.fixture
+def writer(monkeypatch):
+    """Writer whose thread blocks in its first batch until gate is set"""
+    monkeypatch.setattr(settings, "IMAGE_WRITER_QUEUE_SIZE", 2)
+    monkeypatch.setattr(settings, "IMAGE_WRITER_BATCH_SIZE", 1)
+    monkeypatch.setattr(settings, "IMAGE_WRITER_FSYNC", False)
+
+    writer = ImageWriter()
+    writer.gate = threading.Event()
+    write_batch = writer._write_batch
+
+    def gated(batch):
+        writer.gate.wait(5)
+        write_batch(batch)
+
+    writer._write_batch = gated
+    yield writer
+    writer.gate.set()
+    writer.stop()
+
+
+def block(writer: ImageWriter, path: str):
+    """Submit one image and wait until the thread holds it at the gate"""
+    assert writer.submit(path, b"first")
+    deadline = time.monotonic() + 5
+    while writer._queue.qsize() and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def test_full_queue_drops_before_reserving(writer, tmp_path):
+    block(writer, str(tmp_path / "busy.jpg"))
+
+    assert writer.reserve()
+    assert writer.submit(str(tmp_path / "a.jpg"), b"a")
+    # One slot queued, one reserved: nothing else fits
+    assert not writer.reserve()
+    assert not writer.submit(str(tmp_path / "b.jpg"), b"b")
+    assert writer.stats()["dropped"] == 2
+
+    # The reserved write always fits, a released slot is free again
+    assert writer.submit(str(tmp_path / "c.jpg"), b"c", reserved=True)
+    writer.gate.set()
+    writer.flush()
+    assert writer.reserve()
+    writer.release()
+    assert writer.stats()["reserved"] == 0
+
+    assert sorted(os.listdir(tmp_path)) == ["a.jpg", "busy.jpg", "c.jpg"]
+
+
+def test_cancel_pending_write(writer, tmp_path):
+    block(writer, str(tmp_path / "busy.jpg"))
+    deleted = str(tmp_path / "deleted.jpg")
+    assert writer.submit(deleted, b"face")
+    assert writer.cancel(deleted)
+
+    writer.gate.set()
+    writer.flush()
+    assert not os.path.exists(deleted)
+    assert writer.stats()["cancelled"] == 1
+
+    # Once written, there is nothing left to cancel (the caller removes the file)
+    assert not writer.cancel(str(tmp_path / "busy.jpg"))
+    assert os.path.exists(tmp_path / "busy.jpg")
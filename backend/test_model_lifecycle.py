@@ -0,0 +1,84 @@
+"""
+Preload before the first lesson follows local (Tashkent) time, not the
+server clock
+"""
+import asyncio
+from datetime import datetime, time, timedelta, timezone
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from config import settings
+from database import Base
+import models  # noqa: F401 - registers every table
+from models.schedule import Schedule
+import services.model_lifecycle as lifecycle_module
+from services.model_lifecycle import ModelLifecycleManager
+
+TASHKENT = timezone(timedelta(hours=5))
+
+
+class StubPool:
+    def __init__(self):
+        self.calls = []
+
+    async def run(self, fn, *args, **kwargs):
+        self.calls.append(fn)
+
+
+class StubService:
+    model_loaded = False
+
+    def __init__(self):
+        self.pool = StubPool()
+
+    def warm_up(self):
+        pass
+
+
+@pytest.fixture
+def service(monkeypatch):
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine)
+
+    db = Session()
+    # Tuesday 2026-10-20 is weekday 1
+    db.add(Schedule(name="Matematika", day_of_week=1, start_time=time(9, 0), end_time=time(10, 20), is_active=True))
+    db.commit()
+    db.close()
+
+    service = StubService()
+    monkeypatch.setattr(lifecycle_module, "SessionLocal", Session)
+    monkeypatch.setattr(lifecycle_module, "face_recognition_service", service)
+    monkeypatch.setattr(settings, "MODEL_PRELOAD_BEFORE_SCHEDULE_MINUTES", 15)
+    yield service
+    engine.dispose()
+
+
+def check_at(monkeypatch, local_now: datetime) -> ModelLifecycleManager:
+    monkeypatch.setattr(lifecycle_module, "get_current_time", lambda: local_now)
+    manager = ModelLifecycleManager()
+    asyncio.run(manager.check())
+    return manager
+
+
+def test_preload_in_the_local_window(service, monkeypatch):
+    # 08:50 in Tashkent is 03:50 on a UTC host clock
+    manager = check_at(monkeypatch, datetime(2026, 10, 20, 8, 50, tzinfo=TASHKENT))
+    assert service.pool.calls == [service.warm_up]
+    assert manager.next_lesson_start == datetime(2026, 10, 20, 9, 0)
+    assert manager._preloaded_for.isoformat() == "2026-10-20"
+
+
+def test_no_preload_outside_the_window(service, monkeypatch):
+    check_at(monkeypatch, datetime(2026, 10, 20, 8, 30, tzinfo=TASHKENT))
+    check_at(monkeypatch, datetime(2026, 10, 20, 9, 5, tzinfo=TASHKENT))
+    assert service.pool.calls == []
+
+
+def test_first_lesson_is_on_the_local_day(service, monkeypatch):
+    # 00:10 on Tuesday in Tashkent is still Monday in UTC: the lesson looked up is Tuesday's
+    manager = check_at(monkeypatch, datetime(2026, 10, 20, 0, 10, tzinfo=TASHKENT))
+    assert service.pool.calls == []
+    assert manager.next_lesson_start == datetime(2026, 10, 20, 9, 0)
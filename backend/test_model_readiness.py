@@ -0,0 +1,61 @@
+"""
+Readiness of the face recognition model across idle unload and reload
+
+The InsightFace session is replaced by a stub, so no model files are needed.
+"""
+import pytest
+from config import settings
+from services.face_recognition_service import FaceRecognitionService
+
+
+class StubApp:
+    pass
+
+
+@pytest.fixture
+def service(monkeypatch):
+    monkeypatch.setattr(settings, "PRELOAD_MODEL", True)
+    service = FaceRecognitionService()
+    monkeypatch.setattr(service, "_create_app", lambda model_name=None: StubApp())
+    yield service
+    service.pool.close()
+
+
+def test_not_ready_before_preload(service):
+    assert service.model_state == "not_loaded"
+    assert not service.is_ready()
+
+
+def test_ready_after_unload_and_reload(service):
+    service.load_model()
+    assert service.model_state == "loaded"
+    assert service.is_ready()
+
+    assert service.unload_model()
+    assert service.model_state == "not_loaded"
+    assert service.is_ready()  # Reloads on the next request
+    assert service.status()["ready"]
+
+    # The next request loads the model again
+    assert isinstance(service._ensure_app(None), StubApp)
+    assert service.model_state == "loaded"
+    assert service.loads == 2 and service.unloads == 1
+    assert service.is_ready()
+
+
+def test_failed_load_is_not_ready(service, monkeypatch):
+    def fail(model_name=None):
+        raise RuntimeError("model files missing")
+
+    monkeypatch.setattr(service, "_create_app", fail)
+    with pytest.raises(RuntimeError):
+        service.load_model()
+    assert service.model_state == "error"
+    assert not service.is_ready()
+
+
+def test_lazy_mode_is_ready_until_a_failure(service, monkeypatch):
+    monkeypatch.setattr(settings, "PRELOAD_MODEL", False)
+    assert service.is_ready()
+    service.model_state = "error"
+    assert not service.is_ready()
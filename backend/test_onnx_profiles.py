@@ -0,0 +1,35 @@
+"""
+ONNX Runtime thread counts for the pooled InsightFace sessions
+"""
+import pytest
+from config import settings
+from services import onnx_profiles
+from services.onnx_profiles import pool_workers, resolve_profile
+
+
+@pytest.fixture
+def eight_cores(monkeypatch):
+    monkeypatch.setattr(onnx_profiles, "_cpu_count", lambda: 8)
+    monkeypatch.setattr(settings, "ONNX_PROFILE", "default")
+    monkeypatch.setattr(settings, "ONNX_INTRA_OP_THREADS", 0)
+
+
+def test_single_session_keeps_insightface_defaults(eight_cores, monkeypatch):
+    monkeypatch.setattr(settings, "INFERENCE_WORKERS", 1)
+    assert pool_workers() == 1
+    assert resolve_profile() is None
+
+
+def test_pooled_sessions_split_the_cores(eight_cores, monkeypatch):
+    monkeypatch.setattr(settings, "INFERENCE_WORKERS", 0)
+    assert pool_workers() == 8
+    assert resolve_profile() == {"intra_op_threads": 1}
+
+    monkeypatch.setattr(settings, "INFERENCE_WORKERS", 2)
+    assert resolve_profile() == {"intra_op_threads": 4}
+
+
+def test_explicit_thread_count_wins(eight_cores, monkeypatch):
+    monkeypatch.setattr(settings, "INFERENCE_WORKERS", 4)
+    monkeypatch.setattr(settings, "ONNX_INTRA_OP_THREADS", 3)
+    assert resolve_profile() == {"intra_op_threads": 3}
@@ -0,0 +1,46 @@
+"""
+Candidate narrowing follows the lesson running in local (Tashkent) time,
+whatever the server clock's timezone
+"""
+from datetime import datetime, time, timedelta, timezone
+import pytest
+from config import settings
+from services import schedule_candidates as candidates_module
+from services.schedule_candidates import ScheduleCandidateCache
+from services.timetable import Timetable, timetable_cache
+from test_timetable import entry
+
+TASHKENT = timezone(timedelta(hours=5))
+
+# Tuesday 2026-10-20 is weekday 1: group 1 at 09:00 local, group 2 at 04:00 (09:00 minus the UTC offset)
+MORNING = entry(1, 1, time(9, 0), time(10, 20), group_id=1)
+EARLY = entry(2, 1, time(4, 0), time(5, 20), group_id=2)
+
+
+@pytest.fixture
+def timetable(monkeypatch):
+    monkeypatch.setattr(settings, "FACE_CANDIDATE_MATCH_ROOM", True)
+    timetable_cache.invalidate()
+    timetable_cache._timetable = Timetable([MORNING, EARLY], [(1, 10), (1, 11), (2, 20)])
+    yield timetable_cache._timetable
+    timetable_cache.invalidate()
+
+
+def test_default_time_is_local(timetable, monkeypatch):
+    local_now = datetime(2026, 10, 20, 9, 10, tzinfo=TASHKENT)
+    monkeypatch.setattr(candidates_module, "get_current_time", lambda: local_now)
+
+    result = ScheduleCandidateCache().candidate_user_ids(None)
+    assert result.tolist() == [10, 11]
+
+
+def test_utc_clock_would_pick_another_lesson(timetable):
+    # The same instant read from a UTC server clock falls in the early lesson
+    utc_now = datetime(2026, 10, 20, 9, 10, tzinfo=TASHKENT).astimezone(timezone.utc).replace(tzinfo=None)
+    result = ScheduleCandidateCache().candidate_user_ids(None, utc_now)
+    assert result.tolist() == [20]
+
+
+def test_no_lesson_means_no_narrowing(timetable, monkeypatch):
+    monkeypatch.setattr(candidates_module, "get_current_time", lambda: datetime(2026, 10, 20, 13, 0, tzinfo=TASHKENT))
+    assert ScheduleCandidateCache().candidate_user_ids(None) is None
@@ -0,0 +1,48 @@
+"""
+Timetable: a lesson starting just after midnight opens the evening before,
+and both sides of midnight belong to the same lesson occurrence
+"""
+from datetime import date, datetime, time
+from services.timetable import Timetable, TimetableEntry
+
+
+def entry(schedule_id: int, day_of_week: int, start: time, end: time, **fields) -> TimetableEntry:
+    values = dict(
+        id=schedule_id, day_of_week=day_of_week, start_time=start, end_time=end, group_id=None, room=None,
+        late_threshold_minutes=None, duplicate_check_minutes=None, effective_from=None, effective_to=None
+    )
+    values.update(fields)
+    return TimetableEntry(**values)
+
+
+# Tuesday 2026-10-20 is weekday 1
+NIGHT = entry(1, 1, time(0, 10), time(1, 0))
+MORNING = entry(2, 1, time(9, 0), time(10, 20))
+
+
+def test_evening_before_a_lesson_after_midnight():
+    timetable = Timetable([NIGHT, MORNING], [])
+
+    monday_evening = datetime(2026, 10, 19, 23, 45)
+    tuesday_night = datetime(2026, 10, 20, 0, 5)
+    assert timetable.resolve(monday_evening).id == NIGHT.id
+    assert timetable.resolve(tuesday_night).id == NIGHT.id
+    assert timetable.session_date(NIGHT.id, monday_evening) == date(2026, 10, 20)
+    assert timetable.session_date(NIGHT.id, tuesday_night) == date(2026, 10, 20)
+
+    # Tuesday evening leads to Wednesday, when there is no such lesson
+    assert timetable.resolve(datetime(2026, 10, 20, 23, 45)) is None
+
+
+def test_effective_dates_use_the_lesson_date():
+    first_lesson = entry(1, 1, time(0, 10), time(1, 0), effective_from=date(2026, 10, 20))
+    timetable = Timetable([first_lesson], [])
+    assert timetable.resolve(datetime(2026, 10, 19, 23, 45)).id == first_lesson.id
+
+
+def test_daytime_lesson_session_is_its_own_date():
+    timetable = Timetable([NIGHT, MORNING], [])
+    check_in = datetime(2026, 10, 20, 8, 40)
+    assert timetable.resolve(check_in).id == MORNING.id
+    assert timetable.session_date(MORNING.id, check_in) == date(2026, 10, 20)
+    assert timetable.session_date(None, check_in) == date(2026, 10, 20)
@@ -0,0 +1,193 @@
+"""
+Regression test for AttendanceService.get_user_attendance_stats
+
+The set-based implementation must return the same numbers as the previous
+day-by-day loop (kept below as legacy_user_attendance_stats) on random
+schedules, group memberships and attendance records.
+"""
+import random
+from datetime import datetime, time, timedelta, timezone
+import pytest
+from sqlalchemy import create_engine, and_, or_
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from database import Base
+import models  # noqa: F401 - registers every table
+from models.attendance import Attendance
+from models.group import Group, user_groups
+from models.schedule import Schedule
+from models.user import User
+import services.attendance_service as attendance_module
+from services.attendance_service import AttendanceService
+
+TZ = timezone(timedelta(hours=5))
+NOW = datetime(2026, 5, 14, 13, 47, 12, tzinfo=TZ)
+
+
+class FixedDatetime(datetime):
+    """datetime with now() pinned to NOW (naive local, like datetime.now())"""
+
+    @classmethod
+    def now(cls, tz=None):
+        return NOW.astimezone(tz) if tz else NOW.replace(tzinfo=None)
+
+
+def get_current_time():
+    return NOW
+
+
+def legacy_user_attendance_stats(db, user_id: int, days: int = 30):
+    """Day-by-day implementation this replaced (reference for the expected numbers)"""
+    datetime = FixedDatetime
+    end_date = get_current_time()
+    start_date = end_date - timedelta(days=days)
+
+    user_group_ids = [g[0] for g in db.query(user_groups.c.group_id).filter(user_groups.c.user_id == user_id).all()]
+
+    records = db.query(Attendance).filter(
+        Attendance.user_id == user_id,
+        Attendance.check_in_time >= start_date,
+        Attendance.check_in_time <= end_date
+    ).all()
+
+    present_count = len([r for r in records if r.status == "present"])
+    late_count = len([r for r in records if r.status == "late"])
+
+    expected_attendance_count = 0
+    current_check_date = start_date.date()
+    end_check_date = end_date.date()
+    now = datetime.now()
+
+    while current_check_date <= end_check_date:
+        day_of_week = current_check_date.weekday()
+        check_dt_start = datetime.combine(current_check_date, datetime.min.time())
+        check_dt_end = datetime.combine(current_check_date, datetime.max.time())
+
+        day_schedules = db.query(Schedule).filter(
+            and_(
+                Schedule.is_active == True,
+                Schedule.day_of_week == day_of_week,
+                or_(Schedule.effective_from.is_(None), Schedule.effective_from <= check_dt_end),
+                or_(Schedule.effective_to.is_(None), Schedule.effective_to >= check_dt_start),
+                or_(
+                    Schedule.group_id.in_(user_group_ids) if user_group_ids else Schedule.group_id.is_(None),
+                    Schedule.group_id.is_(None)
+                )
+            )
+        ).all()
+
+        for schedule in day_schedules:
+            schedule_end_dt = datetime.combine(current_check_date, schedule.end_time)
+            if schedule_end_dt > now:
+                continue
+
+            attended = any(
+                r.schedule_id == schedule.id and r.check_in_time.date() == current_check_date
+                for r in records
+            )
+            if not attended:
+                earliest = datetime.combine(current_check_date, schedule.start_time) - timedelta(minutes=30)
+                latest = datetime.combine(current_check_date, schedule.end_time)
+                for r in records:
+                    r_time = r.check_in_time
+                    local_earliest = earliest
+                    local_latest = latest
+                    if r_time.tzinfo is not None:
+                        if local_earliest.tzinfo is None:
+                            local_earliest = local_earliest.replace(tzinfo=r_time.tzinfo)
+                        if local_latest.tzinfo is None:
+                            local_latest = local_latest.replace(tzinfo=r_time.tzinfo)
+                    if local_earliest <= r_time <= local_latest:
+                        attended = True
+                        break
+
+            if not attended:
+                expected_attendance_count += 1
+
+        current_check_date += timedelta(days=1)
+
+    absent_count = expected_attendance_count
+    total_opportunities = present_count + late_count + absent_count
+    return {
+        "total_days": days,
+        "present": present_count,
+        "late": late_count,
+        "absent": absent_count,
+        "attendance_rate": round(((present_count + late_count) / total_opportunities) * 100, 2) if total_opportunities > 0 else 0
+    }
+
+
+@pytest.fixture
+def db(monkeypatch):
+    monkeypatch.setattr(attendance_module, "get_current_time", get_current_time)
+    monkeypatch.setattr(attendance_module, "datetime", FixedDatetime)
+
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    populate(session, random.Random(7))
+    yield session
+    session.close()
+    engine.dispose()
+
+
+def populate(db, rng: random.Random):
+    groups = [Group(name=f"Group {i}", code=f"G-{i}") for i in range(4)]
+    users = [User(full_name=f"Student {i}", employee_id=f"S{i:03d}") for i in range(8)]
+    db.add_all(groups + users)
+    db.flush()
+
+    for user in users[1:]:  # The first user belongs to no group
+        user.groups = rng.sample(groups, rng.randint(1, 2))
+
+    schedules = []
+    for i in range(40):
+        start = time(rng.choice([0, 8, 9, 10, 12, 13, 14, 16, 23]), rng.choice([0, 10, 30, 45]))
+        length = timedelta(minutes=rng.choice([50, 80, 90]))
+        end = (datetime.combine(NOW.date(), start) + length).time()
+        effective_from = NOW.replace(tzinfo=None) - timedelta(days=rng.randint(0, 400)) if rng.random() < 0.3 else None
+        effective_to = NOW.replace(tzinfo=None) - timedelta(days=rng.randint(-30, 200)) if rng.random() < 0.3 else None
+        schedules.append(Schedule(
+            name=f"Lesson {i}",
+            day_of_week=rng.randint(0, 6),
+            start_time=start,
+            end_time=end,
+            group_id=rng.choice([None, None] + [g.id for g in groups]),
+            is_active=rng.random() < 0.9,
+            effective_from=effective_from,
+            effective_to=effective_to
+        ))
+    db.add_all(schedules)
+    db.flush()
+
+    for user in users:
+        for _ in range(rng.randint(0, 250)):
+            schedule = rng.choice(schedules)
+            day = NOW.date() - timedelta(days=rng.randint(0, 380))
+            if rng.random() < 0.7:
+                # Inside (or just around) the lesson's check-in window
+                check_in = datetime.combine(day, schedule.start_time) + timedelta(minutes=rng.randint(-40, 100))
+            else:
+                check_in = datetime.combine(day, time(rng.randint(0, 23), rng.randint(0, 59)))
+            check_in = check_in.replace(tzinfo=TZ)
+            db.add(Attendance(
+                user_id=user.id,
+                schedule_id=schedule.id if rng.random() < 0.8 else None,
+                check_in_time=check_in,
+                last_seen_time=check_in,
+                confidence=0.8,
+                status=rng.choice(["present", "present", "late"]),
+                detection_count=1
+            ))
+    db.commit()
+
+
+@pytest.mark.parametrize("days", [1, 7, 30, 90, 365])
+def test_matches_legacy_implementation(db, days):
+    for user in db.query(User).all():
+        expected = legacy_user_attendance_stats(db, user.id, days)
+        assert AttendanceService.get_user_attendance_stats(db, user.id, days) == expected, (user.id, days)
+
+
+def test_unknown_user(db):
+    assert AttendanceService.get_user_attendance_stats(db, 9999, 30) == legacy_user_attendance_stats(db, 9999, 30)
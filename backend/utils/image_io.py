@@ -0,0 +1,173 @@
+"""
+Image input helpers: size-capped upload reading, stored file naming and
+reduced-resolution decoding
+"""
+import numpy as np
+import cv2
+import hashlib
+from datetime import datetime
+from typing import Optional, Tuple
+from fastapi import HTTPException, UploadFile, status
+from config import settings
+
+READ_CHUNK_SIZE = 64 * 1024
+SPOOL_CHUNK_SIZE = 1024 * 1024
+
+# cv2.imdecode flags that let libjpeg scale the DCT instead of decoding full size
+REDUCED_COLOR_FLAGS = {
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+# JPEG start-of-frame markers (baseline, progressive, ...) - not DHT/JPG/DAC
+SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+async def read_upload(file: UploadFile, max_size: Optional[int] = None) -> bytes:
+    """
+    Read an uploaded file in chunks, stopping as soon as it exceeds max_size
+
+    Raises:
+        HTTPException 413: If the file is larger than max_size (default MAX_UPLOAD_SIZE)
+    """
+    max_size = max_size or settings.MAX_UPLOAD_SIZE
+    size = getattr(file, "size", None)
+    if size is not None and size > max_size:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"Upload exceeds {max_size} bytes"
+        )
+
+    chunks = []
+    total = 0
+    while True:
+        chunk = await file.read(READ_CHUNK_SIZE)
+        if not chunk:
+            break
+        total += len(chunk)
+        if total > max_size:
+            raise HTTPException(
+                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                detail=f"Upload exceeds {max_size} bytes"
+            )
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+async def spool_upload(file: UploadFile, target, max_size: int):
+    """
+    Copy an uploaded file into target (a binary file object) without
+    blocking the event loop: chunks are read asynchronously and written
+    from the threadpool
+
+    Raises:
+        HTTPException 413: If the file is larger than max_size
+    """
+    from starlette.concurrency import run_in_threadpool
+
+    total = 0
+    while True:
+        chunk = await file.read(SPOOL_CHUNK_SIZE)
+        if not chunk:
+            break
+        total += len(chunk)
+        if total > max_size:
+            raise HTTPException(
+                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                detail=f"Upload exceeds {max_size} bytes"
+            )
+        await run_in_threadpool(target.write, chunk)
+
+
+def image_extension(contents: bytes) -> str:
+    """File extension matching the encoded bytes (stored as uploaded, no re-encode)"""
+    if contents[:3] == b"\xff\xd8\xff":
+        return ".jpg"
+    if contents[:8] == b"\x89PNG\r\n\x1a\n":
+        return ".png"
+    if contents[:4] == b"RIFF" and contents[8:12] == b"WEBP":
+        return ".webp"
+    if contents[:2] == b"BM":
+        return ".bmp"
+    return ".jpg"
+
+
+def stored_image_name(prefix: str, contents: bytes, when: Optional[datetime] = None) -> str:
+    """
+    Deterministic file name for an uploaded image
+
+    <prefix>_<YYYYmmdd_HHMMSS>_<content hash><ext>: the same bytes at the same
+    second always map to the same file, so the path can be recorded before
+    the file is written.
+    """
+    when = when or datetime.now()
+    digest = hashlib.sha1(contents).hexdigest()[:8]
+    return f"{prefix}_{when.strftime('%Y%m%d_%H%M%S')}_{digest}{image_extension(contents)}"
+
+
+def jpeg_size(contents: bytes) -> Optional[Tuple[int, int]]:
+    """(width, height) from the JPEG frame header, None if not a JPEG"""
+    if len(contents) < 4 or contents[0] != 0xFF or contents[1] != 0xD8:
+        return None
+
+    offset = 2
+    length = len(contents)
+    while offset + 4 <= length:
+        if contents[offset] != 0xFF:
+            return None
+        marker = contents[offset + 1]
+        if marker == 0xFF:  # Fill byte
+            offset += 1
+            continue
+        if marker in (0x01, 0xD8) or 0xD0 <= marker <= 0xD7:  # No length field
+            offset += 2
+            continue
+        segment_length = int.from_bytes(contents[offset + 2:offset + 4], "big")
+        if marker in SOF_MARKERS:
+            if offset + 9 > length:
+                return None
+            height = int.from_bytes(contents[offset + 5:offset + 7], "big")
+            width = int.from_bytes(contents[offset + 7:offset + 9], "big")
+            return width, height
+        if marker in (0xD9, 0xDA):  # End of image / start of scan before any frame header
+            return None
+        offset += 2 + segment_length
+    return None
+
+
+def reduction_factor(width: int, height: int, min_side: int) -> int:
+    """Largest DCT scale (1, 2, 4 or 8) that keeps the long side at least min_side"""
+    if min_side <= 0:
+        return 1
+    long_side = max(width, height)
+    for factor in (8, 4, 2):
+        if long_side // factor >= min_side:
+            return factor
+    return 1
+
+
+def decode_image(contents: bytes, min_side: Optional[int] = None) -> Optional[np.ndarray]:
+    """
+    Decode an uploaded image as BGR
+
+    Large JPEGs are decoded at 1/2, 1/4 or 1/8 scale (libjpeg DCT scaling)
+    while the long side stays at least min_side (FACE_DECODE_MIN_SIDE), which
+    is plenty for the 320x320 detector and the 112x112 aligned crop.
+    Other formats are decoded at full size.
+
+    Returns:
+        Image, or None if the bytes are not a readable image
+    """
+    buffer = np.frombuffer(contents, np.uint8)
+    min_side = settings.FACE_DECODE_MIN_SIDE if min_side is None else min_side
+
+    size = jpeg_size(contents) if min_side > 0 else None
+    if size is not None:
+        factor = reduction_factor(size[0], size[1], min_side)
+        if factor > 1:
+            image = cv2.imdecode(buffer, REDUCED_COLOR_FLAGS[factor])
+            if image is not None:
+                return image
+
+    return cv2.imdecode(buffer, cv2.IMREAD_COLOR)
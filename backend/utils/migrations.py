@@ -34,6 +34,21 @@ def add_column_if_not_exists(engine: Engine, table_name: str, column_name: str,
     else:
         logger.info(f"✅ Column '{column_name}' already exists in table '{table_name}'.")
 
+def has_unique_key(engine: Engine, table_name: str, column_names: list) -> bool:
+    """
+    True if a unique constraint or unique index covers exactly these columns
+    (under any name - create_all and a migration name them differently)
+    """
+    inspector = inspect(engine)
+    wanted = set(column_names)
+    for constraint in inspector.get_unique_constraints(table_name):
+        if set(constraint["column_names"]) == wanted:
+            return True
+    for index in inspector.get_indexes(table_name):
+        if index.get("unique") and set(index["column_names"]) == wanted:
+            return True
+    return False
+
 def migrate_users_table(engine: Engine):
     """
     Run all migrations for the users table
@@ -52,9 +67,125 @@ def migrate_users_table(engine: Engine):
     add_column_if_not_exists(engine, "users", "major", "VARCHAR(255)")
     add_column_if_not_exists(engine, "users", "faculty", "VARCHAR(255)")
 
+def migrate_faces_table(engine: Engine, model_name: str = None):
+    """
+    Run all migrations for the faces table
+    """
+    # Existing rows are raw float32 bytes
+    add_column_if_not_exists(engine, "faces", "embedding_codec", "VARCHAR(16)", "'float32'")
+    
+    # Untagged embeddings were produced by the model configured when the column was added
+    add_column_if_not_exists(engine, "faces", "model_name", "VARCHAR(64)")
+    if model_name:
+        with engine.connect() as conn:
+            try:
+                result = conn.execute(
+                    text("UPDATE faces SET model_name = :model WHERE model_name IS NULL"),
+                    {"model": model_name}
+                )
+                conn.commit()
+                if result.rowcount:
+                    logger.info(f"✅ Tagged {result.rowcount} face embeddings with model '{model_name}'.")
+            except Exception as e:
+                logger.error(f"❌ Error tagging face embeddings: {e}")
+                conn.rollback()
+
+def migrate_devices_table(engine: Engine):
+    """
+    Run all migrations for the devices table
+    """
+    add_column_if_not_exists(engine, "devices", "precropped_faces", "BOOLEAN", "FALSE")
+
 def migrate_schedules_table(engine: Engine):
     """
     Run all migrations for the schedules table
     """
     add_column_if_not_exists(engine, "schedules", "teacher", "VARCHAR(100)")
     add_column_if_not_exists(engine, "schedules", "room", "VARCHAR(50)")
+
+def _backfill_session_dates(conn) -> int:
+    """
+    Set session_date on existing rows: the date of the lesson occurrence, as
+    Timetable.session_date gives it for new check-ins (the next day for an
+    evening check-in to a lesson starting just after midnight)
+    """
+    from datetime import timedelta, timezone
+    from sqlalchemy import bindparam, select
+    from models.attendance import Attendance
+    from models.schedule import Schedule
+    from services.timetable import occurrence_date
+    
+    # Check-in times are Uzbekistan local time (see utils.get_current_time)
+    local_tz = timezone(timedelta(hours=5))
+    attendance = Attendance.__table__
+    schedules = {
+        row.id: row
+        for row in conn.execute(select(Schedule.id, Schedule.start_time, Schedule.end_time))
+    }
+    
+    updates = []
+    rows = conn.execute(select(attendance.c.id, attendance.c.schedule_id, attendance.c.check_in_time).where(
+        attendance.c.schedule_id.isnot(None), attendance.c.check_in_time.isnot(None)
+    ))
+    for row in rows:
+        check_in = row.check_in_time
+        if check_in.tzinfo is not None:
+            check_in = check_in.astimezone(local_tz).replace(tzinfo=None)
+        schedule = schedules.get(row.schedule_id)
+        session_date = occurrence_date(schedule, check_in) if schedule is not None else check_in.date()
+        updates.append({"row_id": row.id, "value": session_date})
+    
+    if updates:
+        conn.execute(
+            attendance.update().where(attendance.c.id == bindparam("row_id")).values(session_date=bindparam("value")),
+            updates
+        )
+    return len(updates)
+
+def migrate_attendance_table(engine: Engine):
+    """
+    Run all migrations for the attendance table
+    """
+    inspector = inspect(engine)
+    if not inspector.has_table("attendance"):
+        return  # Created with the constraint by create_all
+    
+    columns = [col['name'] for col in inspector.get_columns("attendance")]
+    add_column_if_not_exists(engine, "attendance", "session_date", "DATE")
+    
+    with engine.connect() as conn:
+        try:
+            if "session_date" not in columns:
+                count = _backfill_session_dates(conn)
+                logger.info(f"✅ Session dates set on {count} attendance rows.")
+                # Older duplicates of the same lesson stay, but only the first one gets the session key
+                result = conn.execute(text(
+                    "UPDATE attendance SET session_date = NULL "
+                    "WHERE session_date IS NOT NULL AND id NOT IN ("
+                    "SELECT MIN(id) FROM attendance WHERE session_date IS NOT NULL "
+                    "GROUP BY user_id, schedule_id, session_date)"
+                ))
+                if result.rowcount:
+                    logger.info(f"✅ {result.rowcount} duplicate attendance rows left without a session date.")
+            
+            conn.commit()
+        except Exception as e:
+            logger.error(f"❌ Error migrating attendance sessions: {e}")
+            conn.rollback()
+    
+    # Tables from create_all already have the key as a table constraint
+    if has_unique_key(engine, "attendance", ["user_id", "schedule_id", "session_date"]):
+        return
+    
+    with engine.connect() as conn:
+        try:
+            conn.execute(text(
+                "CREATE UNIQUE INDEX uq_attendance_session "
+                "ON attendance (user_id, schedule_id, session_date)"
+            ))
+            conn.commit()
+            logger.info("✅ Unique attendance session index created.")
+        except Exception as e:
+            # AttendanceService checks for the key and keeps using the legacy insert path
+            logger.error(f"❌ Error creating the attendance session index, attendance upserts disabled: {e}")
+            conn.rollback()